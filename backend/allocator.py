@@ -0,0 +1,193 @@
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models.models import db, ParkingSpot
+
+# Notes to me:
+# In-process free-spot allocator for /reserve. Every lot keeps its spot ids (sorted) and a
+# Python int used as a bitmap: bit i set <=> ids[i] is free. Picking N spots is a handful of
+# bit tricks instead of a `WHERE is_occupied = 0 ORDER BY id LIMIT N` scan of the lot.
+#
+# The DB stays the source of truth:
+#  - claimed bits are taken right away and given back if the session rolls back,
+#  - freed spots only become claimable after the session commits,
+#  - lots are (re)loaded from ParkingSpot on startup, lazily, or when a caller notices
+#    the bitmap is stale (another worker booked/released the spot).
+
+
+def lowest_free_policy(free_bits, quantity):
+    """Default policy: the N lowest free spots (same order as the old ORDER BY id)."""
+    positions = []
+    while free_bits and len(positions) < quantity:
+        low = free_bits & -free_bits
+        positions.append(low.bit_length() - 1)
+        free_bits ^= low
+    return positions if len(positions) == quantity else None
+
+
+def contiguous_policy(free_bits, quantity):
+    """N neighbouring spots (by id) or None if the lot has no run that long."""
+    starts = free_bits
+    for k in range(1, quantity):
+        starts &= free_bits >> k
+    if not starts:
+        return None
+    first = (starts & -starts).bit_length() - 1
+    return list(range(first, first + quantity))
+
+
+class _LotBitmap:
+    __slots__ = ('ids', 'index', 'free', 'generation')
+
+    def __init__(self, ids, free, generation):
+        self.ids = ids
+        self.index = {spot_id: pos for pos, spot_id in enumerate(ids)}
+        self.free = free
+        self.generation = generation
+
+
+class SpotAllocator:
+    def __init__(self):
+        self._lots = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.policies = {
+            'lowest': lowest_free_policy,
+            'contiguous': contiguous_policy,
+        }
+
+    def register_policy(self, name, fn):
+        """fn(free_bits, quantity) -> list of bit positions, or None if it can't serve the request."""
+        self.policies[name] = fn
+
+    # loading
+
+    def _build(self, rows):
+        ids = []
+        free = 0
+        for pos, (spot_id, is_occupied) in enumerate(rows):
+            ids.append(spot_id)
+            if not is_occupied:
+                free |= 1 << pos
+        self._generation += 1
+        return _LotBitmap(ids, free, self._generation)
+
+    def rebuild(self):
+        """Load every lot from the DB (startup)."""
+        rows = (
+            db.session.query(ParkingSpot.lot_id, ParkingSpot.id, ParkingSpot.is_occupied)
+            .order_by(ParkingSpot.lot_id, ParkingSpot.id)
+            .all()
+        )
+        grouped = {}
+        for lot_id, spot_id, is_occupied in rows:
+            grouped.setdefault(lot_id, []).append((spot_id, is_occupied))
+        with self._lock:
+            self._lots = {lot_id: self._build(lot_rows) for lot_id, lot_rows in grouped.items()}
+        return len(self._lots)
+
+    def reload_lot(self, lot_id):
+        rows = (
+            db.session.query(ParkingSpot.id, ParkingSpot.is_occupied)
+            .filter(ParkingSpot.lot_id == lot_id)
+            .order_by(ParkingSpot.id)
+            .all()
+        )
+        with self._lock:
+            self._lots[lot_id] = self._build(rows)
+
+    def _lot(self, lot_id):
+        lot = self._lots.get(lot_id)
+        if lot is None:
+            self.reload_lot(lot_id)
+            lot = self._lots[lot_id]
+        return lot
+
+    def free_count(self, lot_id):
+        return self._lot(lot_id).free.bit_count()
+
+    # allocation
+
+    def claim(self, lot_id, quantity, policy=None):
+        """
+        Take `quantity` free spot ids out of the bitmap (all or nothing).
+        Returns [] if the lot can't serve it. The claim is undone if the session rolls back.
+        """
+        lot = self._lot(lot_id)
+        fn = self.policies.get(policy or 'lowest', lowest_free_policy)
+        with self._lock:
+            positions = fn(lot.free, quantity)
+            if positions is None and fn is not lowest_free_policy:
+                # policy couldn't place it (e.g. no contiguous run) -> plain lowest-free
+                positions = lowest_free_policy(lot.free, quantity)
+            if not positions:
+                return []
+            for pos in positions:
+                lot.free &= ~(1 << pos)
+            ids = [lot.ids[pos] for pos in positions]
+
+        _pending()['claims'].append((lot_id, lot.generation, ids))
+        return ids
+
+    def unclaim(self, lot_id, ids):
+        """Give claimed ids back right away (caller decided not to use them)."""
+        ids = set(ids)
+        for claim in _pending()['claims']:
+            if claim[0] == lot_id:
+                claim[2][:] = [i for i in claim[2] if i not in ids]
+        self._set_free(lot_id, ids, None)
+
+    def forget(self, lot_id, ids):
+        """Claimed ids turned out to be occupied in the DB: keep them taken, even on rollback."""
+        ids = set(ids)
+        for claim in _pending()['claims']:
+            if claim[0] == lot_id:
+                claim[2][:] = [i for i in claim[2] if i not in ids]
+
+    def release(self, lot_id, ids):
+        """Spots freed in the current session; claimable once it commits."""
+        _pending()['freed'].append((lot_id, list(ids)))
+
+    def invalidate(self, lot_id):
+        """Lot was created/resized/moved: reload it from the DB after commit."""
+        _pending()['reload'].add(lot_id)
+
+    def _set_free(self, lot_id, ids, generation):
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is None or (generation is not None and lot.generation != generation):
+                return  # reloaded since -> already reflects the DB
+            for spot_id in ids:
+                pos = lot.index.get(spot_id)
+                if pos is not None:
+                    lot.free |= 1 << pos
+
+    # session hooks
+
+    def _after_commit(self, session):
+        pending = session.info.pop('spot_allocator', None)
+        if not pending:
+            return
+        for lot_id, ids in pending['freed']:
+            self._set_free(lot_id, ids, None)
+        with self._lock:
+            for lot_id in pending['reload']:
+                # reloaded lazily on next use, the session can't run queries here
+                self._lots.pop(lot_id, None)
+
+    def _after_rollback(self, session):
+        pending = session.info.pop('spot_allocator', None)
+        if not pending:
+            return
+        for lot_id, generation, ids in pending['claims']:
+            self._set_free(lot_id, ids, generation)
+
+
+def _pending():
+    return db.session.info.setdefault('spot_allocator', {'claims': [], 'freed': [], 'reload': set()})
+
+
+spot_allocator = SpotAllocator()
+
+event.listen(Session, 'after_commit', spot_allocator._after_commit)
+event.listen(Session, 'after_rollback', spot_allocator._after_rollback)
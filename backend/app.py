@@ -1,20 +1,35 @@
 import os
 import uuid
-from flask import Flask, request
+from flask import Flask, request, g
 from flask_cors import CORS
 from flask_security import Security, SQLAlchemyUserDatastore, hash_password
 from flask_security.utils import login_user as fs_login_user
+from flask_principal import Identity, identity_changed
 from flask_caching import Cache
 from flask_mail import Mail
 from celery import Celery
 from celery.schedules import crontab
 
 # models & blueprints
-from models.models import db, User, Role, ParkingLot
+from models.models import db, User, Role, ParkingSpot, Reservation, LotDailyStat
 from routes.auth import auth_bp
 from routes.admin import admin_bp
 from routes.users import user_bp
-from cache import cache
+from routes.ops import ops_bp
+from cache import cache, lot_cache, tiered_cache
+from broadcast import RedisBus, MemoryBus
+from occupancy_stream import occupancy_stream
+from compression import compressor
+from billing import billing_engine
+from dbprofile import database_uri, engine_options, engine_profile
+from occupancy import reconcile_occupancy, refresh_lot_occupancy
+from allocator import spot_allocator
+from rollups import backfill_daily_stats
+from archive import get_archive_lot
+from sync import change_version
+from migrations import run_migrations, check_query_plans
+from auth_cache import token_cache, TokenIdentity
+from hashing import password_hasher
 
 app = Flask(__name__)
 
@@ -23,20 +38,78 @@ app = Flask(__name__)
 # We scope CORS to /api/* to be strict and avoid exposing non-API endpoints.
 
 FRONTEND_ORIGIN = os.getenv('FRONTEND_ORIGIN', 'http://localhost:5173')
-CORS(app, resources={r"/api/*": {"origins": FRONTEND_ORIGIN}}, supports_credentials=True)
+# ETag is exposed so apiFetch can send it back as If-None-Match (see etags.py)
+CORS(app, resources={r"/api/*": {"origins": FRONTEND_ORIGIN}}, supports_credentials=True, expose_headers=['ETag'])
 
 # Database Config
+# parking.db by default; DATABASE_URL (e.g. postgresql://...) switches to a pooled server database.
+# SQLite gets the WAL/busy_timeout/BEGIN IMMEDIATE profile from dbprofile.py.
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'parking.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(basedir)
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_IMMEDIATE_WRITES'] = os.getenv('SQLITE_IMMEDIATE_WRITES', '1') == '1'
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_recycle=app.config['DB_POOL_RECYCLE'],
+    busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'],
+)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'super-secret-key')
 app.config['SECURITY_PASSWORD_SALT'] = os.getenv('SECURITY_PASSWORD_SALT', 'salt-key')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Bearer token auth: token -> user cache and stateless mode (no session cookie per API call)
+app.config['AUTH_TOKEN_STATELESS'] = os.getenv('AUTH_TOKEN_STATELESS', '1') == '1'
+app.config['AUTH_TOKEN_CACHE_SIZE'] = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 1024))
+app.config['AUTH_TOKEN_CACHE_TTL'] = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 60))
+
+# Password hashing pool (login/register/change-password), see hashing.py
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 4))
+app.config['PASSWORD_HASH_QUEUE_LIMIT'] = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', 16))
+app.config['PASSWORD_HASH_PER_CLIENT'] = int(os.getenv('PASSWORD_HASH_PER_CLIENT', 2))
+
 # --- MILESTONE 7: REDIS CACHE CONFIG ---
-app.config['CACHE_TYPE'] = 'RedisCache'
+app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'RedisCache')  # SimpleCache = no Redis (single worker)
 app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+# Per-lot versioned fragments (cache.lot_cache): how long a fragment may live without a version bump
+app.config['LOT_CACHE_TIMEOUT'] = int(os.getenv('LOT_CACHE_TIMEOUT', 300))
+# In-process L1 in front of Redis + circuit breaker (cache.TieredCache)
+app.config['LOT_CACHE_L1_SIZE'] = int(os.getenv('LOT_CACHE_L1_SIZE', 2048))
+app.config['LOT_CACHE_L1_TTL'] = float(os.getenv('LOT_CACHE_L1_TTL', 5))
+app.config['LOT_CACHE_BREAKER_FAILURES'] = int(os.getenv('LOT_CACHE_BREAKER_FAILURES', 3))
+app.config['LOT_CACHE_BREAKER_COOLDOWN'] = float(os.getenv('LOT_CACHE_BREAKER_COOLDOWN', 10))
+
+# Occupancy SSE stream (/api/stream/occupancy): replay buffer, keepalive and max connection length
+app.config['OCCUPANCY_STREAM_HISTORY'] = int(os.getenv('OCCUPANCY_STREAM_HISTORY', 1000))
+app.config['OCCUPANCY_STREAM_HEARTBEAT'] = float(os.getenv('OCCUPANCY_STREAM_HEARTBEAT', 15))
+app.config['OCCUPANCY_STREAM_MAX_SECONDS'] = float(os.getenv('OCCUPANCY_STREAM_MAX_SECONDS', 300))
+
+# Delta sync (/parking-lots?since=N): deletions are remembered this long, older clients resync fully
+app.config['SYNC_TOMBSTONE_DAYS'] = int(os.getenv('SYNC_TOMBSTONE_DAYS', 7))
+
+# /reserve: rounds of conditional spot claims before giving up with 409 (routes/users.py)
+app.config['RESERVE_CLAIM_ATTEMPTS'] = int(os.getenv('RESERVE_CLAIM_ATTEMPTS', 3))
+
+# Bulk release (releases.py): max ids per /release-spots or /parking-spots/release call
+app.config['BULK_RELEASE_MAX_ITEMS'] = int(os.getenv('BULK_RELEASE_MAX_ITEMS', 5000))
+
+# Live cost estimates (billing.py): /analytics prices active sessions as of the start of this bucket
+app.config['BILLING_ESTIMATE_BUCKET_SECONDS'] = int(os.getenv('BILLING_ESTIMATE_BUCKET_SECONDS', 60))
+
+# Response compression (compression.py): br/gzip above this many bytes; ETag'd bodies are kept compressed
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+app.config['COMPRESS_CACHE_BODIES'] = os.getenv('COMPRESS_CACHE_BODIES', '1').lower() in ('1', 'true', 'yes')
 
 # --- MILESTONE 8: MAILHOG CONFIG ---
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'localhost')
@@ -45,9 +118,62 @@ app.config['MAIL_USE_TLS'] = False
 app.config['MAIL_USE_SSL'] = False
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'admin@parking.com')
 
+# Daily reminder fan-out (tasks.send_daily_reminder, see reminders.py)
+app.config['REMINDER_WINDOW_HOURS'] = int(os.getenv('REMINDER_WINDOW_HOURS', 20))
+app.config['REMINDER_CHUNK_SIZE'] = int(os.getenv('REMINDER_CHUNK_SIZE', 500))
+
+# Monthly report: above this many bookings the detail list is attached as .csv.gz instead of inlined
+app.config['MONTHLY_REPORT_INLINE_ROWS'] = int(os.getenv('MONTHLY_REPORT_INLINE_ROWS', 500))
+
 # Initialize Extensions
 db.init_app(app)
+with app.app_context():
+    engine_profile.configure_engine(
+        db.engine,
+        busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'],
+        synchronous=app.config['SQLITE_SYNCHRONOUS'],
+        cache_size_kb=app.config['SQLITE_CACHE_SIZE_KB'],
+        mmap_size=app.config['SQLITE_MMAP_SIZE'],
+        immediate_writes=app.config['SQLITE_IMMEDIATE_WRITES'],
+    )
 cache.init_app(app)
+lot_cache.configure(timeout=app.config['LOT_CACHE_TIMEOUT'])
+# Cross-worker pub/sub (broadcast.py): Redis when the cache is Redis, in-process otherwise
+bus = RedisBus(app.config['CACHE_REDIS_URL']) if app.config['CACHE_TYPE'] == 'RedisCache' else MemoryBus()
+tiered_cache.configure(
+    maxsize=app.config['LOT_CACHE_L1_SIZE'],
+    ttl=app.config['LOT_CACHE_L1_TTL'],
+    failure_threshold=app.config['LOT_CACHE_BREAKER_FAILURES'],
+    cooldown=app.config['LOT_CACHE_BREAKER_COOLDOWN'],
+    # L1 invalidations go to the other workers over Redis pub/sub
+    bus=bus,
+)
+occupancy_stream.configure(
+    bus=bus,
+    history=app.config['OCCUPANCY_STREAM_HISTORY'],
+    heartbeat=app.config['OCCUPANCY_STREAM_HEARTBEAT'],
+    max_seconds=app.config['OCCUPANCY_STREAM_MAX_SECONDS'],
+)
+compressor.configure(
+    min_size=app.config['COMPRESS_MIN_SIZE'],
+    gzip_level=app.config['COMPRESS_GZIP_LEVEL'],
+    brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+    cache_bodies=app.config['COMPRESS_CACHE_BODIES'],
+    cache_timeout=app.config['LOT_CACHE_TIMEOUT'],
+)
+compressor.init_app(app)
+billing_engine.configure(estimate_bucket_seconds=app.config['BILLING_ESTIMATE_BUCKET_SECONDS'])
+token_cache.configure(
+    maxsize=app.config['AUTH_TOKEN_CACHE_SIZE'],
+    ttl=app.config['AUTH_TOKEN_CACHE_TTL'],
+    # logout / password / role changes reach the other workers' token caches
+    bus=bus,
+)
+password_hasher.configure(
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    queue_limit=app.config['PASSWORD_HASH_QUEUE_LIMIT'],
+    per_client=app.config['PASSWORD_HASH_PER_CLIENT'],
+)
 mail = Mail(app)
 
 # --- CELERY CONFIG  ---
@@ -72,6 +198,10 @@ celery.conf.update(
             'task': 'tasks.generate_monthly_report',
             'schedule': crontab(minute='*/2'),  # Every 2 mins for testing
         },
+        'prune-sync-tombstones': {
+            'task': 'tasks.prune_sync_tombstones',
+            'schedule': crontab(minute=30, hour=3),
+        },
     }
 )
 
@@ -97,6 +227,11 @@ def _accept_bearer_token_for_api():
     This accept Authorization: Bearer <fs_uniquifier> for SPA requests.
     Looks up User.fs_uniquifier and logs them in (request context only).
     Runs ONLY for routes under /api to avoid interfering with other endpoints.
+    The token -> identity mapping is cached (auth_cache.token_cache). In stateless mode
+    (AUTH_TOKEN_STATELESS, default on) the identity is only attached to this request,
+    so the session isn't touched and no Set-Cookie goes out with every poll. identity_changed
+    is still sent, as login_user does, so Flask-Principal loads the roles from TokenIdentity.roles
+    and roles_required/roles_accepted work the same in both modes.
     """
     # API requests
     if not request.path.startswith('/api'):
@@ -115,9 +250,24 @@ def _accept_bearer_token_for_api():
         return
 
     try:
-        user = UserModel.query.filter_by(fs_uniquifier=token).first()
-        if user:
-            fs_login_user(user, remember=False)
+        identity = token_cache.get(token)
+        user = None
+        if identity is None:
+            user = UserModel.query.filter_by(fs_uniquifier=token).first()
+            if not user:
+                return
+            identity = TokenIdentity(user)
+            token_cache.put(token, identity)
+
+        if not identity.is_active:
+            return
+
+        if app.config['AUTH_TOKEN_STATELESS']:
+            # what flask_login.current_user reads first -- request scoped, no session write
+            g._login_user = identity
+            identity_changed.send(app, identity=Identity(identity.fs_uniquifier))
+        else:
+            fs_login_user(user or db.session.get(UserModel, identity.id), remember=False)
     except Exception:
         # swallow exceptions so normal flows aren't broken
         return
@@ -145,12 +295,14 @@ def rotate_fs_uniquifier(user):
 app.register_blueprint(auth_bp, url_prefix='/api')
 app.register_blueprint(admin_bp, url_prefix='/api')
 app.register_blueprint(user_bp, url_prefix='/api')
+app.register_blueprint(ops_bp, url_prefix='/api/ops')
 
 
 # Create initial data and ensure admin gets an fs_uniquifier set
 def create_initial_data():
     with app.app_context():
         db.create_all()
+        run_migrations()  # indexes/columns create_all can't add to an existing parking.db
 
         # roles
         if not user_datastore.find_role('admin'):
@@ -181,19 +333,69 @@ def create_initial_data():
 #added this as safeguard to prevent archieve from going  green(fre spots show)       
 def repair_archive():
     with app.app_context():
-        archive = ParkingLot.query.filter_by(name="Deleted - Archived History").first()
+        archive = get_archive_lot()
         if archive:
-            print(f"Archive: Found {len(archive.spots)} spots.")
-            for spot in archive.spots:
-                spot.is_occupied = True # Force Red
+            spots = ParkingSpot.query.filter_by(lot_id=archive.id).count()
+            print(f"Archive: Found {spots} spots.")
+            # Force Red
+            ParkingSpot.query.filter_by(lot_id=archive.id).update(
+                {'is_occupied': True, 'change_version': change_version()}, synchronize_session=False
+            )
             
             # Fix capacity to match reality so the bar makes sense
-            archive.capacity = len(archive.spots) 
+            archive.capacity = spots
+            refresh_lot_occupancy(archive.id)
+            spot_allocator.invalidate(archive.id)
             
             db.session.commit()
+            lot_cache.bump(archive.id)
             # A All spots marked Occupied.
 
+# Rebuild the per-lot free/occupied counters from ParkingSpot.
+# Also available as: flask --app app reconcile-occupancy
+@app.cli.command('reconcile-occupancy')
+def reconcile_occupancy_command():
+    rebuilt = reconcile_occupancy()
+    lot_cache.bump_all()
+    print(f"Occupancy counters rebuilt for {rebuilt} lots.")
+
+
+# Rebuild the per-lot daily analytics rollups from the reservation history.
+# Also available as: flask --app app backfill-daily-stats  (or the tasks.backfill_daily_stats job)
+@app.cli.command('backfill-daily-stats')
+def backfill_daily_stats_command():
+    seen = backfill_daily_stats()
+    lot_cache.bump_all()
+    print(f"Daily stats rebuilt from {seen} reservations.")
+
+
+# Apply pending schema migrations (also done on startup).
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    db.create_all()
+    applied = run_migrations()
+    print(f"Applied migrations: {', '.join(applied) or 'none'}")
+
+
+# Fails (exit code 1) if a hot query would do a full table scan.
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    problems = check_query_plans()
+    for name, detail in problems.items():
+        print(f"FULL SCAN: {name}: {detail}")
+    if problems:
+        raise SystemExit(1)
+    print("All hot queries use an index.")
+
+
 if __name__ == '__main__':
     create_initial_data()
     repair_archive() # repair archieve called
+    with app.app_context():
+        reconcile_occupancy()
+        spot_allocator.rebuild()  # free-spot bitmaps for /reserve
+        # first run on an older database: build the analytics rollups once
+        if not LotDailyStat.query.first() and Reservation.query.first():
+            backfill_daily_stats()
+        lot_cache.bump_all()  # counters/rollups may have been rebuilt above
     app.run(debug=True)
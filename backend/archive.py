@@ -0,0 +1,70 @@
+import time
+from sqlalchemy import update, delete, func, literal
+from models.models import db, ParkingLot, ParkingSpot
+from occupancy import init_lot_occupancy, adjust_lot_occupancy
+from rollups import move_lot_stats
+from allocator import spot_allocator
+from sync import change_version, tombstone_spots
+
+# Notes to me:
+# The archive is the one lot flagged is_archive: deleted lots with reservation history hand
+# their spots over to it so old reservations/analytics keep pointing somewhere.
+# Nothing here commits -- delete_parking_lot runs the whole move + delete as ONE transaction,
+# so a failure can't leave a lot half-archived.
+
+ARCHIVE_NAME = "Deleted - Archived History"
+
+
+def get_archive_lot(create=False):
+    archive = ParkingLot.query.filter_by(is_archive=True).first()
+    if archive is None and create:
+        archive = ParkingLot(
+            name=ARCHIVE_NAME,
+            address="Deleted Data Storage",
+            pin_code="000000",
+            capacity=0,
+            price_per_hour=0.0,
+            is_archive=True,
+        )
+        db.session.add(archive)
+        db.session.flush()
+        init_lot_occupancy(archive.id, free_spots=0)
+    return archive
+
+
+def archive_lot_spots(lot, archive):
+    """
+    Move every spot of `lot` into the archive with one UPDATE. Spots are renamed
+    "<lot name[:5]>_<spot number>_<unix time>" (cut to 20 chars, same as before) and stay occupied
+    (red) for good. Returns how many spots moved.
+    """
+    suffix = str(int(time.time()))
+    version = change_version()
+    new_number = func.substr(
+        literal(f"{lot.name[:5]}_") + ParkingSpot.spot_number + literal(f"_{suffix}"), 1, 20
+    )
+    moved = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.lot_id == lot.id)
+        .values(lot_id=archive.id, spot_number=new_number, is_occupied=True, change_version=version)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    db.session.execute(
+        update(ParkingLot).where(ParkingLot.id == archive.id)
+        .values(capacity=ParkingLot.capacity + moved, change_version=version)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_lot_occupancy(archive.id, occupied_delta=moved, free_delta=0)
+    move_lot_stats(lot.id, archive.id)
+    spot_allocator.invalidate(archive.id)
+    return moved
+
+
+def drop_lot_spots(lot):
+    """Lot without any history: its spots can simply go (one DELETE, no ORM cascade)."""
+    tombstone_spots(ParkingSpot.lot_id == lot.id)
+    db.session.execute(
+        delete(ParkingSpot).where(ParkingSpot.lot_id == lot.id)
+        .execution_options(synchronize_session=False)
+    )
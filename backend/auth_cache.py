@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models.models import User
+
+# Notes to me:
+# Bounded LRU + TTL cache of Bearer token (fs_uniquifier) -> user identity, used by the
+# /api auth middleware in app.py so a dashboard poll doesn't look the user up every time.
+# Each worker keeps its own entries. Invalidation below is immediate in the worker that made the
+# change; once that change commits, the user id goes out on the bus (broadcast.py, like cache.py's
+# L1 invalidations) and every other worker drops the user's entries too. Publishing before commit
+# would let another worker re-read and re-cache the old row. The TTL is the safety net for a lost
+# message.
+# TokenIdentity carries a snapshot of the user's roles (TokenRole), so Flask-Security's identity
+# loader can build the same RoleNeeds from it as from a User row -- see the middleware in app.py.
+
+log = logging.getLogger(__name__)
+
+
+class TokenRole:
+    """A role as the identity loader sees it: its name and permissions."""
+
+    def __init__(self, role):
+        self.name = role.name
+        self.permissions = frozenset(role.get_permissions())
+
+    def get_permissions(self):
+        return self.permissions
+
+
+class TokenIdentity(UserMixin):
+    """What the middleware knows about the caller -- enough for current_user, has_role and roles_required."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.username = user.username
+        self.fs_uniquifier = user.fs_uniquifier
+        self.active = bool(user.active)
+        self.roles = tuple(TokenRole(role) for role in user.roles)
+        self.role_names = tuple(role.name for role in self.roles)
+
+    @property
+    def is_active(self):
+        return self.active
+
+    def get_id(self):
+        return self.fs_uniquifier
+
+    def has_role(self, role):
+        return getattr(role, 'name', role) in self.role_names
+
+
+class TokenCache:
+    CHANNEL = 'auth:invalidate'
+
+    def __init__(self, maxsize=1024, ttl=60, bus=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bus = bus
+        self._entries = OrderedDict()  # token -> (expires_at, identity)
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex
+        self._listening_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    def configure(self, maxsize=None, ttl=None, bus=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            if bus is not None:
+                self.bus = bus
+                self._listening_pid = None
+
+    def get(self, token):
+        self._listen()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token, identity):
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_token(self, token):
+        with self._lock:
+            if self._entries.pop(token, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id, broadcast=False):
+        """Drop the user's entries here; with broadcast=True in every other worker as well."""
+        with self._lock:
+            stale = [t for t, (_, ident) in self._entries.items() if ident.id == user_id]
+            for token in stale:
+                del self._entries[token]
+            self.invalidations += len(stale)
+        if broadcast:
+            self._broadcast(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # cross-worker invalidation
+
+    def _node(self):
+        return f'{os.getpid()}-{self._token}'
+
+    def _listen(self):
+        # lazily, in the worker process itself (a thread started before a fork doesn't survive it)
+        if self.bus is None or self._listening_pid == os.getpid():
+            return
+        self._listening_pid = os.getpid()
+        try:
+            self.bus.subscribe(self.CHANNEL, self._on_invalidate, on_reconnect=self.clear)
+        except Exception:
+            log.warning("could not subscribe to %s", self.CHANNEL, exc_info=True)
+            self._listening_pid = None
+
+    def _on_invalidate(self, message):
+        sender, _, user_id = message.partition('|')
+        if sender == self._node() or not user_id.isdigit():
+            return
+        self.invalidate_user(int(user_id))
+        with self._lock:
+            self.invalidations_received += 1
+
+    def _broadcast(self, user_id):
+        if self.bus is None:
+            return
+        self._listen()
+        try:
+            self.bus.publish(self.CHANNEL, f'{self._node()}|{user_id}')
+            with self._lock:
+                self.invalidations_sent += 1
+        except Exception:
+            log.warning("could not broadcast token invalidation", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'invalidations_sent': self.invalidations_sent,
+                'invalidations_received': self.invalidations_received,
+                'bus': type(self.bus).__name__ if self.bus is not None else None,
+            }
+
+
+token_cache = TokenCache()
+
+
+# Invalidation: anything that changes who a token belongs to or what it may do.
+# Attribute events fire wherever the change is made (rotate_fs_uniquifier, change_password,
+# user_datastore role helpers, ...), a bit before commit: this worker drops its entries right away
+# (that only costs a cache miss) and the user id is kept in session.info until the commit, which
+# tells the other workers.
+
+def _note_stale(target):
+    token_cache.invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('token_cache_stale', set()).add(target.id)
+
+
+@event.listens_for(User.fs_uniquifier, 'set')
+def _token_rotated(target, value, oldvalue, initiator):
+    if isinstance(oldvalue, str):
+        token_cache.invalidate_token(oldvalue)
+    if target.id is not None:
+        _note_stale(target)
+
+
+@event.listens_for(User.password, 'set')
+@event.listens_for(User.active, 'set')
+def _credentials_changed(target, value, oldvalue, initiator):
+    if target.id is not None:
+        _note_stale(target)
+
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _roles_changed(target, value, initiator):
+    if target.id is not None:
+        _note_stale(target)
+
+
+def _after_commit(session):
+    for user_id in session.info.pop('token_cache_stale', ()):
+        token_cache.invalidate_user(user_id, broadcast=True)
+
+
+def _after_rollback(session):
+    session.info.pop('token_cache_stale', None)
+
+
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
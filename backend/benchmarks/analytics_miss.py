@@ -0,0 +1,148 @@
+"""
+/analytics when the fragment cache misses, at 10, 100 and 1000 lots:
+  - old loop:     two global counts, then an occupied COUNT and a revenue SUM per lot (2N+3 queries),
+  - all missed:   every lot_summary fragment rebuilt (lot_cache.bump_all -- deploy, reconcile),
+  - one lot:      only the lot a booking touched rebuilt (what a reserve/release leaves behind).
+
+    cd backend && python benchmarks/analytics_miss.py [lot counts...]
+
+Runs the real admin blueprint on a temporary SQLite file with an in-process SimpleCache, no
+Accept-Encoding (so stored compressed bodies stay out of it). Every lot has SPOTS_PER_LOT spots
+and closed reservations; a third of the spots are occupied.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event, func, insert  # noqa: E402
+from models.models import db, User, ParkingLot, ParkingSpot, Reservation, LotOccupancy  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+from cache import cache, lot_cache  # noqa: E402
+
+SPOTS_PER_LOT = 20
+RESERVATIONS_PER_LOT = 60
+ROUNDS = 15
+
+
+def make_app(uri):
+    from routes.admin import admin_bp
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    cache.init_app(app, config={'CACHE_TYPE': 'SimpleCache'})
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    app.register_blueprint(admin_bp, url_prefix='/api')
+    return app
+
+
+def setup(lots):
+    rng = random.Random(42)
+    db.create_all()
+    db.session.add(User(email='bench@x', username='bench', password='x', fs_uniquifier='bench'))
+    db.session.execute(insert(ParkingLot.__table__), [
+        {'name': f'Lot {n}', 'address': 'x', 'pin_code': '000000', 'price_per_hour': 10,
+         'capacity': SPOTS_PER_LOT, 'is_archive': False}
+        for n in range(lots)
+    ])
+    lot_ids = [row[0] for row in db.session.query(ParkingLot.id).order_by(ParkingLot.id)]
+    db.session.execute(insert(ParkingSpot.__table__), [
+        {'spot_number': f'LOT-{i}', 'lot_id': lot_id, 'is_occupied': i % 3 == 0}
+        for lot_id in lot_ids for i in range(1, SPOTS_PER_LOT + 1)
+    ])
+    db.session.execute(insert(LotOccupancy.__table__), [
+        {'lot_id': lot_id, 'occupied_spots': SPOTS_PER_LOT // 3,
+         'free_spots': SPOTS_PER_LOT - SPOTS_PER_LOT // 3}
+        for lot_id in lot_ids
+    ])
+    spots = db.session.query(ParkingSpot.id).all()
+    started = datetime(2024, 1, 1)
+    db.session.execute(insert(Reservation.__table__), [
+        {'user_id': 1, 'spot_id': rng.choice(spots)[0], 'start_time': started,
+         'end_time': started + timedelta(hours=2), 'total_cost': 20.0, 'active': False}
+        for _ in range(lots * RESERVATIONS_PER_LOT)
+    ])
+    db.session.commit()
+    return lot_ids
+
+
+def old_analytics():
+    """The per-lot loop /analytics used to run on a miss."""
+    total_spots = ParkingSpot.query.count()
+    total_revenue = db.session.query(func.sum(Reservation.total_cost)).scalar() or 0.0
+    summary = []
+    for lot in ParkingLot.query.all():
+        occupied = ParkingSpot.query.filter_by(lot_id=lot.id, is_occupied=True).count()
+        revenue = (
+            db.session.query(func.sum(Reservation.total_cost))
+            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+            .filter(ParkingSpot.lot_id == lot.id)
+            .scalar() or 0.0
+        )
+        summary.append({'id': lot.id, 'occupied': occupied, 'total_revenue': revenue})
+    return total_spots, total_revenue, summary
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def measure(fn, before):
+    counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    samples = []
+    try:
+        for _ in range(ROUNDS):
+            before()
+            counter.count = 0
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+            db.session.remove()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter)
+    return statistics.median(samples), counter.count
+
+
+def run(lots):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        app = make_app('sqlite:///' + os.path.join(tmp, 'analytics.db'))
+        client = app.test_client()
+
+        def get():
+            response = client.get('/api/analytics')
+            assert response.status_code == 200, response.status_code
+
+        with app.app_context():
+            lot_ids = setup(lots)
+            get()  # index + fragments warm
+            rows = [
+                ('old loop', *measure(old_analytics, lambda: None)),
+                ('all missed', *measure(get, lot_cache.bump_all)),
+                ('one lot', *measure(get, lambda: lot_cache.bump(lot_ids[0]))),
+            ]
+            db.engine.dispose()
+    for name, elapsed, queries in rows:
+        print(f"{lots:>6}  {name:<12}{elapsed * 1000:>10.2f}{queries:>9}")
+
+
+def main(counts=(10, 100, 1000)):
+    print(f"{'lots':>6}  {'path':<12}{'p50 ms':>10}{'queries':>9}")
+    for lots in counts:
+        run(lots)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (10, 100, 1000))
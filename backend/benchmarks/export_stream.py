@@ -0,0 +1,116 @@
+"""
+CSV export of one user's history: the old in-memory export vs the streamed one (exports.py).
+  - old:            Reservation.query...all(), r.spot.parking_lot per row, csv into a StringIO,
+  - streamed:       history_rows (one joined yield_per query) -> iter_csv, chunks thrown away
+                    (what the /export-csv/download response does),
+  - streamed+gzip:  the same through iter_gzip into exports.spool (the emailed export).
+
+    cd backend && python benchmarks/export_stream.py [reservation counts...]
+
+Peak Python memory is measured with tracemalloc (which slows everything down, so timings are
+relative). The streamed peaks should stay flat whatever the history size; try 1000000.
+"""
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from models.models import db, User, ParkingLot, ParkingSpot, Reservation  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+from exports import CSV_HEADER, history_rows, iter_csv, iter_gzip, spool  # noqa: E402
+
+SPOTS = 50
+INSERT_BATCH = 50000
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    return app
+
+
+def setup(reservations):
+    db.create_all()
+    user = User(email='bench@x', username='bench', password='x', fs_uniquifier='bench')
+    lot = ParkingLot(name='Bench', address='x', pin_code='000000', price_per_hour=10, capacity=SPOTS)
+    db.session.add_all([user, lot])
+    db.session.flush()
+    db.session.execute(insert(ParkingSpot.__table__), [
+        {'spot_number': f'BEN-{i}', 'lot_id': lot.id, 'is_occupied': False} for i in range(1, SPOTS + 1)
+    ])
+    spot_ids = [row[0] for row in db.session.query(ParkingSpot.id)]
+    started = datetime(2020, 1, 1)
+    for first in range(0, reservations, INSERT_BATCH):
+        db.session.execute(insert(Reservation.__table__), [
+            {'user_id': user.id, 'spot_id': spot_ids[n % SPOTS],
+             'start_time': started + timedelta(hours=n), 'end_time': started + timedelta(hours=n, minutes=90),
+             'total_cost': 15.0, 'active': False}
+            for n in range(first, min(first + INSERT_BATCH, reservations))
+        ])
+    db.session.commit()
+    return user.id
+
+
+def old_export(user_id):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    for r in Reservation.query.filter_by(user_id=user_id).all():
+        writer.writerow([r.id, r.spot.parking_lot.name, r.spot.spot_number, r.start_time, r.end_time,
+                         r.total_cost, "Active" if r.active else "Completed"])
+    return len(output.getvalue().encode('utf-8'))
+
+
+def streamed(user_id):
+    return sum(len(chunk) for chunk in iter_csv(history_rows(user_id)))
+
+
+def streamed_gzip(user_id):
+    with spool(iter_gzip(iter_csv(history_rows(user_id)))) as output:
+        output.seek(0, os.SEEK_END)
+        return output.tell()
+
+
+def measure(fn, user_id):
+    db.session.remove()
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = fn(user_id)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return elapsed, peak, size
+
+
+def run(reservations):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        app = make_app('sqlite:///' + os.path.join(tmp, 'export.db'))
+        with app.app_context():
+            user_id = setup(reservations)
+            for name, fn in (('old', old_export), ('streamed', streamed), ('streamed+gzip', streamed_gzip)):
+                elapsed, peak, size = measure(fn, user_id)
+                print(f"{reservations:>9}  {name:<15}{elapsed:>9.2f}{peak / 2**20:>12.1f}{size / 2**20:>11.1f}")
+            db.engine.dispose()
+
+
+def main(counts=(10000, 100000)):
+    print(f"{'rows':>9}  {'export':<15}{'seconds':>9}{'peak MiB':>12}{'out MiB':>11}")
+    for count in counts:
+        run(count)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (10000, 100000))
@@ -0,0 +1,66 @@
+"""
+Pricing N active sessions: row-by-row datetime math (what the views used to do) vs
+billing_engine.price_sessions, with and without NumPy.
+
+    cd backend && python benchmarks/live_billing.py [sessions]
+
+Also checks that all three give the same cents as billing_engine.session_cost, the final bill.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billing  # noqa: E402
+from billing import billing_engine  # noqa: E402
+
+
+def row_by_row(start_times, rates, now):
+    out = []
+    for start, rate in zip(start_times, rates):
+        start = start.replace(tzinfo=timezone.utc)
+        hours = max(1, (now - start).total_seconds() / 3600.0)
+        out.append(round(hours * float(rate or 0.0), 2))
+    return out
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(sessions=100000):
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    start_times = [now.replace(tzinfo=None) - timedelta(seconds=rng.uniform(0, 3 * 86400)) for _ in range(sessions)]
+    rates = [rng.choice((10, 20, 35.5, 49.99)) for _ in range(sessions)]
+
+    reference = [billing_engine.session_cost(s, now, r) for s, r in zip(start_times, rates)]
+    print(f"{sessions} active sessions")
+    t, old = timed(lambda: row_by_row(start_times, rates, now))
+    print(f"{'row by row':<22}{t * 1000:>9.1f} ms")
+
+    numpy = billing.np
+    if numpy is not None:
+        t, (_, costs) = timed(lambda: billing_engine.price_sessions(start_times, rates, now=now))
+        print(f"{'price_sessions numpy':<22}{t * 1000:>9.1f} ms   same cents: {costs == reference}")
+    billing.np = None
+    try:
+        t, (_, costs) = timed(lambda: billing_engine.price_sessions(start_times, rates, now=now))
+        print(f"{'price_sessions python':<22}{t * 1000:>9.1f} ms   same cents: {costs == reference}")
+    finally:
+        billing.np = numpy
+    diffs = sum(1 for a, b in zip(old, reference) if a != b)
+    print(f"old round(x, 2) differs from the bill on {diffs} sessions")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,178 @@
+"""
+Daily reminder run over N users against a local SMTP stand-in:
+  - old:     User.query.all(), roles lazy-loaded per user for the admin check, one Reservation
+             query per user, one SMTP connection per mail,
+  - chunked: reminders.reminder_candidates (one anti-join query per chunk of ids), each chunk
+             claimed (claim_reminders) and mailed over one SMTP connection by WORKERS threads
+             standing in for the send_reminder_batch celery tasks. A second run right after must
+             mail nobody (last_reminded_at window).
+
+    cd backend && python benchmarks/reminders_fanout.py [users]
+
+The SMTP stand-in accepts and drops everything; a fifth of the users have an active booking and
+every 50th is an admin. At the default 100k users the old run alone takes several minutes.
+"""
+import os
+import smtplib
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from models.models import db, User, Role, ParkingLot, ParkingSpot, Reservation, roles_users  # noqa: E402
+from dbprofile import engine_options, engine_profile, immediate_transactions  # noqa: E402
+from reminders import reminder_candidates, claim_reminders  # noqa: E402
+
+WORKERS = 4
+CHUNK_SIZE = 500
+INSERT_BATCH = 50000
+
+
+class _SMTPSink(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: every command gets a 250, DATA is read and dropped."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reply('220 sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.delivered += 1
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            elif command == b'EHLO':
+                self.reply('250 sink')
+            else:
+                self.reply('250 ok')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPSink)
+        self.delivered = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def _message(email, username):
+    msg = EmailMessage()
+    msg['Subject'] = "Need Parking Tomorrow?"
+    msg['From'] = 'noreply@parking.local'
+    msg['To'] = email
+    msg.set_content(f"Hi {username},\n\nYou don't have a spot booked. Log in now to reserve one!")
+    return msg
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri, pool_size=WORKERS + 1)
+    db.init_app(app)
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    return app
+
+
+def setup(users):
+    db.create_all()
+    db.session.add(Role(name='admin'))
+    lot = ParkingLot(name='Bench', address='x', pin_code='000000', price_per_hour=10, capacity=users // 5 + 1)
+    db.session.add(lot)
+    db.session.flush()
+    for first in range(0, users, INSERT_BATCH):
+        db.session.execute(insert(User.__table__), [
+            {'email': f'user{n}@bench', 'username': f'user{n}', 'password': 'x', 'fs_uniquifier': f'bench-{n}'}
+            for n in range(first, min(first + INSERT_BATCH, users))
+        ])
+    db.session.execute(insert(roles_users), [{'user_id': n, 'role_id': 1} for n in range(1, users + 1, 50)])
+    booked = list(range(3, users + 1, 5))
+    db.session.execute(insert(ParkingSpot.__table__), [
+        {'spot_number': f'BEN-{i}', 'lot_id': lot.id, 'is_occupied': True} for i in range(1, len(booked) + 1)
+    ])
+    spot_ids = [row[0] for row in db.session.query(ParkingSpot.id).order_by(ParkingSpot.id)]
+    db.session.execute(insert(Reservation.__table__), [
+        {'user_id': user_id, 'spot_id': spot_id, 'start_time': datetime.utcnow(), 'active': True}
+        for user_id, spot_id in zip(booked, spot_ids)
+    ])
+    db.session.commit()
+
+
+def old_run(port):
+    sent = 0
+    for user in User.query.all():
+        if any(role.name == 'admin' for role in user.roles):
+            continue
+        if Reservation.query.filter_by(user_id=user.id, active=True).first():
+            continue
+        with smtplib.SMTP('127.0.0.1', port, local_hostname='bench') as conn:
+            conn.send_message(_message(user.email, user.username))
+        sent += 1
+    return sent
+
+
+def chunked_run(app, port):
+    def batch(user_ids):
+        with app.app_context():
+            with immediate_transactions():
+                claimed = claim_reminders(user_ids)
+            if claimed:
+                with smtplib.SMTP('127.0.0.1', port, local_hostname='bench') as conn:
+                    for _, email, username in claimed:
+                        conn.send_message(_message(email, username))
+            db.session.remove()
+            return len(claimed)
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        futures = [pool.submit(batch, ids) for ids in reminder_candidates(chunk_size=CHUNK_SIZE)]
+        return sum(future.result() for future in futures)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main(users=100000):
+    sink = SMTPSink()
+    port = sink.server_address[1]
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        app = make_app('sqlite:///' + os.path.join(tmp, 'reminders.db'))
+        with app.app_context():
+            setup(users)
+            print(f"{users} users")
+            rows = [('old', *timed(old_run, port))]
+            db.session.remove()
+            rows.append(('chunked', *timed(chunked_run, app, port)))
+            rows.append(('chunked again', *timed(chunked_run, app, port)))
+            for name, elapsed, sent in rows:
+                print(f"{name:<15}{elapsed:>9.2f} s{sent:>9} mailed")
+            print(f"SMTP stand-in received {sink.delivered} messages")
+            db.engine.dispose()
+    sink.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
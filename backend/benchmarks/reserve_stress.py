@@ -0,0 +1,174 @@
+"""
+Concurrent /reserve + /release-spot stress run: checks there is never a double booking and reports
+reservations per second.
+
+    cd backend && python benchmarks/reserve_stress.py [seconds] [processes] [threads per process]
+
+Runs the real user/admin blueprints on a temporary SQLite file with the production engine profile
+(dbprofile.py). Every process is a separate "worker" with its own spot allocator, so they do pick
+the same candidate spots and have to lose the conditional claim. Lots are kept small so they run
+full and bookings keep colliding. Afterwards the invariants are checked against the database:
+  - no spot has more than one active reservation,
+  - occupied spots == spots with an active reservation,
+  - the per-lot free/occupied counters match the spot rows.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import func  # noqa: E402
+from models.models import db, User, ParkingSpot, Reservation, LotOccupancy  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+
+LOTS = 4
+SPOTS_PER_LOT = 12
+USERS = 50
+
+
+def make_app(uri):
+    from routes.admin import admin_bp
+    from routes.users import user_bp
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri, pool_size=16)
+    db.init_app(app)
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    app.register_blueprint(admin_bp, url_prefix='/api')
+    app.register_blueprint(user_bp, url_prefix='/api')
+    return app
+
+
+def setup(app):
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            User(email=f'user{n}@stress', username=f'user{n}', password='x', fs_uniquifier=f'stress-{n}')
+            for n in range(USERS)
+        )
+        db.session.commit()
+    client = app.test_client()
+    for n in range(LOTS):
+        client.post('/api/parking-lot', json={
+            'name': f'Stress {n}', 'address': 'x', 'pin_code': '000000',
+            'capacity': SPOTS_PER_LOT, 'price_per_hour': 10,
+        })
+
+
+def _client_loop(app, seconds, seed, results):
+    import threading  # noqa: F401  (threads are started by the caller)
+    rng = random.Random(seed)
+    client = app.test_client()
+    counts = {'reserved': 0, 'booked_spots': 0, 'released': 0, 'full': 0, 'conflict': 0, 'errors': 0}
+    mine = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if mine and (rng.random() < 0.45 or len(mine) > 6):
+            reservation_id = mine.pop(rng.randrange(len(mine)))
+            response = client.post('/api/release-spot', json={'reservation_id': reservation_id})
+            counts['released' if response.status_code == 200 else 'errors'] += 1
+            continue
+        response = client.post('/api/reserve', json={
+            'lot_id': rng.randrange(1, LOTS + 1),
+            'user_email': f'user{rng.randrange(USERS)}@stress',
+            'quantity': rng.choice((1, 1, 1, 2, 3)),
+        })
+        if response.status_code == 201:
+            booked = response.get_json()['reservations']
+            mine.extend(r['reservation_id'] for r in booked)
+            counts['reserved'] += 1
+            counts['booked_spots'] += len(booked)
+        elif response.status_code == 409:
+            counts['conflict'] += 1
+        elif response.status_code == 400:
+            counts['full'] += 1
+        else:
+            counts['errors'] += 1
+    results.put(counts)
+
+
+def worker(uri, seconds, threads, seed, results):
+    import threading
+    app = make_app(uri)
+    pool = [threading.Thread(target=_client_loop, args=(app, seconds, seed * 100 + n, results))
+            for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+
+def check(app):
+    with app.app_context():
+        doubles = (
+            db.session.query(Reservation.spot_id)
+            .filter(Reservation.active.is_(True))
+            .group_by(Reservation.spot_id)
+            .having(func.count() > 1)
+            .all()
+        )
+        occupied = {row[0] for row in db.session.query(ParkingSpot.id).filter(ParkingSpot.is_occupied.is_(True))}
+        booked = {row[0] for row in db.session.query(Reservation.spot_id).filter(Reservation.active.is_(True))}
+        counters_off = []
+        for row in LotOccupancy.query.all():
+            real = db.session.query(func.count()).filter(
+                ParkingSpot.lot_id == row.lot_id, ParkingSpot.is_occupied.is_(True)
+            ).scalar()
+            if real != row.occupied_spots:
+                counters_off.append((row.lot_id, row.occupied_spots, real))
+        return {
+            'double_booked_spots': len(doubles),
+            'occupied_without_reservation': len(occupied - booked),
+            'reserved_but_free': len(booked - occupied),
+            'counters_off': counters_off,
+        }
+
+
+def main(seconds=10.0, processes=4, threads=4):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'stress.db')
+        app = make_app(uri)
+        setup(app)
+        with app.app_context():
+            db.engine.dispose()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(uri, seconds, threads, n, results))
+                 for n in range(processes)]
+        started = time.monotonic()
+        for proc in procs:
+            proc.start()
+        totals = {}
+        for _ in range(processes * threads):
+            for name, value in results.get().items():
+                totals[name] = totals.get(name, 0) + value
+        for proc in procs:
+            proc.join()
+        elapsed = time.monotonic() - started
+
+        problems = check(app)
+
+    print(f"{processes} processes x {threads} threads, {elapsed:.1f}s, "
+          f"{LOTS} lots x {SPOTS_PER_LOT} spots")
+    print(f"reservations/s: {totals['reserved'] / elapsed:.1f}  (spots/s {totals['booked_spots'] / elapsed:.1f})")
+    print(f"releases: {totals['released']}  lot full: {totals['full']}  "
+          f"lost to concurrency (409): {totals['conflict']}  errors: {totals['errors']}")
+    print(f"invariants: {problems}")
+    ok = not any(problems.values()) and not totals['errors']
+    print("OK: no double bookings" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sys.exit(main(
+        float(args[0]) if args else 10.0,
+        int(args[1]) if len(args) > 1 else 4,
+        int(args[2]) if len(args) > 2 else 4,
+    ))
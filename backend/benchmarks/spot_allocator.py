@@ -0,0 +1,100 @@
+"""
+Picking N free spots for /reserve: the old `WHERE lot_id = ? AND is_occupied = 0 ORDER BY id LIMIT N`
+query vs spot_allocator.claim (per-lot bitmap, allocator.py).
+
+    cd backend && python benchmarks/spot_allocator.py [spots] [occupied fraction]
+
+One lot on a temporary SQLite file (hot-path index in place), a random share of its spots occupied.
+Claims are handed back after each call, so every call sees the same lot. Both sides must pick the
+same spots for the lowest-free policy.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from models.models import db, ParkingLot, ParkingSpot  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+from allocator import spot_allocator  # noqa: E402
+
+QUANTITIES = (1, 3, 10)
+ROUNDS = 200
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    return app
+
+
+def setup(spots, occupied_share):
+    rng = random.Random(42)
+    db.create_all()
+    lot = ParkingLot(name='Bench', address='x', pin_code='000000', price_per_hour=10, capacity=spots)
+    db.session.add(lot)
+    db.session.flush()
+    db.session.execute(insert(ParkingSpot.__table__), [
+        {'spot_number': f"BEN-{i}", 'lot_id': lot.id, 'is_occupied': rng.random() < occupied_share}
+        for i in range(1, spots + 1)
+    ])
+    db.session.commit()
+    return lot.id
+
+
+def query_pick(lot_id, quantity):
+    return [
+        spot.id for spot in
+        ParkingSpot.query.filter_by(lot_id=lot_id, is_occupied=False).order_by(ParkingSpot.id).limit(quantity)
+    ]
+
+
+def allocator_pick(lot_id, quantity):
+    return spot_allocator.claim(lot_id, quantity)
+
+
+def timed(pick, lot_id, quantity):
+    samples, picked = [], None
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        picked = pick(lot_id, quantity)
+        samples.append(time.perf_counter() - started)
+        if pick is allocator_pick:
+            picked = list(picked)  # unclaim empties the claimed list in place
+            spot_allocator.unclaim(lot_id, picked)
+        db.session.rollback()
+    return statistics.median(samples), max(samples), picked
+
+
+def main(spots=50000, occupied_share=0.95):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        app = make_app('sqlite:///' + os.path.join(tmp, 'allocator.db'))
+        with app.app_context():
+            lot_id = setup(spots, occupied_share)
+            started = time.perf_counter()
+            spot_allocator.rebuild()
+            print(f"{spots} spots, {occupied_share:.0%} occupied, "
+                  f"{spot_allocator.free_count(lot_id)} free (bitmap built in {(time.perf_counter() - started) * 1000:.1f} ms)")
+            print(f"{'quantity':<10}{'query p50 us':>14}{'bitmap p50 us':>15}{'query max us':>14}{'bitmap max us':>15}  same spots")
+            for quantity in QUANTITIES:
+                q50, qmax, from_query = timed(query_pick, lot_id, quantity)
+                b50, bmax, from_bitmap = timed(allocator_pick, lot_id, quantity)
+                print(f"{quantity:<10}{q50 * 1e6:>14.1f}{b50 * 1e6:>15.1f}{qmax * 1e6:>14.1f}{bmax * 1e6:>15.1f}  "
+                      f"{from_query == from_bitmap}")
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.95,
+    )
@@ -0,0 +1,66 @@
+"""
+Spot grid encoding vs the plain JSON spot list: encode time and bytes.
+
+    cd backend && python benchmarks/spot_grid.py [spots] [occupied fraction]
+
+No database needed -- a synthetic lot shaped like provisioning.add_spots makes them
+("LOT-1".."LOT-N", consecutive ids), with a random share of the spots occupied.
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spotgrid import encode_spots, decode_spots  # noqa: E402
+
+
+def _best(fn, repeat=7):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main(count=10000, occupied_share=0.4):
+    rng = random.Random(42)
+    ids = list(range(1001, 1001 + count))
+    numbers = [f"LOT-{i}" for i in range(1, count + 1)]
+    occupied = [rng.random() < occupied_share for _ in range(count)]
+
+    def plain():
+        return json.dumps([
+            {'id': i, 'spot_number': n, 'is_occupied': o} for i, n, o in zip(ids, numbers, occupied)
+        ]).encode()
+
+    def grid():
+        return json.dumps(encode_spots(ids, numbers, occupied)).encode()
+
+    rows = [('plain json', *_best(plain)), ('grid json', *_best(grid))]
+    try:
+        import msgpack
+        rows.append(('grid msgpack', *_best(
+            lambda: msgpack.packb(encode_spots(ids, numbers, occupied, binary=True), use_bin_type=True)
+        )))
+    except ImportError:
+        print("(msgpack not installed, skipping the MessagePack variant)")
+
+    grid_body = json.loads(rows[1][2])
+    assert decode_spots(grid_body) == json.loads(rows[0][2]), "grid does not round-trip"
+
+    base_time, base_body = rows[0][1], rows[0][2]
+    print(f"{count} spots, {occupied_share:.0%} occupied")
+    print(f"{'encoding':<14}{'bytes':>10}{'ms':>10}{'size x':>9}{'time x':>9}")
+    for name, elapsed, body in rows:
+        print(f"{name:<14}{len(body):>10}{elapsed * 1000:>10.2f}"
+              f"{len(base_body) / len(body):>9.1f}{base_time / elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 10000, float(args[1]) if len(args) > 1 else 0.4)
@@ -0,0 +1,106 @@
+"""
+Creating a lot of N spots and shrinking it to half: the old ORM paths vs provisioning.py.
+  - old:  one ParkingSpot object per spot on create; on shrink every spot loaded, sorted in Python
+          and deleted one by one,
+  - bulk: add_spots (Core executemany in BATCH_SIZE batches) and remove_free_spots (one DELETE).
+Each step is one transaction, like create_parking_lot / update_parking_lot.
+
+    cd backend && python benchmarks/spot_provisioning.py [capacities...]
+
+Runs on a temporary SQLite file; both paths must leave the same spot numbers behind.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from models.models import db, ParkingLot, ParkingSpot  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+from provisioning import spot_prefix, add_spots, remove_free_spots  # noqa: E402
+
+
+def make_app(uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+    return app
+
+
+def new_lot(name, capacity):
+    lot = ParkingLot(name=name, address='x', pin_code='000000', price_per_hour=10, capacity=capacity)
+    db.session.add(lot)
+    db.session.flush()
+    return lot
+
+
+def old_create(name, capacity):
+    lot = new_lot(name, capacity)
+    prefix = spot_prefix(name)
+    for i in range(1, capacity + 1):
+        db.session.add(ParkingSpot(spot_number=f"{prefix}-{i}", lot_id=lot.id, is_occupied=False))
+    db.session.commit()
+    return lot.id
+
+
+def old_shrink(lot_id, to_remove):
+    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
+    spots.sort(key=lambda s: int(s.spot_number.rsplit('-', 1)[1]), reverse=True)
+    for spot in [s for s in spots if not s.is_occupied][:to_remove]:
+        db.session.delete(spot)
+    db.session.commit()
+
+
+def bulk_create(name, capacity):
+    lot = new_lot(name, capacity)
+    add_spots(lot.id, spot_prefix(name), 1, capacity)
+    db.session.commit()
+    return lot.id
+
+
+def bulk_shrink(lot_id, to_remove):
+    assert remove_free_spots(lot_id, to_remove)
+    db.session.commit()
+
+
+def spot_numbers(lot_id):
+    return sorted(row[0] for row in db.session.query(ParkingSpot.spot_number).filter_by(lot_id=lot_id))
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    db.session.remove()
+    return elapsed, result
+
+
+def run(capacity):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        app = make_app('sqlite:///' + os.path.join(tmp, 'provisioning.db'))
+        with app.app_context():
+            db.create_all()
+            results = {}
+            for path, create, shrink in (('old', old_create, old_shrink), ('bulk', bulk_create, bulk_shrink)):
+                created, lot_id = timed(create, f'{path.title()} Lot', capacity)
+                shrunk, _ = timed(shrink, lot_id, capacity // 2)
+                results[path] = spot_numbers(lot_id)
+                print(f"{capacity:>8}  {path:<6}{created * 1000:>12.1f}{shrunk * 1000:>12.1f}")
+            same = [n.split('-', 1)[1] for n in results['old']] == [n.split('-', 1)[1] for n in results['bulk']]
+            print(f"{'':>8}  same spots left: {same}")
+            db.engine.dispose()
+
+
+def main(capacities=(1000, 10000, 100000)):
+    print(f"{'spots':>8}  {'path':<6}{'create ms':>12}{'shrink ms':>12}")
+    for capacity in capacities:
+        run(capacity)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or (1000, 10000, 100000))
@@ -0,0 +1,134 @@
+"""
+Concurrent readers + writers on a file SQLite database, default settings vs dbprofile's profile
+(WAL, synchronous=NORMAL, busy_timeout, cache/mmap, BEGIN IMMEDIATE for writers).
+
+    cd backend && python benchmarks/sqlite_profile.py [seconds] [readers] [writers]
+
+Writers do what /reserve does in miniature: read a free spot, mark it occupied, insert a booking
+row, commit. Readers run the dashboard-style aggregate + a page of spots.
+Every reader/writer is its own process (like the app's workers). Counts successful
+transactions and "database is locked" failures.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from dbprofile import EngineProfile, engine_options, immediate_transactions  # noqa: E402
+
+SPOTS = 20000
+LOTS = 20
+
+
+def _engine(uri, profiled):
+    if not profiled:
+        return create_engine(uri)
+    engine = create_engine(uri, **engine_options(uri, pool_size=2))
+    EngineProfile().configure_engine(engine)
+    return engine
+
+
+def _setup(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE spot (id INTEGER PRIMARY KEY, lot_id INTEGER, is_occupied BOOLEAN)"))
+        conn.execute(text("CREATE INDEX ix_spot_lot_occupied ON spot (lot_id, is_occupied)"))
+        conn.execute(text("CREATE TABLE booking (id INTEGER PRIMARY KEY, spot_id INTEGER, started REAL)"))
+        conn.execute(
+            text("INSERT INTO spot (lot_id, is_occupied) VALUES (:lot, 0)"),
+            [{'lot': i % LOTS + 1} for i in range(SPOTS)],
+        )
+
+
+def _worker(fn):
+    # one process per worker (like gunicorn workers), own engine, counters sent back at the end
+    def run(uri, profiled, stop, results, *args):
+        engine = _engine(uri, profiled)
+        counts = {'writes': 0, 'write_errors': 0, 'reads': 0, 'read_errors': 0}
+        fn(engine, stop, counts, *args)
+        engine.dispose()
+        results.put(counts)
+    return run
+
+
+@_worker
+def _writer(engine, stop, counts, n):
+    lot = n % LOTS + 1
+    with immediate_transactions():
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    spot = conn.execute(
+                        text("SELECT id FROM spot WHERE lot_id = :lot AND is_occupied = 0 LIMIT 1"), {'lot': lot}
+                    ).scalar()
+                    if spot is None:
+                        conn.execute(text("UPDATE spot SET is_occupied = 0 WHERE lot_id = :lot"), {'lot': lot})
+                        continue
+                    conn.execute(text("UPDATE spot SET is_occupied = 1 WHERE id = :id"), {'id': spot})
+                    conn.execute(text("INSERT INTO booking (spot_id, started) VALUES (:id, :t)"),
+                                 {'id': spot, 't': time.time()})
+                counts['writes'] += 1
+            except OperationalError:
+                counts['write_errors'] += 1
+
+
+@_worker
+def _reader(engine, stop, counts):
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(
+                    "SELECT lot_id, SUM(is_occupied), COUNT(*) FROM spot GROUP BY lot_id"
+                )).all()
+                conn.execute(text("SELECT id, is_occupied FROM spot WHERE lot_id = 3 LIMIT 200")).all()
+            counts['reads'] += 1
+        except OperationalError:
+            counts['read_errors'] += 1
+
+
+def run(label, profiled, seconds, readers, writers):
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCH_DIR')) as tmp:
+        uri = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        engine = _engine(uri, profiled)
+        _setup(engine)
+        engine.dispose()
+
+        stop, results = multiprocessing.Event(), multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_writer, args=(uri, profiled, stop, results, n))
+                 for n in range(writers)]
+        procs += [multiprocessing.Process(target=_reader, args=(uri, profiled, stop, results))
+                  for _ in range(readers)]
+        for proc in procs:
+            proc.start()
+        time.sleep(seconds)
+        stop.set()
+        counts = {'writes': 0, 'write_errors': 0, 'reads': 0, 'read_errors': 0}
+        for _ in procs:
+            for name, value in results.get().items():
+                counts[name] += value
+        for proc in procs:
+            proc.join()
+
+    print(f"{label:<10}{counts['writes'] / seconds:>10.0f}{counts['reads'] / seconds:>10.0f}"
+          f"{counts['write_errors']:>14}{counts['read_errors']:>13}")
+    return counts
+
+
+def main(seconds=5.0, readers=4, writers=4):
+    print(f"{seconds:.0f}s, {readers} readers, {writers} writers")
+    print(f"{'profile':<10}{'writes/s':>10}{'reads/s':>10}{'write errors':>14}{'read errors':>13}")
+    run('default', False, seconds, readers, writers)
+    run('tuned', True, seconds, readers, writers)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(
+        float(args[0]) if args else 5.0,
+        int(args[1]) if len(args) > 1 else 4,
+        int(args[2]) if len(args) > 2 else 4,
+    )
@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from models.models import db, ParkingLot, ParkingSpot, Reservation
+
+try:
+    import numpy as np
+except ImportError:  # in requirements.txt; a stripped-down install falls back to plain Python loops
+    np = None
+
+# Notes to me:
+# The billing rule, in one place: a session costs max(1 hour, its duration) x the lot's CURRENT
+# price_per_hour, rounded to cents. Final bills (release_spot, _close_and_bill_reservation,
+# releases.py) use session_cost(); live estimates use price_sessions(), which prices a whole batch
+# of sessions at once -- start timestamps (as epoch microseconds) and rates become NumPy arrays, one
+# vectorized pass instead of timezone-aware datetime math per row. Both do the same float operations
+# in the same order, so a live estimate and the bill at that same instant agree to the cent.
+# Live estimates feed the spot modal (running_cost per active reservation), /my-reservations
+# (running_cost + duration of active sessions) and /analytics (outstanding revenue = what every
+# active session would cost if it ended now).
+# /analytics is ETag'd and its bodies are cached, so its estimates are priced at the start of an
+# BILLING_ESTIMATE_BUCKET_SECONDS bucket and the bucket is part of the ETag (see etags.priced_lots_tag).
+
+MIN_BILLED_HOURS = 1.0
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _utc(dt):
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _naive_utc(dt):
+    return dt if dt.tzinfo is None else dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _epoch_us(datetimes):
+    """
+    Datetimes -> float64 array of whole microseconds since the epoch (None -> NaN). Whole
+    microseconds stay exact in a float64, so differences are exactly what timedelta gives.
+    Plain subtraction is the fast path (naive UTC, what the database hands back); anything else
+    (aware datetimes, None) goes through the careful loop.
+    """
+    try:
+        seconds = np.fromiter(((dt - _EPOCH).total_seconds() for dt in datetimes), np.float64, len(datetimes))
+    except TypeError:
+        seconds = np.array(
+            [np.nan if dt is None else (_naive_utc(dt) - _EPOCH).total_seconds() for dt in datetimes],
+            dtype=np.float64,
+        )
+    return np.rint(seconds * 1e6)
+
+
+def round_cents(amount):
+    return round(amount * 100) / 100
+
+
+class BillingEngine:
+    def __init__(self, estimate_bucket_seconds=60):
+        self.estimate_bucket_seconds = estimate_bucket_seconds
+        self._lock = threading.Lock()
+        self._counters = {'billed': 0, 'priced_sessions': 0, 'batches': 0}
+
+    def configure(self, estimate_bucket_seconds=None):
+        if estimate_bucket_seconds is not None:
+            self.estimate_bucket_seconds = max(1, int(estimate_bucket_seconds))
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+
+    # final bill
+
+    def session_cost(self, start_time, end_time, rate):
+        """Bill of one session that ended at end_time."""
+        end = _utc(end_time)
+        start = _utc(start_time) or end
+        hours = max((end - start).total_seconds() / 3600.0, MIN_BILLED_HOURS)
+        self._count(billed=1)
+        return round_cents(hours * float(rate or 0.0))
+
+    # live estimates
+
+    def price_sessions(self, start_times, rates, end_times=None, now=None):
+        """
+        Durations (seconds) and costs of a batch of sessions, as two lists. A session without an end
+        time (or all of them, end_times=None) is priced as if it ended `now`.
+        """
+        now = _utc(now) or datetime.now(timezone.utc)
+        count = len(start_times)
+        if not count:
+            return [], []
+        self._count(priced_sessions=count, batches=1)
+        if end_times is None:
+            end_times = [None] * count
+
+        if np is None:
+            seconds, costs = [], []
+            for start, end, rate in zip(start_times, end_times, rates):
+                end = _utc(end) or now
+                elapsed = (end - (_utc(start) or end)).total_seconds()
+                seconds.append(max(0.0, elapsed))
+                costs.append(round_cents(max(elapsed / 3600.0, MIN_BILLED_HOURS) * float(rate or 0.0)))
+            return seconds, costs
+
+        now_us = (_naive_utc(now) - _EPOCH) // timedelta(microseconds=1)
+        if any(end is not None for end in end_times):
+            ends = _epoch_us(end_times)
+            ends = np.where(np.isnan(ends), now_us, ends)
+        else:
+            ends = np.float64(now_us)
+        starts = _epoch_us(start_times)
+        starts = np.where(np.isnan(starts), ends, starts)
+        elapsed = (ends - starts) / 1e6
+        try:
+            rate_array = np.array(rates, dtype=np.float64)
+        except TypeError:
+            rate_array = np.array([float(r or 0.0) for r in rates], dtype=np.float64)
+        rate_array = np.nan_to_num(rate_array)  # None that slipped through as NaN
+        costs = np.rint(np.maximum(elapsed / 3600.0, MIN_BILLED_HOURS) * rate_array * 100) / 100
+        return np.maximum(elapsed, 0.0).tolist(), costs.tolist()
+
+    def estimate_bucket(self):
+        return int(time.time() // self.estimate_bucket_seconds)
+
+    def estimate_time(self, bucket=None):
+        """Start of the (current) estimate bucket -- the 'now' of cached/ETag'd estimates."""
+        if bucket is None:
+            bucket = self.estimate_bucket()
+        return datetime.fromtimestamp(bucket * self.estimate_bucket_seconds, timezone.utc)
+
+    def outstanding_revenue(self, now=None):
+        """
+        What every active session would be billed if it ended at `now`:
+        ({lot_id: amount}, total, active session count). One query, one pricing pass.
+        """
+        rows = db.session.execute(
+            select(ParkingSpot.lot_id, Reservation.start_time, ParkingLot.price_per_hour)
+            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+            .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+            .where(Reservation.active.is_(True))
+        ).all()
+        if not rows:
+            return {}, 0.0, 0
+        lot_ids, start_times, rates = zip(*rows)
+        _, costs = self.price_sessions(start_times, rates, now=now)
+
+        if np is None:
+            by_lot = {}
+            for lot_id, cost in zip(lot_ids, costs):
+                by_lot[lot_id] = by_lot.get(lot_id, 0.0) + cost
+        else:
+            lots, index = np.unique(np.array(lot_ids), return_inverse=True)
+            sums = np.bincount(index, weights=np.array(costs), minlength=len(lots))
+            by_lot = dict(zip(lots.tolist(), sums.tolist()))
+        by_lot = {lot_id: round_cents(amount) for lot_id, amount in by_lot.items()}
+        return by_lot, round_cents(sum(costs)), len(rows)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+        out.update(
+            numpy=np is not None,
+            min_billed_hours=MIN_BILLED_HOURS,
+            estimate_bucket_seconds=self.estimate_bucket_seconds,
+        )
+        return out
+
+
+billing_engine = BillingEngine()
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+# Notes to me:
+# Tiny pub/sub bus so workers can tell each other things (cache invalidations, ...).
+# RedisBus is the real one (Redis PUBLISH/SUBSCRIBE, one listener thread per channel per process),
+# MemoryBus is the in-process stand-in with the same API for a single worker / local runs.
+# RedisBus takes any redis-py compatible client, so a fake Redis can be passed in instead.
+# Messages are plain strings. Delivery is best effort: on_reconnect tells the subscriber it may
+# have missed some, so it can fall back to dropping whatever it was keeping in sync.
+
+log = logging.getLogger(__name__)
+
+
+class MemoryBus:
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            callbacks = list(self._subscribers[channel])
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, channel, callback, on_reconnect=None):
+        with self._lock:
+            self._subscribers[channel].append(callback)
+
+
+class RedisBus:
+    def __init__(self, url=None, client=None, retry_seconds=1.0):
+        self.url = url
+        self._client = client
+        self.retry_seconds = retry_seconds
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    def subscribe(self, channel, callback, on_reconnect=None):
+        thread = threading.Thread(
+            target=self._listen, args=(channel, callback, on_reconnect),
+            name=f'bus-{channel}', daemon=True,
+        )
+        thread.start()
+
+    def _listen(self, channel, callback, on_reconnect):
+        first = True
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                if not first and on_reconnect:
+                    on_reconnect()
+                first = False
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    data = message['data']
+                    callback(data.decode() if isinstance(data, bytes) else data)
+            except Exception:
+                log.warning("bus listener on %s lost its connection, retrying", channel, exc_info=True)
+                first = False
+                time.sleep(self.retry_seconds)
@@ -1,3 +1,462 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from flask_caching import Cache
 
-cache = Cache() #configured in app.py
\ No newline at end of file
+cache = Cache() #configured in app.py
+
+# Notes to me:
+# Versioned per-lot fragments on top of `cache` (Redis in production).
+# Every lot has a version key; a fragment key embeds the version it was built from, so a write
+# only has to bump the version of the lot(s) it touched -- the other lots' fragments stay valid and
+# the global views (/available-lots, /analytics, /parking-lots) are put back together from them.
+# "lots" is the version of the set of lots (create/delete), "epoch" invalidates everything.
+# Bump AFTER commit: a reader that raced the write can only have stored under the old version.
+# Versions that got lost (eviction, restart of a non-persistent cache) are re-seeded from the clock,
+# which is larger than any counter they could have reached, so old fragments never match again.
+# A backend error never fails the request: reads go straight to the builders and bumps only log,
+# like @cache.cached did (the write is already committed when we bump).
+#
+# Two tiers (TieredCache): every worker keeps a small LRU of what it read from Redis for a few
+# seconds (l1_ttl), so a hot fragment costs neither a round trip nor unpickling. Version keys are
+# the only thing that changes in place -- inc/set/delete drop them from every worker's L1 through
+# the bus (broadcast.py), l1_ttl is the safety net if a message gets lost.
+# Circuit breaker: after `failure_threshold` Redis errors in a row Redis is skipped for `cooldown`
+# seconds and the worker runs on L1 alone. Bumps made meanwhile only exist locally, so when Redis
+# answers again the whole epoch is bumped (on_recover) and the fragments stored before the outage
+# can't come back.
+
+log = logging.getLogger(__name__)
+
+PREFIX = 'lotcache'
+EPOCH = 'epoch'
+LOTS = 'lots'
+CHANGES = 'changes'  # moves with every lot bump: "something in some lot changed" (ETags, etags.py)
+USERS = 'users'
+
+
+def _seed():
+    return time.time_ns() // 1000
+
+
+_MISSING = object()
+
+
+class TieredCache:
+    """L1 (this process: LRU + short TTL) in front of L2 (the flask_caching backend, Redis)."""
+
+    CHANNEL = f'{PREFIX}:invalidate'
+
+    def __init__(self, l2, maxsize=2048, ttl=5, bus=None, failure_threshold=3, cooldown=10):
+        self.l2 = l2
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bus = bus
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex
+        self._listening_pid = None
+        self._failures = 0
+        self._tripped = False
+        self._dirty = False
+        self._open_until = 0.0
+        self._recover_hooks = []
+        self.counters = dict.fromkeys(
+            ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses', 'l2_errors', 'l2_skipped',
+             'evictions', 'invalidations_sent', 'invalidations_received', 'breaker_trips'), 0)
+
+    def configure(self, maxsize=None, ttl=None, bus=None, failure_threshold=None, cooldown=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            if bus is not None:
+                self.bus = bus
+                self._listening_pid = None
+            if failure_threshold is not None:
+                self.failure_threshold = failure_threshold
+            if cooldown is not None:
+                self.cooldown = cooldown
+
+    def on_recover(self, hook):
+        self._recover_hooks.append(hook)
+
+    def _bump_counter(self, name, by=1):
+        with self._lock:
+            self.counters[name] += by
+
+    # L1
+
+    def _l1_get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.counters['l1_misses'] += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.counters['l1_hits'] += 1
+            return entry[1]
+
+    def _l1_put(self, key, value, timeout=None):
+        if value is None:
+            return
+        ttl = self.ttl if not timeout else min(self.ttl, timeout)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _l1_drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear_l1(self):
+        with self._lock:
+            self._entries.clear()
+
+    # cross-worker invalidation
+
+    def _node(self):
+        return f'{os.getpid()}-{self._token}'
+
+    def _listen(self):
+        # lazily, in the worker process itself (a thread started before a fork doesn't survive it)
+        if self.bus is None or self._listening_pid == os.getpid():
+            return
+        self._listening_pid = os.getpid()
+        try:
+            self.bus.subscribe(self.CHANNEL, self._on_invalidate, on_reconnect=self.clear_l1)
+        except Exception:
+            log.warning("could not subscribe to %s", self.CHANNEL, exc_info=True)
+            self._listening_pid = None
+
+    def _on_invalidate(self, message):
+        sender, _, keys = message.partition('|')
+        if sender == self._node():
+            return
+        keys = keys.split()
+        self._l1_drop(keys)
+        self._bump_counter('invalidations_received', len(keys))
+
+    def _broadcast(self, keys):
+        if self.bus is None or not keys:
+            return
+        try:
+            self.bus.publish(self.CHANNEL, f"{self._node()}|{' '.join(keys)}")
+            self._bump_counter('invalidations_sent', len(keys))
+        except Exception:
+            log.warning("could not broadcast cache invalidation", exc_info=True)
+
+    # L2 behind the circuit breaker
+
+    def breaker_open(self):
+        return time.monotonic() < self._open_until
+
+    def _l2(self, op, *args, **kwargs):
+        """Run op on L2. Returns _MISSING when L2 is skipped (breaker open) or failed."""
+        if self.breaker_open():
+            with self._lock:
+                self.counters['l2_skipped'] += 1
+                self._dirty = self._dirty or op in ('set', 'add', 'inc', 'delete')
+            return _MISSING
+        try:
+            result = getattr(self.l2, op)(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.counters['l2_errors'] += 1
+                self._failures += 1
+                # a write that only landed in L1 has to be made up for once L2 answers again
+                self._dirty = self._dirty or op in ('set', 'add', 'inc', 'delete')
+                # a failed probe after the cooldown re-opens right away
+                tripped = self._tripped or self._failures >= self.failure_threshold
+                if tripped:
+                    self._open_until = time.monotonic() + self.cooldown
+                    self._failures = 0
+                    if not self._tripped:
+                        self.counters['breaker_trips'] += 1
+                    self._tripped = True
+            log.warning("cache L2 %s failed%s", op, ", running on L1 only" if tripped else "", exc_info=True)
+            return _MISSING
+
+        with self._lock:
+            recovered = self._tripped or self._dirty
+            self._tripped = self._dirty = False
+            self._failures = 0
+        if recovered:
+            # first L2 success after an outage: the bumps made meanwhile never reached Redis
+            log.warning("cache L2 is back, dropping L1 and bumping the epoch")
+            self.clear_l1()
+            for hook in self._recover_hooks:
+                try:
+                    hook()
+                except Exception:
+                    log.exception("cache recover hook failed")
+        return result
+
+    def _probe(self):
+        # after an outage L1 hits alone would never reach L2, so ask it directly once it's due
+        if (self._tripped or self._dirty) and not self.breaker_open():
+            self._l2('get', f'{PREFIX}:probe')
+
+    # the part of the cachelib API LotCache uses
+
+    def get(self, key):
+        self._listen()
+        self._probe()
+        value = self._l1_get(key)
+        if value is not _MISSING:
+            return value
+        value = self._l2('get', key)
+        if value is _MISSING or value is None:
+            self._bump_counter('l2_misses')
+            return None
+        self._bump_counter('l2_hits')
+        self._l1_put(key, value)
+        return value
+
+    def get_many(self, *keys):
+        self._listen()
+        self._probe()
+        values = [self._l1_get(key) for key in keys]
+        wanted = [key for key, value in zip(keys, values) if value is _MISSING]
+        if wanted:
+            fetched = self._l2('get_many', *wanted)
+            fetched = dict(zip(wanted, fetched)) if fetched is not _MISSING else {}
+            hits = 0
+            for key, value in fetched.items():
+                if value is not None:
+                    hits += 1
+                    self._l1_put(key, value)
+            self._bump_counter('l2_hits', hits)
+            self._bump_counter('l2_misses', len(wanted) - hits)
+            values = [fetched.get(key) if value is _MISSING else value for key, value in zip(keys, values)]
+        return values
+
+    def set(self, key, value, timeout=None):
+        self._l1_put(key, value, timeout)
+        self._l2('set', key, value, timeout=timeout)
+        self._broadcast([key])
+        return True
+
+    def set_many(self, mapping, timeout=None):
+        # only used for versioned (write-once) fragment keys -> nothing to invalidate elsewhere
+        for key, value in mapping.items():
+            self._l1_put(key, value, timeout)
+        self._l2('set_many', mapping, timeout=timeout)
+        return list(mapping)
+
+    def add(self, key, value, timeout=None):
+        added = self._l2('add', key, value, timeout=timeout)
+        if added is _MISSING:
+            if self._l1_get(key) is not _MISSING:
+                return False
+            added = True
+        if added:
+            self._l1_put(key, value, timeout)
+        return bool(added)
+
+    def inc(self, key, delta=1):
+        value = self._l2('inc', key, delta=delta)
+        if value is _MISSING or value is None:
+            current = self._l1_get(key)
+            value = (0 if current is _MISSING else current) + delta
+        self._l1_put(key, value)
+        self._broadcast([key])
+        return value
+
+    def delete(self, key):
+        self._l1_drop([key])
+        self._l2('delete', key)
+        self._broadcast([key])
+        return True
+
+    def stats(self):
+        with self._lock:
+            l1_lookups = self.counters['l1_hits'] + self.counters['l1_misses']
+            return {
+                **self.counters,
+                'l1_size': len(self._entries),
+                'l1_maxsize': self.maxsize,
+                'l1_ttl_seconds': self.ttl,
+                'l1_hit_ratio': round(self.counters['l1_hits'] / l1_lookups, 3) if l1_lookups else 0.0,
+                'breaker_open': time.monotonic() < self._open_until,
+                'bus': type(self.bus).__name__ if self.bus is not None else None,
+            }
+
+
+class LotCache:
+    def __init__(self, backend, timeout=300):
+        self.backend = backend
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._misses = {}
+        self.bumps = 0
+
+    def configure(self, timeout=None):
+        if timeout is not None:
+            self.timeout = timeout
+
+    def _version_key(self, name):
+        return f'{PREFIX}:v:{name}'
+
+    def _versions(self, names):
+        """Current version of each name (one MGET, missing ones are seeded)."""
+        keys = [self._version_key(name) for name in names]
+        values = self.backend.get_many(*keys) if keys else []
+        versions = {}
+        for name, key, value in zip(names, keys, values):
+            if value is None:
+                value = _seed()
+                if not self.backend.add(key, value, timeout=0):
+                    value = self.backend.get(key) or value
+            versions[name] = value
+        return versions
+
+    def _count(self, kind, hits, misses):
+        with self._lock:
+            self._hits[kind] = self._hits.get(kind, 0) + hits
+            self._misses[kind] = self._misses.get(kind, 0) + misses
+
+    def get_many(self, kind, lot_ids, build, variant=None):
+        """
+        Fragments of `kind` for lot_ids -> {lot_id: value}. build(missing_ids) must return
+        {lot_id: value} for the misses (lots it leaves out are simply not cached).
+        `variant` (user id, day, page, ...) becomes part of the key, not of the stats label.
+        """
+        lot_ids = list(lot_ids)
+        if not lot_ids:
+            return {}
+        suffix = f':{variant}' if variant is not None else ''
+        try:
+            versions = self._versions([EPOCH] + [f'lot:{lot_id}' for lot_id in lot_ids])
+            epoch = versions[EPOCH]
+            keys = {
+                lot_id: f"{PREFIX}:{kind}{suffix}:{lot_id}:{epoch}.{versions[f'lot:{lot_id}']}"
+                for lot_id in lot_ids
+            }
+            found = dict(zip(lot_ids, self.backend.get_many(*keys.values())))
+        except Exception:
+            log.exception("lot cache unavailable, building %s directly", kind)
+            keys, found = None, dict.fromkeys(lot_ids)
+
+        missing = [lot_id for lot_id, value in found.items() if value is None]
+        if missing:
+            built = build(missing)
+            if built and keys is not None:
+                self.backend.set_many({keys[lot_id]: value for lot_id, value in built.items()},
+                                      timeout=self.timeout)
+            found.update(built)
+        self._count(kind, len(lot_ids) - len(missing), len(missing))
+        return {lot_id: found[lot_id] for lot_id in lot_ids if found.get(lot_id) is not None}
+
+    def get(self, kind, lot_id, build, variant=None):
+        """Single-lot fragment. build() returns the value (None = don't cache)."""
+        def build_one(_ids):
+            value = build()
+            return {lot_id: value} if value is not None else {}
+        return self.get_many(kind, [lot_id], build_one, variant=variant).get(lot_id)
+
+    def get_global(self, kind, build):
+        """Fragment that depends on the set of lots (e.g. the ordered lot index), not on one lot."""
+        try:
+            versions = self._versions([EPOCH, LOTS])
+            key = f'{PREFIX}:{kind}:{versions[EPOCH]}.{versions[LOTS]}'
+            value = self.backend.get(key)
+        except Exception:
+            log.exception("lot cache unavailable, building %s directly", kind)
+            key = value = None
+        if value is not None:
+            self._count(kind, 1, 0)
+            return value
+        value = build()
+        if key is not None:
+            self.backend.set(key, value, timeout=self.timeout)
+        self._count(kind, 0, 1)
+        return value
+
+    def _bump(self, names):
+        for name in names:
+            key = self._version_key(name)
+            try:
+                if self.backend.get(key) is None:
+                    self.backend.add(key, _seed(), timeout=0)
+                self.backend.inc(key)
+            except Exception:
+                log.exception("lot cache unavailable, could not bump %s", name)
+        with self._lock:
+            self.bumps += len(names)
+
+    def bump(self, *lot_ids, lots=False):
+        """Lots changed (spots, counters, rollups, details). lots=True: lots were added/removed."""
+        names = [f'lot:{lot_id}' for lot_id in dict.fromkeys(lot_ids) if lot_id is not None]
+        if lots:
+            names.append(LOTS)
+        names.append(CHANGES)
+        self._bump(names)
+
+    def touch(self, *names):
+        """Bump other named versions (e.g. USERS)."""
+        self._bump(list(names))
+
+    def version_tag(self, *names):
+        """'<epoch>.<v1>.<v2>..' for the given names -- changes whenever one of them is bumped."""
+        names = [EPOCH, *names]
+        versions = self._versions(names)
+        return '.'.join(str(versions[name]) for name in names)
+
+    def bump_all(self):
+        """Bulk rebuilds (reconcile, backfill, repair) -- drop every fragment at once."""
+        self._bump([EPOCH])
+
+    def stats(self):
+        with self._lock:
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            kinds = {}
+            for kind in sorted(set(self._hits) | set(self._misses)):
+                h, m = self._hits.get(kind, 0), self._misses.get(kind, 0)
+                kinds[kind] = {'hits': h, 'misses': m, 'hit_ratio': round(h / (h + m), 3) if h + m else 0.0}
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                'bumps': self.bumps,
+                'timeout_seconds': self.timeout,
+                'kinds': kinds,
+                'tiers': self.backend.stats() if hasattr(self.backend, 'stats') else None,
+            }
+
+
+class _Backend:
+    """The configured flask_caching backend, looked up per call (init_app runs after import)."""
+
+    def __getattr__(self, name):
+        return getattr(cache.cache, name)
+
+
+tiered_cache = TieredCache(_Backend())
+lot_cache = LotCache(tiered_cache)
+tiered_cache.on_recover(lot_cache.bump_all)
+
+
+def lot_index():
+    """[(is_archive 0/1, lot_id), ...] in list order (archive last), cached per version of the lot set."""
+    from models.models import db, ParkingLot
+
+    def build():
+        rows = db.session.query(ParkingLot.is_archive, ParkingLot.id).all()
+        return sorted((1 if is_archive else 0, lot_id) for is_archive, lot_id in rows)
+
+    return [tuple(entry) for entry in lot_cache.get_global('index', build)]
@@ -0,0 +1,161 @@
+import gzip
+import threading
+from flask import request, Response
+from cache import tiered_cache
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt; a stripped-down install negotiates gzip only
+    brotli = None
+
+# Notes to me:
+# Negotiated response compression (Accept-Encoding: br > gzip), only above `min_size` bytes --
+# tiny bodies get bigger/slower compressed. Runs as an after_request hook for every /api response
+# except streams (SSE) and passthrough files, and anything already encoded.
+# Versioned (ETag'd) responses go one step further: etags.versioned_etag keeps the COMPRESSED body
+# in the tiered cache under its ETag + encoding, so a client that doesn't have that version yet
+# (new tab, other admin, ...) gets the stored bytes without the view, jsonify or compression running.
+# The ETag already encodes the versions the body was built from, so those entries never go stale --
+# they just stop being asked for. The negotiated encoding is part of the ETag (one tag per
+# representation), which is why the hook leaves ETags alone.
+# A stored body keeps the view's headers with it (Content-Type, Cache-Control, X-*, Vary, ...), minus
+# the ones that belong to one response only (STORED_HEADERS_SKIPPED) -- never a Set-Cookie.
+
+BODY_PREFIX = 'body:v2'  # v2: (headers, body); 'body' entries were (mimetype, body)
+
+STORED_HEADERS_SKIPPED = frozenset(('content-length', 'content-encoding', 'etag', 'date', 'set-cookie'))
+
+COMPRESSIBLE = (
+    'application/json',
+    'application/vnd.parking.grid+json',
+    'application/vnd.parking.grid+msgpack',
+    'text/',
+    'application/javascript',
+    'image/svg+xml',
+)
+
+
+def _gzip(body, level):
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class Compressor:
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5, cache_bodies=True, cache_timeout=300):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_bodies = cache_bodies
+        self.cache_timeout = cache_timeout
+        self._lock = threading.Lock()
+        self._counters = {
+            'compressed': 0, 'skipped_small': 0, 'bytes_in': 0, 'bytes_out': 0,
+            'body_hits': 0, 'body_misses': 0,
+        }
+
+    def configure(self, min_size=None, gzip_level=None, brotli_quality=None, cache_bodies=None, cache_timeout=None):
+        if min_size is not None:
+            self.min_size = min_size
+        if gzip_level is not None:
+            self.gzip_level = gzip_level
+        if brotli_quality is not None:
+            self.brotli_quality = brotli_quality
+        if cache_bodies is not None:
+            self.cache_bodies = cache_bodies
+        if cache_timeout is not None:
+            self.cache_timeout = cache_timeout
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+
+    def negotiate(self):
+        """'br', 'gzip' or None for the current request."""
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return _gzip(body, self.gzip_level)
+
+    def eligible(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not 200 <= response.status_code < 300 or response.status_code == 204):
+            return False
+        mimetype = response.mimetype or ''
+        return any(mimetype.startswith(kind) for kind in COMPRESSIBLE)
+
+    def apply(self, response, encoding=None):
+        """Compress `response` in place if worth it. Returns True when it did."""
+        encoding = encoding or self.negotiate()
+        if encoding is None or not self.eligible(response):
+            return False
+        body = response.get_data()
+        if len(body) < self.min_size:
+            self._count(skipped_small=1)
+            return False
+        packed = self.compress(body, encoding)
+        self._count(compressed=1, bytes_in=len(body), bytes_out=len(packed))
+        self.set_encoded(response, packed, encoding)
+        return True
+
+    @staticmethod
+    def set_encoded(response, packed, encoding):
+        response.set_data(packed)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+
+    def cached_response(self, key, encoding):
+        """Response rebuilt from a stored compressed body, or None."""
+        if not self.cache_bodies or encoding is None:
+            return None
+        stored = tiered_cache.get(f'{BODY_PREFIX}:{key}:{encoding}')
+        if stored is None:
+            self._count(body_misses=1)
+            return None
+        self._count(body_hits=1)
+        headers, packed = stored
+        response = Response(headers=headers)
+        self.set_encoded(response, packed, encoding)
+        return response
+
+    def store_response(self, key, encoding, response):
+        """Compress `response` and keep the bytes under `key` (a version-derived ETag)."""
+        if not self.apply(response, encoding) or not self.cache_bodies:
+            return
+        headers = [
+            (name, value) for name, value in response.headers.items()
+            if name.lower() not in STORED_HEADERS_SKIPPED
+        ]
+        # write-once key: nothing for the other workers to drop from their L1
+        tiered_cache.set_many(
+            {f'{BODY_PREFIX}:{key}:{encoding}': (headers, response.get_data())},
+            timeout=self.cache_timeout,
+        )
+
+    def after_request(self, response):
+        if request.path.startswith('/api') and self.eligible(response):
+            response.vary.add('Accept-Encoding')
+            self.apply(response)
+        return response
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+        out['ratio'] = round(out['bytes_out'] / out['bytes_in'], 3) if out['bytes_in'] else None
+        lookups = out['body_hits'] + out['body_misses']
+        out['body_hit_ratio'] = round(out['body_hits'] / lookups, 3) if lookups else None
+        out.update(min_size=self.min_size, brotli=brotli is not None, cache_bodies=self.cache_bodies)
+        return out
+
+
+compressor = Compressor()
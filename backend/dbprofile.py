@@ -0,0 +1,145 @@
+import os
+import threading
+from contextvars import ContextVar
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+
+# Notes to me:
+# Engine profile, applied with SQLAlchemy engine events (configure_engine, called once from app.py).
+# SQLite (the default parking.db):
+#  - WAL: readers no longer wait for the writer (and the writer not for them), synchronous=NORMAL
+#    is safe with WAL and saves an fsync per commit,
+#  - busy_timeout: a writer waits for the lock instead of failing with "database is locked",
+#  - cache_size / mmap_size: bigger page cache, reads served from the mapping,
+#  - BEGIN IMMEDIATE for write transactions. A deferred transaction that reads first and writes
+#    later has to UPGRADE its lock -- if another writer committed in between SQLite fails it right
+#    away (busy_timeout can't help). IMMEDIATE takes the write lock up front, so writers queue
+#    on busy_timeout instead. "Write" = the request's method isn't GET/HEAD/OPTIONS, minus the
+#    views marked @read_only_transaction (POST endpoints that only read); immediate_transactions()
+#    forces it for code outside a request (CLI, Celery).
+#    pysqlite's own implicit BEGIN is switched off for this (isolation_level=None), we emit it.
+# DATABASE_URL switches to a server database (Postgres, MySQL, ...) with a real pool instead --
+# none of the above applies there.
+# benchmarks/sqlite_profile.py runs concurrent readers + writers with and without the profile.
+
+_immediate = ContextVar('immediate_transactions', default=None)
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def database_uri(basedir):
+    return os.getenv('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'parking.db')
+
+
+def engine_options(uri, pool_size=10, max_overflow=20, pool_recycle=1800, busy_timeout_ms=5000):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`."""
+    if uri.startswith('sqlite'):
+        if ':memory:' in uri or uri.rstrip('/') == 'sqlite:':
+            return {}  # in-memory: one connection, nothing to tune
+        # the driver-level timeout is the same busy wait, for the connect itself
+        return {
+            'connect_args': {'timeout': busy_timeout_ms / 1000, 'check_same_thread': False},
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+        }
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True,
+    }
+
+
+def read_only_transaction(view):
+    """Mark a (POST) view as read-only: its transactions start deferred, not IMMEDIATE."""
+    view.read_only_transaction = True
+    return view
+
+
+class immediate_transactions:
+    """Outside a request: `with immediate_transactions(): ...` makes transactions take the write lock."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self._token = _immediate.set(self.enabled)
+        return self
+
+    def __exit__(self, *exc):
+        _immediate.reset(self._token)
+
+
+def _wants_immediate():
+    forced = _immediate.get()
+    if forced is not None:
+        return forced
+    if not has_request_context() or request.method in READ_METHODS:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return not getattr(view, 'read_only_transaction', False)
+
+
+class EngineProfile:
+    def __init__(self):
+        self.engine = None
+        self.pragmas = {}
+        self.immediate_writes = True
+        self._lock = threading.Lock()
+        self._counters = {'connections': 0, 'immediate': 0, 'deferred': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def configure_engine(self, engine, busy_timeout_ms=5000, synchronous='NORMAL', cache_size_kb=65536,
+                         mmap_size=268435456, immediate_writes=True):
+        self.engine = engine
+        if engine.dialect.name != 'sqlite':
+            return
+        self.immediate_writes = immediate_writes
+        self.pragmas = {
+            'journal_mode': 'WAL',
+            'synchronous': synchronous,
+            'busy_timeout': int(busy_timeout_ms),
+            'cache_size': -int(cache_size_kb),  # negative = KiB
+            'mmap_size': int(mmap_size),
+            'temp_store': 'MEMORY',
+        }
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'begin', self._on_begin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+        self._count('connections')
+
+    def _on_begin(self, conn):
+        if self.immediate_writes and _wants_immediate():
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            self._count('immediate')
+        else:
+            conn.exec_driver_sql("BEGIN")
+            self._count('deferred')
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._counters)
+        if self.engine is not None:
+            out['dialect'] = self.engine.dialect.name
+            out['pool'] = self.engine.pool.status()
+            if self.engine.dialect.name == 'sqlite':
+                with self.engine.connect() as conn:
+                    out['pragmas'] = {
+                        name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                        for name in self.pragmas
+                    }
+        return out
+
+
+engine_profile = EngineProfile()
@@ -0,0 +1,112 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response, g
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models.models import User
+from cache import lot_cache, CHANGES, USERS
+from compression import compressor
+from billing import billing_engine
+
+# Notes to me:
+# Strong ETags for the endpoints the dashboards poll, built from the cache version keys
+# (cache.lot_cache, read from L1 most of the time) -- NOT from hashing the body. An unchanged poll
+# gets its 304 before the view (and any query) runs.
+# The tag is read BEFORE the view: if a write lands in between, the body is newer than its tag and
+# the next poll simply gets a full response again; the other way round could hide a change.
+# /users has its own version, bumped after commit when a user row or its roles change.
+# The negotiated Content-Encoding is part of the tag, and a full response is first looked up as an
+# already compressed body stored under its tag (compression.py) -- the view only runs on a miss.
+# Views with live cost estimates (/analytics) add the billing estimate bucket: the body changes with
+# the clock, not only with writes.
+
+
+def _etag(parts):
+    # Accept too: it can pick the representation (spot grids, spotgrid.py)
+    raw = '|'.join(str(part) for part in (
+        request.path, request.query_string.decode(), request.headers.get('Accept', ''), *parts
+    ))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def versioned_etag(tag):
+    """
+    View decorator. tag(*args, **kwargs) returns the version parts the response depends on
+    (a tuple, no queries), or None to skip ETags for this request.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                parts = tag(*args, **kwargs)
+            except Exception:
+                parts = None
+            if parts is None:
+                return view(*args, **kwargs)
+
+            encoding = compressor.negotiate()
+            etag = _etag((*parts, encoding or 'identity'))
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = compressor.cached_response(etag, encoding)
+                if response is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if encoding:
+                        compressor.store_response(etag, encoding, response)
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.vary.add('Accept-Encoding')
+            # per-user data behind a token: browsers may keep it, but must revalidate every time
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def lots_tag(*args, **kwargs):
+    """Anything built from lots/spots/counters/rollups (the global lot views)."""
+    return (lot_cache.version_tag(CHANGES),)
+
+
+def priced_lots_tag(*args, **kwargs):
+    """lots_tag + the live-estimate time bucket (billing.py). The view prices as of g.estimate_bucket."""
+    g.estimate_bucket = billing_engine.estimate_bucket()
+    return (lot_cache.version_tag(CHANGES), g.estimate_bucket)
+
+
+def users_tag(*args, **kwargs):
+    return (lot_cache.version_tag(USERS),)
+
+
+# what the /users list shows: the rows themselves, email, username and roles
+_USER_FIELDS = ('email', 'username', 'roles')
+
+
+def _note_user_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, User):
+            session.info['users_changed'] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _USER_FIELDS):
+                session.info['users_changed'] = True
+                return
+
+
+def _after_commit(session):
+    if session.info.pop('users_changed', False):
+        lot_cache.touch(USERS)
+
+
+def _after_rollback(session):
+    session.info.pop('users_changed', None)
+
+
+event.listen(Session, 'before_flush', _note_user_changes)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
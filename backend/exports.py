@@ -0,0 +1,71 @@
+import csv
+import tempfile
+import zlib
+from sqlalchemy import select
+from models.models import db, ParkingLot, ParkingSpot, Reservation
+
+# Notes to me:
+# CSV export of a user's history without holding it in memory.
+# One joined query (no r.spot.parking_lot lazy loads), read with yield_per so only one chunk
+# of rows is alive at a time, turned into CSV text a batch at a time. Used by the
+# /export-csv/download endpoint (streamed response) and by the emailed export task
+# (written to a spooled temp file).
+
+CSV_HEADER = ['Reservation ID', 'Lot', 'Spot', 'Start', 'End', 'Cost', 'Status']
+BATCH_BYTES = 64 * 1024
+SPOOL_BYTES = 1024 * 1024
+
+
+class _Line:
+    """csv.writer target that just hands back what it was given."""
+
+    def write(self, value):
+        return value
+
+
+def history_rows(user_id, chunk_size=1000):
+    query = (
+        select(Reservation.id, ParkingLot.name, ParkingSpot.spot_number, Reservation.start_time,
+               Reservation.end_time, Reservation.total_cost, Reservation.active)
+        .outerjoin(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .outerjoin(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(Reservation.user_id == user_id)
+        .order_by(Reservation.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for res_id, lot_name, spot_number, start, end, cost, active in db.session.execute(query):
+        yield [res_id, lot_name, spot_number, start, end, cost, "Active" if active else "Completed"]
+
+
+def iter_csv(rows, header=CSV_HEADER):
+    """Header + rows as utf-8 chunks of roughly BATCH_BYTES."""
+    writer = csv.writer(_Line())
+    batch = [writer.writerow(header)]
+    size = len(batch[0])
+    for row in rows:
+        line = writer.writerow(row)
+        batch.append(line)
+        size += len(line)
+        if size >= BATCH_BYTES:
+            yield ''.join(batch).encode('utf-8')
+            batch, size = [], 0
+    if batch:
+        yield ''.join(batch).encode('utf-8')
+
+
+def iter_gzip(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 -> gzip header/trailer
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def spool(chunks, max_size=SPOOL_BYTES):
+    """Write byte chunks to a temp file that stays in RAM up to max_size. Returned rewound."""
+    output = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        output.write(chunk)
+    output.seek(0)
+    return output
@@ -0,0 +1,155 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from flask_security.utils import hash_password, get_hmac, use_double_hash
+
+# Notes to me:
+# Password hashing is deliberately slow, so /login, /register and change-password hand it to a
+# small bounded thread pool (argon2/bcrypt release the GIL) instead of hashing inline.
+#  - at most `workers` hashes run at once, `queue_limit` more may wait -> anything beyond that
+#    is rejected straight away (503) instead of piling up request threads
+#  - one client may only have `per_client` hashes in flight (429)
+#  - login transparently rehashes when the stored hash uses outdated settings
+
+
+class HashingBusy(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class PasswordHasher:
+    def __init__(self, workers=4, queue_limit=16, per_client=2, timeout=30):
+        self.configure(workers, queue_limit, per_client, timeout)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._per_client_inflight = {}
+        self._inflight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def configure(self, workers=None, queue_limit=None, per_client=None, timeout=None):
+        if workers is not None:
+            self.workers = workers
+        if queue_limit is not None:
+            self.queue_limit = queue_limit
+        if per_client is not None:
+            self.per_client = per_client
+        if timeout is not None:
+            self.timeout = timeout
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pwhash')
+        return self._executor
+
+    def _acquire(self, client):
+        with self._lock:
+            if self._inflight >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise HashingBusy('Server busy, please retry shortly.', 503)
+            if self._per_client_inflight.get(client, 0) >= self.per_client:
+                self.rejected += 1
+                raise HashingBusy('Too many attempts in progress, slow down.', 429)
+            self._inflight += 1
+            self._per_client_inflight[client] = self._per_client_inflight.get(client, 0) + 1
+
+    def _release(self, client, elapsed):
+        with self._lock:
+            self._inflight -= 1
+            left = self._per_client_inflight.get(client, 1) - 1
+            if left > 0:
+                self._per_client_inflight[client] = left
+            else:
+                self._per_client_inflight.pop(client, None)
+            if elapsed is not None:
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    def _run(self, client, fn, *args):
+        self._acquire(client)
+        app = current_app._get_current_object()
+
+        def job():
+            started = time.perf_counter()
+            with app.app_context():
+                result = fn(*args)
+            return result, time.perf_counter() - started
+
+        try:
+            future = self._pool().submit(job)
+        except Exception:
+            self._release(client, None)
+            raise
+        # the slot is held until the hash is really done -- a request that gave up waiting (503)
+        # doesn't stop the job, so it must keep counting against queue_limit / per_client
+        future.add_done_callback(lambda done: self._release(client, _elapsed(done)))
+        try:
+            return future.result(timeout=self.timeout)[0]
+        except FutureTimeout:
+            raise HashingBusy('Server busy, please retry shortly.', 503)
+
+    def note_rehash(self):
+        with self._lock:
+            self.rehashed += 1
+
+    def hash(self, password, client=None):
+        return self._run(client, hash_password, password)
+
+    def verify(self, password, password_hash, client=None):
+        """
+        Returns (valid, new_hash). new_hash is set when the password was right but the stored
+        hash was made with older settings -- the caller saves it on the user.
+        """
+        return self._run(client, _verify_and_rehash, password, password_hash)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'per_client': self.per_client,
+                'in_flight': self._inflight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'avg_ms': round(self.total_seconds / self.completed * 1000, 1) if self.completed else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 1),
+            }
+
+
+def _elapsed(future):
+    if future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()[1]
+
+
+def _verify_and_rehash(password, password_hash):
+    """Same rules as flask_security's verify_and_update_password, minus touching the ORM user."""
+    if not password_hash:
+        return False, None
+    pwd_context = current_app.extensions['security'].pwd_context
+
+    candidate = password
+    if use_double_hash(password_hash):
+        candidate = get_hmac(password)
+        if pwd_context.identify(password_hash) == 'bcrypt':
+            candidate = candidate[:72]
+    if not pwd_context.verify(candidate, password_hash):
+        return False, None
+
+    if pwd_context.needs_update(password_hash):
+        password_hasher.note_rehash()
+        return True, hash_password(password)
+    return True, None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,175 @@
+from datetime import datetime
+from sqlalchemy import inspect, text, select, insert
+from models.models import (
+    db, ParkingLot, ParkingSpot, Reservation, User, LotDailyStat, UserLotDailyStat, SyncTombstone,
+    SyncState, SyncChange,
+)
+
+# Notes to me:
+# Tiny migration runner for schema changes db.create_all() can't do on an existing parking.db
+# (create_all only creates missing tables -- it never adds indexes/columns to old ones).
+# Each migration runs once, in its own transaction, and is recorded in schema_migrations.
+# New migrations go at the END of MIGRATIONS and must be safe to run on a fresh database too.
+# A migration names the indexes it creates: "every index on the model" changes as the model grows,
+# and an old migration would then try to index columns only a later one adds.
+
+
+def _create_indexes(conn, model, *names):
+    """
+    Create the named indexes declared on `model` -- only those: the model's CURRENT index list can
+    include indexes on columns a later migration adds. Skipped while the table doesn't exist yet
+    (create_all makes it with every index).
+    """
+    table = model.__table__
+    if not inspect(conn).has_table(table.name):
+        return
+    declared = {index.name: index for index in table.indexes}
+    for name in names:
+        declared[name].create(conn, checkfirst=True)
+
+
+def add_column(conn, model, column_name):
+    """ALTER TABLE ... ADD COLUMN for a column declared on the model, if it isn't there yet."""
+    table = model.__table__
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    if column_name in existing:
+        return False
+    column = table.c[column_name]
+    quote = conn.dialect.identifier_preparer
+    ddl = (f"ALTER TABLE {quote.format_table(table)} ADD COLUMN {quote.quote(column.name)} "
+           f"{column.type.compile(conn.dialect)}")
+    default = conn.dialect.ddl_compiler(conn.dialect, None).get_column_default_string(column)
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    conn.execute(text(ddl))
+    return True
+
+
+def _0001_hot_path_indexes(conn):
+    _create_indexes(
+        conn, Reservation,
+        'ix_reservation_spot_active', 'ix_reservation_user_start',
+        'ix_reservation_start_time', 'ix_reservation_end_time',
+    )
+    _create_indexes(conn, ParkingSpot, 'ix_parking_spot_lot_occupied')
+
+
+def _0002_user_last_reminded_at(conn):
+    add_column(conn, User, 'last_reminded_at')
+
+
+def _0003_parking_lot_is_archive(conn):
+    from archive import ARCHIVE_NAME
+    add_column(conn, ParkingLot, 'is_archive')
+    _create_indexes(conn, ParkingLot, 'ix_parking_lot_is_archive')
+    _create_indexes(conn, LotDailyStat, 'ix_lot_daily_stat_lot_day')
+    _create_indexes(conn, UserLotDailyStat, 'ix_user_lot_daily_stat_lot_user_day')
+    conn.execute(
+        text("UPDATE parking_lot SET is_archive = :yes WHERE name = :name"),
+        {'yes': True, 'name': ARCHIVE_NAME},
+    )
+
+
+def _0004_change_versions(conn):
+    # existing rows keep version 0: clients always start with a full sync anyway
+    add_column(conn, ParkingLot, 'change_version')
+    add_column(conn, ParkingSpot, 'change_version')
+    _create_indexes(conn, ParkingLot, 'ix_parking_lot_change_version')
+    _create_indexes(conn, ParkingSpot, 'ix_parking_spot_change_version')
+    _create_indexes(conn, SyncTombstone, 'ix_sync_tombstone_change_version', 'ix_sync_tombstone_deleted_at')
+
+
+def _0005_sync_change_log(conn):
+    # change versions now come from SyncChange ids: carry on from where the single counter row stopped
+    SyncChange.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, SyncChange, 'ix_sync_change_open')
+    if not inspect(conn).has_table(SyncState.__table__.name):
+        return
+    last = conn.execute(select(SyncState.version).where(SyncState.id == 1)).scalar()
+    if not last or conn.execute(select(SyncChange.id).limit(1)).first():
+        return
+    conn.execute(insert(SyncChange.__table__).values(id=last, done=True, created_at=datetime.utcnow()))
+    if conn.dialect.name == 'postgresql':
+        # an explicit id doesn't move the serial's sequence
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('sync_change', 'id'), :last)"), {'last': last})
+
+
+MIGRATIONS = [
+    ('0001_hot_path_indexes', _0001_hot_path_indexes),
+    ('0002_user_last_reminded_at', _0002_user_last_reminded_at),
+    ('0003_parking_lot_is_archive', _0003_parking_lot_is_archive),
+    ('0004_change_versions', _0004_change_versions),
+    ('0005_sync_change_log', _0005_sync_change_log),
+]
+
+
+def run_migrations():
+    """Apply pending migrations. Returns the ids that were applied."""
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "id VARCHAR(100) PRIMARY KEY, applied_at VARCHAR(40) NOT NULL)"
+        ))
+        done = {row[0] for row in conn.execute(text("SELECT id FROM schema_migrations"))}
+
+    applied = []
+    for migration_id, migrate in MIGRATIONS:
+        if migration_id in done:
+            continue
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :at)"),
+                {'id': migration_id, 'at': datetime.utcnow().isoformat()},
+            )
+        applied.append(migration_id)
+    return applied
+
+
+# Query plan guard
+# The hot queries below must be served by an index. check_query_plans() runs EXPLAIN QUERY PLAN
+# on each (SQLite only) and reports the ones that fall back to a full table scan.
+
+HOT_QUERIES = {
+    'active reservation of a spot':
+        "SELECT id FROM reservation WHERE spot_id = 1 AND active = 1",
+    'reservation history of a user':
+        "SELECT id FROM reservation WHERE user_id = 1 ORDER BY start_time DESC",
+    'reservations started in a range':
+        "SELECT id FROM reservation WHERE start_time >= '2024-01-01' AND start_time < '2024-02-01'",
+    'reservations ended since':
+        "SELECT id FROM reservation WHERE end_time >= '2024-01-01'",
+    'free spots of a lot':
+        "SELECT id FROM parking_spot WHERE lot_id = 1 AND is_occupied = 0",
+    'rollups of a lot':
+        "SELECT day FROM lot_daily_stat WHERE lot_id = 1 AND day >= '2024-01-01'",
+    'rollups of a user in a lot':
+        "SELECT day FROM user_lot_daily_stat WHERE lot_id = 1 AND user_id = 1",
+    'archive lot':
+        "SELECT id FROM parking_lot WHERE is_archive = 1",
+    'spots changed since':
+        "SELECT id FROM parking_spot WHERE change_version > 5",
+    'lots changed since':
+        "SELECT id FROM parking_lot WHERE change_version > 5",
+    'deletions since':
+        "SELECT entity_id FROM sync_tombstone WHERE change_version > 5",
+    'oldest open change version':
+        "SELECT min(id) FROM sync_change WHERE done = 0 AND created_at > '2024-01-01'",
+    'token lookup':
+        "SELECT id FROM user WHERE fs_uniquifier = 'x'",
+}
+
+
+def check_query_plans():
+    """Returns {query name: plan detail} for every hot query doing a full table scan."""
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    problems = {}
+    with db.engine.connect() as conn:
+        for name, sql in HOT_QUERIES.items():
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            # SEARCH = index lookup. SCAN (even "USING INDEX") walks the whole table/index.
+            scans = [step for step in plan if step.startswith('SCAN ') and 'CONSTANT ROW' not in step]
+            if scans:
+                problems[name] = '; '.join(scans)
+    return problems
@@ -25,6 +25,7 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(255), nullable=False)
     active = db.Column(db.Boolean(), default=True)
     fs_uniquifier = db.Column(db.String(255), unique=True, nullable=False) # Flask-Security
+    last_reminded_at = db.Column(db.DateTime, nullable=True) # daily reminder de-dup (tasks.py)
 
     roles = db.relationship('Role', secondary=roles_users, backref=db.backref('users', lazy='dynamic'))
     reservations = db.relationship('Reservation', backref='user', lazy=True)
@@ -40,8 +41,20 @@ class ParkingLot(db.Model):
     pin_code = db.Column(db.String(10), nullable=False)
     price_per_hour = db.Column(db.Float, nullable=False)
     capacity = db.Column(db.Integer, nullable=False) # Total number of spots allowed
+    # The single system lot that keeps the spots/history of deleted lots (see archive.py)
+    is_archive = db.Column(db.Boolean, nullable=False, default=False, server_default='0', index=True)
+    # Global change version of the last write to this row (delta sync, see sync.py)
+    change_version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
     
     spots = db.relationship('ParkingSpot', backref='parking_lot', lazy=True, cascade="all, delete-orphan")
+    occupancy = db.relationship('LotOccupancy', backref='parking_lot', uselist=False, lazy=True, cascade="all, delete-orphan")
+
+# Denormalized free/occupied counters per lot so list views don't have to load every spot.
+# Kept in step by the reserve/release/lot-edit paths (see occupancy.py), rebuilt by reconcile.
+class LotOccupancy(db.Model):
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), primary_key=True)
+    free_spots = db.Column(db.Integer, nullable=False, default=0)
+    occupied_spots = db.Column(db.Integer, nullable=False, default=0)
 
 class ParkingSpot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,6 +62,11 @@ class ParkingSpot(db.Model):
     is_occupied = db.Column(db.Boolean, default=False)
     
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
+    change_version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+
+    __table_args__ = (
+        db.Index('ix_parking_spot_lot_occupied', 'lot_id', 'is_occupied'),
+    )
 
 class Reservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,4 +78,69 @@ class Reservation(db.Model):
     total_cost = db.Column(db.Float, default=0.0)
     active = db.Column(db.Boolean, default=True) # True if car is currently parked
 
-    spot = db.relationship('ParkingSpot', backref='reservations', lazy=True)
\ No newline at end of file
+    spot = db.relationship('ParkingSpot', backref='reservations', lazy=True)
+
+    # Hot-path indexes. Existing databases get them through migrations.py.
+    __table_args__ = (
+        db.Index('ix_reservation_spot_active', 'spot_id', 'active'),
+        db.Index('ix_reservation_user_start', 'user_id', 'start_time'),
+        db.Index('ix_reservation_start_time', 'start_time'),
+        db.Index('ix_reservation_end_time', 'end_time'),
+    )
+
+# ANALYTICS ROLLUPS
+# (lot, day) -> revenue / bookings / completed sessions / parked seconds, kept up to date by
+# reserve + release (see rollups.py) so per-lot analytics read ~30 rows instead of raw history.
+# bookings count on the day a session starts, the rest on the day it is closed (UTC days).
+
+class DailyStatColumns:
+    day = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    total_duration_seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+class LotDailyStat(DailyStatColumns, db.Model):
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), primary_key=True)
+
+    # primary key starts with day; per-lot reads and the archive move go by lot
+    __table_args__ = (
+        db.Index('ix_lot_daily_stat_lot_day', 'lot_id', 'day'),
+    )
+
+# same numbers per user, for the user-side lot analytics
+class UserLotDailyStat(DailyStatColumns, db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_user_lot_daily_stat_lot_user_day', 'lot_id', 'user_id', 'day'),
+    )
+
+
+# Delta sync for /parking-lots?since=N (see sync.py)
+# Single row: below which version tombstones were pruned. `version` is the old global counter,
+# only read once to seed SyncChange (migration 0005).
+class SyncState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    tombstones_from = db.Column(db.Integer, nullable=False, default=0)
+
+# One row per transaction that wrote lots/spots: id = its change version. done=False while the
+# writer hasn't committed yet (server databases only, see sync.py)
+class SyncChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    done = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_sync_change_open', 'done', 'id'),
+    )
+
+# Deleted lots/spots, so clients holding them can drop them
+class SyncTombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'lot' | 'spot'
+    entity_id = db.Column(db.Integer, nullable=False)
+    change_version = db.Column(db.Integer, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
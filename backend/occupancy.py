@@ -0,0 +1,111 @@
+from sqlalchemy import func, case, update, delete, insert, select
+from models.models import db, ParkingLot, ParkingSpot, LotOccupancy
+
+# Notes to me:
+# Per-lot free/occupied counters (LotOccupancy) so /available-lots, /analytics and
+# /parking-lots don't have to walk every spot of every lot.
+# All helpers only touch db.session -- the caller's commit/rollback decides, so the
+# counters always move in the same transaction as the spots themselves.
+
+
+def _occupied_expr():
+    return func.coalesce(func.sum(case((ParkingSpot.is_occupied.is_(True), 1), else_=0)), 0)
+
+
+def init_lot_occupancy(lot_id, free_spots, occupied_spots=0):
+    """Counter row for a freshly created lot."""
+    db.session.add(LotOccupancy(lot_id=lot_id, free_spots=free_spots, occupied_spots=occupied_spots))
+
+
+def adjust_lot_occupancy(lot_id, occupied_delta=0, free_delta=None):
+    """
+    Shift the counters of one lot by a delta (single UPDATE, no spot loading).
+    By default a spot that becomes occupied stops being free and vice versa,
+    pass free_delta explicitly when spots are added/removed instead.
+    """
+    if free_delta is None:
+        free_delta = -occupied_delta
+    if not occupied_delta and not free_delta:
+        return
+
+    result = db.session.execute(
+        update(LotOccupancy)
+        .where(LotOccupancy.lot_id == lot_id)
+        .values(
+            free_spots=LotOccupancy.free_spots + free_delta,
+            occupied_spots=LotOccupancy.occupied_spots + occupied_delta,
+        )
+    )
+    if result.rowcount == 0:
+        # lot predates the counters -> build its row from the spots
+        refresh_lot_occupancy(lot_id)
+
+
+def refresh_lot_occupancy(lot_id):
+    """Recount a single lot from ParkingSpot (one aggregate query)."""
+    total, occupied = db.session.query(
+        func.count(ParkingSpot.id), _occupied_expr()
+    ).filter(ParkingSpot.lot_id == lot_id).one()
+
+    row = db.session.get(LotOccupancy, lot_id)
+    if row is None:
+        row = LotOccupancy(lot_id=lot_id)
+        db.session.add(row)
+    row.occupied_spots = int(occupied or 0)
+    row.free_spots = int(total or 0) - row.occupied_spots
+    return row
+
+
+def get_lot_occupancy(lot_id):
+    """Counter row of one lot (recounted if it doesn't exist yet). Doesn't commit."""
+    row = db.session.get(LotOccupancy, lot_id)
+    if row is None:
+        row = refresh_lot_occupancy(lot_id)
+    return row
+
+
+def reconcile_occupancy():
+    """Rebuild every counter row from ParkingSpot. Returns the number of lots rebuilt."""
+    counts = (
+        select(
+            ParkingLot.id,
+            func.count(ParkingSpot.id) - _occupied_expr(),
+            _occupied_expr(),
+        )
+        .select_from(ParkingLot)
+        .outerjoin(ParkingSpot, ParkingSpot.lot_id == ParkingLot.id)
+        .group_by(ParkingLot.id)
+    )
+    try:
+        db.session.execute(delete(LotOccupancy))
+        result = db.session.execute(
+            insert(LotOccupancy).from_select(['lot_id', 'free_spots', 'occupied_spots'], counts)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result.rowcount
+
+
+def lot_occupancy_map():
+    """
+    {lot_id: (free_spots, occupied_spots)} for every lot in one small query.
+    Lots without a counter row yet (older databases) get recounted once and saved.
+    """
+    rows = (
+        db.session.query(ParkingLot.id, LotOccupancy.free_spots, LotOccupancy.occupied_spots)
+        .outerjoin(LotOccupancy, LotOccupancy.lot_id == ParkingLot.id)
+        .all()
+    )
+    out = {}
+    missing = False
+    for lot_id, free, occupied in rows:
+        if free is None:
+            row = refresh_lot_occupancy(lot_id)
+            free, occupied = row.free_spots, row.occupied_spots
+            missing = True
+        out[lot_id] = (free, occupied)
+    if missing:
+        db.session.commit()
+    return out
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from models.models import db, LotOccupancy
+
+# Notes to me:
+# Occupancy changes pushed to the dashboards over SSE (/api/stream/occupancy) instead of polling.
+# reserve/release/admin release call publish_occupancy() after their commit. The event goes out on
+# the bus (broadcast.py: Redis pub/sub, MemoryBus stand-in), so every worker -- including the one that
+# published it -- gets it through its subscriber and appends it to a small ring buffer.
+# SSE clients read from that buffer: a reconnect with Last-Event-ID replays what it missed, and
+# an id that's no longer in the buffer (too old, worker started later) gets a "reset" event so the
+# client reloads everything once.
+# Event ids are "<ms>-<token>-<n>": unique across workers, order is the bus' delivery order.
+# The stream needs no login (EventSource can't send the Bearer header), so events carry only what
+# /available-lots shows anyway: lot counters and which spot ids flipped -- nothing about who.
+
+log = logging.getLogger(__name__)
+
+
+class OccupancyStream:
+    CHANNEL = 'occupancy'
+
+    def __init__(self, bus=None, history=1000, heartbeat=15, max_seconds=300):
+        self.bus = bus
+        self.heartbeat = heartbeat
+        self.max_seconds = max_seconds
+        self._events = deque(maxlen=history)  # (seq, event id, payload json)
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._counter = 0
+        self._token = uuid.uuid4().hex[:8]
+        self._listening_pid = None
+        self.published = 0
+        self.received = 0
+
+    def configure(self, bus=None, history=None, heartbeat=None, max_seconds=None):
+        with self._cond:
+            if bus is not None:
+                self.bus = bus
+                self._listening_pid = None
+            if history is not None:
+                self._events = deque(self._events, maxlen=history)
+            if heartbeat is not None:
+                self.heartbeat = heartbeat
+            if max_seconds is not None:
+                self.max_seconds = max_seconds
+
+    def _listen(self):
+        # lazily, in the worker process itself (threads don't survive a fork)
+        if self.bus is None or self._listening_pid == os.getpid():
+            return
+        self._listening_pid = os.getpid()
+        try:
+            self.bus.subscribe(self.CHANNEL, self._on_message)
+        except Exception:
+            log.warning("could not subscribe to %s", self.CHANNEL, exc_info=True)
+            self._listening_pid = None
+
+    def _on_message(self, message):
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event['id'], json.dumps(event['data'])))
+            self.received += 1
+            self._cond.notify_all()
+
+    def publish(self, lots, spots):
+        """lots: [{id, free_spots, occupied_spots}], spots: [{id, lot_id, is_occupied}]."""
+        if self.bus is None:
+            return
+        self._listen()
+        with self._cond:
+            self._counter += 1
+            event_id = f'{int(time.time() * 1000)}-{self._token}-{self._counter}'
+        message = json.dumps({'id': event_id, 'data': {'lots': lots, 'spots': spots}})
+        try:
+            self.bus.publish(self.CHANNEL, message)
+            self.published += 1
+        except Exception:
+            log.warning("could not publish occupancy event", exc_info=True)
+
+    def _after(self, seq):
+        return [entry for entry in self._events if entry[0] > seq]
+
+    def stream(self, last_event_id=None):
+        """SSE lines for one client; ends after max_seconds (EventSource reconnects by itself)."""
+        self._listen()
+        yield 'retry: 3000\n\n'
+        with self._cond:
+            seq = self._seq
+            found = None
+            if last_event_id:
+                found = next((s for s, event_id, _ in self._events if event_id == last_event_id), None)
+        if found is not None:
+            seq = found
+        elif last_event_id:
+            yield 'event: reset\ndata: {}\n\n'
+
+        deadline = time.monotonic() + self.max_seconds
+        while time.monotonic() < deadline:
+            with self._cond:
+                pending = self._after(seq)
+                if not pending:
+                    self._cond.wait(timeout=min(self.heartbeat, max(0.0, deadline - time.monotonic())))
+                    pending = self._after(seq)
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            if pending[0][0] > seq + 1:
+                # fell behind the ring buffer while waiting
+                yield 'event: reset\ndata: {}\n\n'
+            for entry_seq, event_id, payload in pending:
+                yield f'id: {event_id}\nevent: occupancy\ndata: {payload}\n\n'
+                seq = entry_seq
+
+    def stats(self):
+        with self._cond:
+            return {
+                'published': self.published,
+                'received': self.received,
+                'buffered': len(self._events),
+                'history': self._events.maxlen,
+                'bus': type(self.bus).__name__ if self.bus is not None else None,
+            }
+
+
+occupancy_stream = OccupancyStream()
+
+
+def publish_occupancy(lot_id, spot_ids, is_occupied):
+    """
+    Call after commit: these spots of lot_id became occupied/free. A user dashboard only reloads
+    when one of its own sessions' spots is in there. Reads the lot's counters once.
+    """
+    row = db.session.get(LotOccupancy, lot_id)
+    lots = []
+    if row is not None:
+        lots.append({'id': lot_id, 'free_spots': row.free_spots, 'occupied_spots': row.occupied_spots})
+    spots = [{'id': spot_id, 'lot_id': lot_id, 'is_occupied': bool(is_occupied)} for spot_id in spot_ids]
+    occupancy_stream.publish(lots, spots)
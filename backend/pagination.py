@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+# Notes to me:
+# Keyset (cursor) pagination helpers for the list endpoints.
+# A cursor is the sort key of the last row of the previous page, so the next page is a
+# plain index range scan instead of OFFSET n. Clients pass it back untouched.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def page_size(raw, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(raw) if raw not in (None, '') else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(MAX_PAGE_SIZE, size))
+
+
+def wants_all(raw):
+    """Old unpaginated response, kept behind ?all=1 (or "all": true) for the current frontend."""
+    return str(raw).lower() in ('1', 'true', 'yes')
+
+
+def encode_cursor(*values):
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """Cursor string -> tuple of values converted with `types` (datetime is parsed from ISO)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if len(raw) != len(types):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for v, t in zip(raw, types)
+        )
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise BadCursor('Invalid cursor')
+
+
+def keyset_page(query, columns, cursor_values, size, descending=False):
+    """
+    Apply the keyset filter + ORDER BY + LIMIT for `columns` (the unique sort key).
+    Fetches one extra row to know whether there is a next page.
+    Returns (rows, has_more).
+    """
+    if cursor_values is not None:
+        key = tuple_(*columns)
+        values = tuple_(*cursor_values)
+        query = query.filter(key < values if descending else key > values)
+    order = [c.desc() for c in columns] if descending else list(columns)
+    rows = query.order_by(*order).limit(size + 1).all()
+    return rows[:size], len(rows) > size
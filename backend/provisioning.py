@@ -0,0 +1,61 @@
+from sqlalchemy import select, insert, delete, exists
+from models.models import db, ParkingSpot, Reservation
+from sync import change_version, tombstone_spots
+
+# Notes to me:
+# Bulk spot creation / removal for create_parking_lot and capacity changes.
+# Core executemany in batches (and DELETE .. IN batches of ids) through db.session, so it all lands
+# in the caller's transaction (lot row, occupancy counters, spots commit together) -- no ORM object
+# per spot.
+# Spot numbers keep the old scheme: "<first 3 letters of lot name, upper>-<n>".
+
+BATCH_SIZE = 5000
+
+
+def spot_prefix(lot_name):
+    return (lot_name or '')[:3].upper()
+
+
+def add_spots(lot_id, prefix, first, last, batch_size=BATCH_SIZE):
+    """Insert spots numbered first..last (inclusive). Returns how many were added."""
+    version = change_version() if last >= first else None
+    for start in range(first, last + 1, batch_size):
+        stop = min(start + batch_size, last + 1)
+        db.session.execute(
+            insert(ParkingSpot.__table__),
+            [
+                {'spot_number': f"{prefix}-{i}", 'lot_id': lot_id, 'is_occupied': False, 'change_version': version}
+                for i in range(start, stop)
+            ],
+        )
+    return max(0, last - first + 1)
+
+
+def remove_free_spots(lot_id, count, batch_size=BATCH_SIZE):
+    """
+    Drop `count` free spots when shrinking, newest first. Spots with reservation history are
+    kept -- their reservations still point at them.
+    Returns False when the lot doesn't have that many removable spots (nothing removed, or -- a spot
+    got booked in between -- the caller's transaction has to be rolled back).
+    """
+    has_history = exists().where(Reservation.spot_id == ParkingSpot.id)
+    # ids first, then DELETE .. IN (ids): MySQL rejects LIMIT inside an IN subquery
+    ids = db.session.execute(
+        select(ParkingSpot.id)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.is_occupied.isnot(True), ~has_history)
+        .order_by(ParkingSpot.id.desc())
+        .limit(count)
+        .with_for_update()
+    ).scalars().all()
+    if len(ids) < count:
+        return False
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        tombstone_spots(ParkingSpot.id.in_(batch))
+        deleted = db.session.execute(
+            delete(ParkingSpot).where(ParkingSpot.id.in_(batch), ParkingSpot.is_occupied.isnot(True)),
+            execution_options={'synchronize_session': False},
+        ).rowcount
+        if deleted != len(batch):
+            return False
+    return True
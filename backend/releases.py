@@ -0,0 +1,116 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import select, update
+from models.models import db, ParkingLot, ParkingSpot, Reservation
+from occupancy import adjust_lot_occupancy
+from allocator import spot_allocator
+from rollups import record_closed_many
+from sync import change_version
+from billing import billing_engine
+from cache import lot_cache
+from occupancy_stream import publish_occupancy
+
+# Notes to me:
+# Bulk release: close + bill many active reservations in ONE transaction, set-based --
+#   1 SELECT of the sessions (spot, lot, rate along), 1 executemany UPDATE of the reservations,
+#   1 UPDATE .. IN of the spots, 1 counter UPDATE per lot, rollup upserts per (lot, day) / (user, lot, day).
+# Used by POST /release-spots (reservation ids), POST /parking-spots/release (spot ids) and
+# POST /parking-lot/<id>/evacuate. Evacuating a 2000-spot lot used to be 2000 round trips, each with its
+# own commit + cache bump; the caller now commits, bumps lot_cache and publishes occupancy once.
+# The SELECT locks the rows (FOR UPDATE on servers, the IMMEDIATE write lock on SQLite), so a single
+# release running at the same time can't bill a session twice.
+# Request lists are capped at BULK_RELEASE_MAX_ITEMS ids (evacuation isn't, it's one lot).
+# Billed by billing.py, like the single release paths.
+
+MAX_ITEMS = 5000
+
+
+def parse_ids(value, limit=MAX_ITEMS):
+    """Request list of ids -> de-duplicated list of ints. ValueError with a message for the client."""
+    if not isinstance(value, list) or not value:
+        raise ValueError('Expected a non-empty list of ids')
+    if len(value) > limit:
+        raise ValueError(f'At most {limit} ids per request')
+    try:
+        return list(dict.fromkeys(int(v) for v in value))
+    except (TypeError, ValueError):
+        raise ValueError('Ids must be integers')
+
+
+def release_reservations(*where):
+    """
+    Close and bill every ACTIVE reservation matching `where` (conditions on Reservation / ParkingSpot).
+    Doesn't commit. Returns {'items': [...], 'total_cost': .., 'lots': {lot_id: [freed spot ids]}};
+    each item is {reservation_id, spot_id, lot_id, user_id, total_cost}.
+    """
+    rows = db.session.execute(
+        select(
+            Reservation.id, Reservation.user_id, Reservation.start_time,
+            ParkingSpot.id, ParkingSpot.lot_id, ParkingSpot.is_occupied, ParkingLot.price_per_hour,
+        )
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(Reservation.active.is_(True), *where)
+        .order_by(Reservation.id)
+        .with_for_update(of=Reservation)
+    ).all()
+    if not rows:
+        return {'items': [], 'total_cost': 0.0, 'lots': {}}
+
+    end_time = datetime.now(timezone.utc)
+    items, params, closed = [], [], []
+    by_lot, freed = defaultdict(list), defaultdict(list)
+    for res_id, user_id, start_time, spot_id, lot_id, is_occupied, rate in rows:
+        cost = billing_engine.session_cost(start_time, end_time, rate)
+        params.append({'id': res_id, 'end_time': end_time, 'total_cost': cost, 'active': False})
+        closed.append((lot_id, user_id, start_time, end_time, cost))
+        items.append({
+            'reservation_id': res_id, 'spot_id': spot_id, 'lot_id': lot_id,
+            'user_id': user_id, 'total_cost': cost,
+        })
+        by_lot[lot_id].append(spot_id)
+        if is_occupied:
+            freed[lot_id].append(spot_id)
+
+    # executemany UPDATE by primary key, no ORM objects loaded
+    db.session.execute(update(Reservation), params)
+
+    spot_ids = [spot_id for ids in by_lot.values() for spot_id in ids]
+    spots = ParkingSpot.__table__
+    db.session.execute(
+        update(spots).where(spots.c.id.in_(spot_ids)).values(is_occupied=False, change_version=change_version())
+    )
+
+    for lot_id, ids in freed.items():
+        adjust_lot_occupancy(lot_id, occupied_delta=-len(ids))
+        spot_allocator.release(lot_id, ids)
+    record_closed_many(closed)
+
+    return {
+        'items': items,
+        'total_cost': round(sum(item['total_cost'] for item in items), 2),
+        'lots': dict(by_lot),
+    }
+
+
+def announce_release(result):
+    """Call after commit: one cache bump for all touched lots, one occupancy event per lot."""
+    if not result['lots']:
+        return
+    lot_cache.bump(*result['lots'])
+    for lot_id, spot_ids in result['lots'].items():
+        publish_occupancy(lot_id, spot_ids, False)
+
+
+def release_payload(result, requested=None, key='reservation_id'):
+    """Response body: per-item costs, plus the requested ids that had nothing active to release."""
+    done = {item[key] for item in result['items']}
+    payload = {
+        'message': f"Released {len(result['items'])} reservation(s)",
+        'released': len(result['items']),
+        'total_cost': result['total_cost'],
+        'items': result['items'],
+    }
+    if requested is not None:
+        payload['not_released'] = [i for i in requested if i not in done]
+    return payload
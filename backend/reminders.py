@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, exists, and_, or_
+from models.models import db, User, Role, Reservation, roles_users
+
+# Notes to me:
+# Daily reminder ("you have no spot booked") helpers for tasks.send_daily_reminder.
+#  - candidates come from one anti-join query (no active reservation, not admin, not reminded
+#    within the window), read in keyset chunks of ids -- no User.query.all(), no query per user
+#  - each chunk becomes its own celery task; it first claims its users by stamping
+#    last_reminded_at (conditional UPDATE, re-checking "no active reservation" since the chunk may
+#    have waited in the queue), so overlapping runs / retried chunks never mail the same user twice
+#    inside the window, then sends over one SMTP connection
+# Window is a bit under a day so a daily beat that fires a few seconds early still sends.
+
+DEFAULT_WINDOW_HOURS = 20
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _not_reminded_since(cutoff):
+    return or_(User.last_reminded_at.is_(None), User.last_reminded_at < cutoff)
+
+
+def _has_active_reservation():
+    return exists().where(and_(Reservation.user_id == User.id, Reservation.active.is_(True)))
+
+
+def reminder_candidates(window_hours=DEFAULT_WINDOW_HOURS, chunk_size=DEFAULT_CHUNK_SIZE, now=None):
+    """Yields lists of user ids (at most chunk_size each) that should get a reminder."""
+    now = now or datetime.utcnow()
+    has_active = _has_active_reservation()
+    is_admin = exists().where(and_(
+        roles_users.c.user_id == User.id,
+        roles_users.c.role_id == Role.id,
+        Role.name == 'admin',
+    ))
+    due = and_(
+        ~has_active,
+        ~is_admin,
+        _not_reminded_since(now - timedelta(hours=window_hours)),
+    )
+
+    # keyset over user.id, one short query per chunk: no read cursor stays open while the
+    # chunk tasks are already writing last_reminded_at (SQLite would make them wait)
+    last_id = 0
+    while True:
+        ids = db.session.execute(
+            select(User.id).where(due, User.id > last_id).order_by(User.id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def claim_reminders(user_ids, window_hours=DEFAULT_WINDOW_HOURS, now=None):
+    """
+    Stamp last_reminded_at on the users that are still due and return (id, email, username)
+    for exactly those. Commits, so the claim is visible to other workers before any mail goes out.
+    Users who booked a spot since the candidates were picked aren't due anymore.
+    """
+    now = now or datetime.utcnow()
+    due = and_(
+        User.id.in_(user_ids),
+        ~_has_active_reservation(),
+        _not_reminded_since(now - timedelta(hours=window_hours)),
+    )
+
+    if db.session.get_bind().dialect.update_returning:
+        claimed = db.session.execute(
+            update(User).where(due).values(last_reminded_at=now)
+            .returning(User.id, User.email, User.username)
+            .execution_options(synchronize_session=False)
+        ).all()
+    else:
+        claimed = db.session.execute(
+            select(User.id, User.email, User.username).where(due).with_for_update()
+        ).all()
+        if claimed:
+            db.session.execute(
+                update(User).where(User.id.in_([row.id for row in claimed]))
+                .values(last_reminded_at=now)
+                .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
+    return claimed
+
+
+def unclaim_reminders(user_ids):
+    """Mail didn't go out -- let the next run pick these users up again."""
+    if not user_ids:
+        return
+    db.session.execute(
+        update(User).where(User.id.in_(user_ids)).values(last_reminded_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
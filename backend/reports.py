@@ -0,0 +1,105 @@
+from datetime import datetime
+from html import escape
+from sqlalchemy import select, func
+from models.models import db, User, ParkingLot, ParkingSpot, Reservation
+
+# Notes to me:
+# Queries behind the monthly admin report (tasks.generate_monthly_report).
+# The month is a half-open start_time range [first of month, first of next month) so the
+# start_time index is used -- extract('month', ...) can't use it.
+# Totals / per-lot / per-day are aggregated in SQL; the detail list is one joined query
+# read with yield_per.
+
+DETAIL_HEADER = ['Reservation ID', 'User', 'Lot', 'Spot', 'Start', 'End', 'Cost']
+
+
+def month_range(now):
+    start = datetime(now.year, now.month, 1)
+    end = datetime(now.year + 1, 1, 1) if now.month == 12 else datetime(now.year, now.month + 1, 1)
+    return start, end
+
+
+def _in_range(start, end):
+    return (Reservation.start_time >= start) & (Reservation.start_time < end)
+
+
+def month_totals(start, end):
+    """(bookings, revenue) for reservations started in [start, end)."""
+    bookings, revenue = db.session.execute(
+        select(func.count(Reservation.id), func.coalesce(func.sum(Reservation.total_cost), 0.0))
+        .where(_in_range(start, end))
+    ).one()
+    return bookings, float(revenue)
+
+
+def revenue_by_lot(start, end):
+    """[(lot name, bookings, revenue)], biggest revenue first."""
+    revenue = func.coalesce(func.sum(Reservation.total_cost), 0.0)
+    return db.session.execute(
+        select(ParkingLot.name, func.count(Reservation.id), revenue)
+        .select_from(Reservation)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(_in_range(start, end))
+        .group_by(ParkingLot.id, ParkingLot.name)
+        .order_by(revenue.desc(), ParkingLot.name)
+    ).all()
+
+
+def revenue_by_day(start, end):
+    """[(day 'YYYY-MM-DD', bookings, revenue)] in date order."""
+    day = func.date(Reservation.start_time)
+    return db.session.execute(
+        select(day, func.count(Reservation.id), func.coalesce(func.sum(Reservation.total_cost), 0.0))
+        .where(_in_range(start, end))
+        .group_by(day)
+        .order_by(day)
+    ).all()
+
+
+def detail_rows(start, end, chunk_size=1000):
+    """Yields (id, email, lot, spot, start, end, cost) for the month, in start_time order."""
+    query = (
+        select(Reservation.id, User.email, ParkingLot.name, ParkingSpot.spot_number,
+               Reservation.start_time, Reservation.end_time, Reservation.total_cost)
+        .join(User, Reservation.user_id == User.id)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(_in_range(start, end))
+        .order_by(Reservation.start_time, Reservation.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    yield from db.session.execute(query)
+
+
+def render_report(now, totals, by_lot, by_day, details=None, attached=None):
+    """
+    HTML body. `details` are detail_rows() to list inline; when the detail went into an
+    attachment instead, pass its file name as `attached`.
+    """
+    bookings, revenue = totals
+    parts = [
+        f"<h1>Monthly Report: {now.strftime('%B %Y')}</h1>",
+        f"<p>Total Revenue: <strong>₹{revenue}</strong></p>",
+        f"<p>Total Bookings: <strong>{bookings}</strong></p>",
+    ]
+
+    if by_lot:
+        parts.append("<h2>By Lot</h2><table><tr><th>Lot</th><th>Bookings</th><th>Revenue</th></tr>")
+        parts.extend(f"<tr><td>{escape(name)}</td><td>{count}</td><td>₹{total}</td></tr>" for name, count, total in by_lot)
+        parts.append("</table>")
+    if by_day:
+        parts.append("<h2>By Day</h2><table><tr><th>Day</th><th>Bookings</th><th>Revenue</th></tr>")
+        parts.extend(f"<tr><td>{day}</td><td>{count}</td><td>₹{total}</td></tr>" for day, count, total in by_day)
+        parts.append("</table>")
+
+    if attached:
+        parts.append(f"<p>All {bookings} bookings are listed in the attached {escape(attached)}.</p>")
+    else:
+        parts.append("<ul>")
+        parts.extend(
+            f"<li>User: {escape(email)} | Spot: {escape(spot)} | Cost: ₹{cost}</li>"
+            for _id, email, _lot, spot, _start, _end, cost in (details or ())
+        )
+        parts.append("</ul>")
+    return ''.join(parts)
@@ -0,0 +1,204 @@
+from datetime import timezone
+from sqlalchemy import func, select, update, delete, literal
+from models.models import db, ParkingSpot, Reservation, LotDailyStat, UserLotDailyStat
+
+# Notes to me:
+# Maintains the (lot, day) and (user, lot, day) rollups used by the per-lot analytics.
+# Like occupancy.py, everything goes through db.session so the rollup moves in the same
+# transaction as the reservation it describes.
+
+STAT_FIELDS = ('revenue', 'bookings', 'completed', 'total_duration_seconds')
+
+
+def _utc(dt):
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _upsert_insert():
+    """insert() construct with ON CONFLICT support for the current database, or None."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _upsert(model, keys, deltas):
+    """INSERT the row or add the deltas onto the existing one."""
+    values = {field: 0 for field in STAT_FIELDS}
+    values.update(deltas)
+
+    dialect_insert = _upsert_insert()
+    if dialect_insert is not None:
+        stmt = dialect_insert(model).values(**keys, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={field: getattr(model, field) + stmt.excluded[field] for field in deltas},
+        )
+        db.session.execute(stmt)
+        return
+
+    # other databases: update, insert if nothing was there
+    conditions = [getattr(model, k) == v for k, v in keys.items()]
+    result = db.session.execute(
+        update(model).where(*conditions)
+        .values({field: getattr(model, field) + delta for field, delta in deltas.items()})
+    )
+    if result.rowcount == 0:
+        db.session.add(model(**keys, **values))
+
+
+def bump_daily_stats(lot_id, user_id, day, **deltas):
+    _upsert(LotDailyStat, {'lot_id': lot_id, 'day': day}, deltas)
+    if user_id is not None:
+        _upsert(UserLotDailyStat, {'user_id': user_id, 'lot_id': lot_id, 'day': day}, deltas)
+
+
+def record_bookings(lot_id, user_id, start_time, count=1):
+    """New session(s) started in a lot."""
+    bump_daily_stats(lot_id, user_id, _utc(start_time).date(), bookings=count)
+
+
+def record_closed(reservation, lot_id):
+    """A session was closed and billed: revenue + duration on the day it ended."""
+    start = _utc(reservation.start_time)
+    end = _utc(reservation.end_time)
+    if end is None:
+        return
+    duration = max(0.0, (end - start).total_seconds()) if start else 0.0
+    bump_daily_stats(
+        lot_id, reservation.user_id, end.date(),
+        revenue=float(reservation.total_cost or 0.0),
+        completed=1,
+        total_duration_seconds=duration,
+    )
+
+
+def record_closed_many(closed):
+    """
+    Batch version of record_closed for bulk releases: `closed` yields
+    (lot_id, user_id, start_time, end_time, cost). One upsert per (lot, day) and per (user, lot, day)
+    instead of two per reservation.
+    """
+    lot_deltas = {}
+    user_deltas = {}
+    for lot_id, user_id, start_time, end_time, cost in closed:
+        start, end = _utc(start_time), _utc(end_time)
+        if end is None:
+            continue
+        duration = max(0.0, (end - start).total_seconds()) if start else 0.0
+        for deltas, key in ((lot_deltas, (lot_id, end.date())), (user_deltas, (user_id, lot_id, end.date()))):
+            row = deltas.setdefault(key, {'revenue': 0.0, 'completed': 0, 'total_duration_seconds': 0.0})
+            row['revenue'] += float(cost or 0.0)
+            row['completed'] += 1
+            row['total_duration_seconds'] += duration
+    for (lot_id, day), deltas in lot_deltas.items():
+        _upsert(LotDailyStat, {'lot_id': lot_id, 'day': day}, deltas)
+    for (user_id, lot_id, day), deltas in user_deltas.items():
+        if user_id is not None:
+            _upsert(UserLotDailyStat, {'user_id': user_id, 'lot_id': lot_id, 'day': day}, deltas)
+
+
+def move_lot_stats(from_lot_id, to_lot_id):
+    """Spots (and their history) moved to another lot, e.g. the archive: move the rollups too."""
+    dialect_insert = _upsert_insert()
+    for model in (LotDailyStat, UserLotDailyStat):
+        key_names = ['lot_id', 'day'] + (['user_id'] if model is UserLotDailyStat else [])
+        if dialect_insert is not None:
+            # one INSERT .. SELECT, adding onto rows the target already has for that day
+            columns = key_names + list(STAT_FIELDS)
+            source = select(
+                literal(to_lot_id).label('lot_id'),
+                *[getattr(model, name) for name in columns[1:]]
+            ).where(model.lot_id == from_lot_id)
+            stmt = dialect_insert(model).from_select(columns, source)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_names,
+                set_={field: getattr(model, field) + stmt.excluded[field] for field in STAT_FIELDS},
+            )
+            db.session.execute(stmt)
+        else:
+            for row in model.query.filter(model.lot_id == from_lot_id).all():
+                keys = {name: getattr(row, name) for name in key_names}
+                keys['lot_id'] = to_lot_id
+                _upsert(model, keys, {field: getattr(row, field) for field in STAT_FIELDS})
+        db.session.execute(delete(model).where(model.lot_id == from_lot_id))
+
+
+def daily_rows(lot_id, since, user_id=None):
+    """Rollup rows of a lot from `since` (a date) on -- one row per day at most."""
+    model = LotDailyStat if user_id is None else UserLotDailyStat
+    q = model.query.filter(model.lot_id == lot_id, model.day >= since)
+    if user_id is not None:
+        q = q.filter(model.user_id == user_id)
+    return q.all()
+
+
+def lifetime_totals(lot_id, user_id=None):
+    """(revenue, bookings, completed, total_duration_seconds) over the whole history of a lot."""
+    model = LotDailyStat if user_id is None else UserLotDailyStat
+    q = db.session.query(*[func.coalesce(func.sum(getattr(model, f)), 0) for f in STAT_FIELDS]) \
+        .filter(model.lot_id == lot_id)
+    if user_id is not None:
+        q = q.filter(model.user_id == user_id)
+    return q.one()
+
+
+def backfill_daily_stats(chunk_size=5000):
+    """
+    Rebuild both rollups from the raw reservation history.
+    Streams reservations in chunks and aggregates in Python so it works on any database.
+    Returns the number of reservations read.
+    """
+    lot_stats = {}
+    user_stats = {}
+
+    def add(lot_id, user_id, day, field, amount):
+        for stats, key in ((lot_stats, (lot_id, day)), (user_stats, (user_id, lot_id, day))):
+            row = stats.setdefault(key, dict.fromkeys(STAT_FIELDS, 0))
+            row[field] += amount
+
+    query = (
+        select(ParkingSpot.lot_id, Reservation.user_id, Reservation.start_time,
+               Reservation.end_time, Reservation.total_cost, Reservation.active)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    seen = 0
+    for lot_id, user_id, start_time, end_time, total_cost, active in db.session.execute(query):
+        seen += 1
+        start = _utc(start_time)
+        end = _utc(end_time)
+        if start:
+            add(lot_id, user_id, start.date(), 'bookings', 1)
+        if end and not active:
+            add(lot_id, user_id, end.date(), 'revenue', float(total_cost or 0.0))
+            add(lot_id, user_id, end.date(), 'completed', 1)
+            add(lot_id, user_id, end.date(), 'total_duration_seconds',
+                max(0.0, (end - start).total_seconds()) if start else 0.0)
+
+    try:
+        db.session.execute(delete(LotDailyStat))
+        db.session.execute(delete(UserLotDailyStat))
+        if lot_stats:
+            db.session.execute(db.insert(LotDailyStat), [
+                {'lot_id': lot_id, 'day': day, **row} for (lot_id, day), row in lot_stats.items()
+            ])
+        if user_stats:
+            db.session.execute(db.insert(UserLotDailyStat), [
+                {'user_id': user_id, 'lot_id': lot_id, 'day': day, **row}
+                for (user_id, lot_id, day), row in user_stats.items()
+            ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return seen
@@ -1,10 +1,26 @@
-from flask import Blueprint, request, jsonify
-from models.models import db, User, ParkingLot, ParkingSpot, Reservation
-from cache import cache
+from flask import Blueprint, request, jsonify, current_app, g
+from models.models import db, User, ParkingLot, ParkingSpot, Reservation, LotOccupancy
+from bisect import bisect_right
+from cache import lot_cache, lot_index
+from etags import versioned_etag, lots_tag, priced_lots_tag, users_tag
+from occupancy_stream import publish_occupancy
+from allocator import spot_allocator
+from rollups import record_closed, daily_rows, lifetime_totals
+from occupancy import (
+    init_lot_occupancy, adjust_lot_occupancy, refresh_lot_occupancy,
+    get_lot_occupancy, lot_occupancy_map
+)
 from datetime import datetime, date, timedelta, timezone
 
-import time
-from sqlalchemy import func, and_, not_ 
+from sqlalchemy import func, and_, not_
+from sqlalchemy.orm import selectinload, joinedload
+from archive import get_archive_lot, archive_lot_spots, drop_lot_spots
+from provisioning import spot_prefix, add_spots, remove_free_spots
+from pagination import page_size, wants_all, encode_cursor, decode_cursor, keyset_page, BadCursor
+from sync import changes_since, current_state
+from spotgrid import grid_format, grid_response, encode_spots
+from billing import billing_engine
+from releases import MAX_ITEMS, parse_ids, release_reservations, announce_release, release_payload
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -24,20 +40,6 @@ def _close_and_bill_reservation(reservation):
 
     end_time = datetime.now(timezone.utc)
 
-    start_time = reservation.start_time
-    if start_time is None:
-        start_time = end_time
-
-    if getattr(start_time, 'tzinfo', None) is None:
-        
-        start_time = start_time.replace(tzinfo=timezone.utc)
-    else:
-        start_time = start_time.astimezone(timezone.utc)
-
-    duration = end_time - start_time
-    hours = max(1.0, duration.total_seconds() / 3600.0)
-    # minutes = max(1, duration.total_seconds() / 60)
-
     # defensive retrieval of rate
     rate = 0.0
     try:
@@ -46,8 +48,7 @@ def _close_and_bill_reservation(reservation):
     except Exception:
         rate = float(getattr(reservation, 'rate', 0.0) or 0.0)
 
-    cost = round(hours * rate, 2)
-    # cost = round((minutes / 60) * rate, 2)
+    cost = billing_engine.session_cost(reservation.start_time, end_time, rate)
 
     reservation.end_time = end_time
     reservation.total_cost = cost
@@ -56,6 +57,10 @@ def _close_and_bill_reservation(reservation):
     # free the spot if relationship exists
     try:
         if reservation.spot:
+            record_closed(reservation, reservation.spot.lot_id)
+            if reservation.spot.is_occupied:
+                adjust_lot_occupancy(reservation.spot.lot_id, occupied_delta=-1)
+                spot_allocator.release(reservation.spot.lot_id, [reservation.spot.id])
             reservation.spot.is_occupied = False
     except Exception:
         
@@ -68,31 +73,25 @@ def _close_and_bill_reservation(reservation):
 # Parking lots: list
 # --
 
-@admin_bp.route('/parking-lots', methods=['GET'])
-def get_parking_lots():
-    lots = ParkingLot.query.all()
-    
-    archive_name = "Deleted - Archived History"
-    
-    # Sort: Normal lots (0) first, Archive (1) last. Secondary sort by ID.
-    sorted_lots = sorted(lots, key=lambda x: (1 if x.name == archive_name else 0, x.id))
-
-    output = []
-    
-    for lot in sorted_lots:   
+def _lot_detail_fragments(lot_ids):
+    """Cache builder for get_parking_lots: lot fields + its spots, one query for all missed lots."""
+    lots = ParkingLot.query.options(selectinload(ParkingLot.spots)).filter(ParkingLot.id.in_(lot_ids)).all()
+    occupancy = lot_occupancy_map()
+    built = {}
+    for lot in lots:
         try:
             ordered_spots = sorted(lot.spots, key=lambda s: s.spot_number)
         except Exception:
             ordered_spots = list(lot.spots)
 
-        output.append({
+        built[lot.id] = {
             'id': lot.id,
             'name': lot.name,
             'address': lot.address,
             'pin_code': lot.pin_code,
             'capacity': lot.capacity,
             'price_per_hour': lot.price_per_hour,
-            'active_spots': len([s for s in lot.spots if not s.is_occupied]),
+            'active_spots': occupancy.get(lot.id, (0, 0))[0],
             'spots': [
                 {
                     'id': s.id,
@@ -101,7 +100,134 @@ def get_parking_lots():
                 }
                 for s in ordered_spots
             ],
-        })
+        }
+    return built
+
+
+def _lot_grid_fragments(lot_ids, binary=False):
+    """Same as _lot_detail_fragments, spots as one compact grid (spotgrid.py, id order) per lot."""
+    lots = ParkingLot.query.filter(ParkingLot.id.in_(lot_ids)).all()
+    rows = (
+        db.session.query(ParkingSpot.lot_id, ParkingSpot.id, ParkingSpot.spot_number, ParkingSpot.is_occupied)
+        .filter(ParkingSpot.lot_id.in_(lot_ids))
+        .order_by(ParkingSpot.lot_id, ParkingSpot.id)
+        .all()
+    )
+    columns = {lot.id: ([], [], []) for lot in lots}
+    for lot_id, spot_id, spot_number, is_occupied in rows:
+        ids, numbers, occupied = columns[lot_id]
+        ids.append(spot_id)
+        numbers.append(spot_number)
+        occupied.append(is_occupied)
+    occupancy = lot_occupancy_map()
+    return {
+        lot.id: {
+            'id': lot.id,
+            'name': lot.name,
+            'address': lot.address,
+            'pin_code': lot.pin_code,
+            'capacity': lot.capacity,
+            'price_per_hour': lot.price_per_hour,
+            'active_spots': occupancy.get(lot.id, (0, 0))[0],
+            'spot_grid': encode_spots(*columns[lot.id], binary=binary),
+        }
+        for lot in lots
+    }
+
+
+def _sync_lot(lot, occupancy):
+    return {
+        'id': lot.id,
+        'name': lot.name,
+        'address': lot.address,
+        'pin_code': lot.pin_code,
+        'capacity': lot.capacity,
+        'price_per_hour': lot.price_per_hour,
+        'active_spots': occupancy.get(lot.id, (0, 0))[0],
+        'is_archive': bool(lot.is_archive),
+    }
+
+
+def _lots_delta(since):
+    """
+    ?since=N body: lots (without spots) and spots (flat, with lot_id) written after N, ids deleted
+    after N, and the version to send next time. full_resync=True means "this is everything, drop what
+    you have" -- first sync, or the client is further behind than the kept tombstones.
+    Straight from the DB: a cached fragment could be older than the version we hand out.
+    """
+    changes = changes_since(since)
+    if changes is None:
+        version, _ = current_state()  # read first: anything newer simply comes again next time
+        lots = ParkingLot.query.all()
+        spots = db.session.query(
+            ParkingSpot.id, ParkingSpot.lot_id, ParkingSpot.spot_number, ParkingSpot.is_occupied
+        ).all()
+        deleted = {'lots': [], 'spots': []}
+    else:
+        version, lots, spots, deleted = changes
+    occupancy = lot_occupancy_map() if lots else {}
+    return {
+        'version': version,
+        'full_resync': changes is None,
+        'lots': [_sync_lot(lot, occupancy) for lot in lots],
+        'spots': [
+            {'id': s.id, 'lot_id': s.lot_id, 'spot_number': s.spot_number, 'is_occupied': s.is_occupied}
+            for s in spots
+        ],
+        'deleted': deleted,
+    }
+
+
+# Paginated by default (?limit=&cursor=), ?all=1 returns the old plain list.
+# ?since=<version> is the delta sync mode (see sync.py / _lots_delta), ?since=0 for the first one.
+# ?format=grid (or grid-msgpack, or the Accept types in spotgrid.py): spot_grid instead of spots.
+# Sort: Normal lots (0) first, Archive (1) last, then by ID -- the cached lot index is already in
+# that order, so a page is a slice of it and each lot comes from its own cache fragment.
+@admin_bp.route('/parking-lots', methods=['GET'])
+@versioned_etag(lots_tag)
+def get_parking_lots():
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'message': 'Invalid since'}), 400
+        return jsonify(_lots_delta(since)), 200
+
+    legacy = wants_all(request.args.get('all'))
+    index = lot_index()
+
+    if legacy:
+        page = index
+        has_more = False
+    else:
+        try:
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor, int, int) if cursor else None
+        except BadCursor:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        start = bisect_right(index, cursor) if cursor else 0
+        size = page_size(request.args.get('limit'))
+        page = index[start:start + size]
+        has_more = start + size < len(index)
+
+    lot_ids = [lot_id for _, lot_id in page]
+    fmt = grid_format()
+    if fmt:
+        fragments = lot_cache.get_many(
+            'lot_grid', lot_ids, lambda ids: _lot_grid_fragments(ids, binary=fmt == 'msgpack'), variant=fmt
+        )
+    else:
+        fragments = lot_cache.get_many('lot_detail', lot_ids, _lot_detail_fragments)
+    output = [fragments[lot_id] for lot_id in lot_ids if lot_id in fragments]
+
+    if not legacy:
+        output = {
+            'items': output,
+            'next_cursor': encode_cursor(*page[-1]) if has_more else None
+        }
+    if fmt:
+        return grid_response(output, fmt)
     return jsonify(output), 200
 
 
@@ -128,17 +254,13 @@ def create_parking_lot():
     db.session.add(new_lot)
     db.session.flush()  #
 
-    for i in range(1, capacity + 1):
-        new_spot = ParkingSpot(
-            spot_number=f"{(data.get('name') or '')[:3].upper()}-{i}",
-            lot_id=new_lot.id
-        )
-        db.session.add(new_spot)
+    add_spots(new_lot.id, spot_prefix(data.get('name')), 1, capacity)
 
+    init_lot_occupancy(new_lot.id, free_spots=capacity)
+    spot_allocator.invalidate(new_lot.id)
     db.session.commit()
 
-    cache.delete('available_lots')
-    cache.delete('admin_analytics')
+    lot_cache.bump(new_lot.id, lots=True)
 
     return jsonify({'message': 'Created'}), 201
 
@@ -152,7 +274,7 @@ def update_parking_lot(id):
         return jsonify({'message': 'Parking lot not found'}), 404
     
     # --- NEW CHECK: Block editing the Archive ---
-    if lot.name == "Deleted - Archived History":
+    if lot.is_archive:
         return jsonify({'message': 'System Archive cannot be edited.'}), 403
 
     data = request.get_json() or {}
@@ -178,7 +300,7 @@ def update_parking_lot(id):
             return jsonify({'message': 'Capacity must be at least 1'}), 400
 
         current_capacity = lot.capacity or 0
-        occupied_count = len([s for s in lot.spots if s.is_occupied])
+        occupied_count = get_lot_occupancy(lot.id).occupied_spots
 
         # Cannot shrink below number of occupied spots
         if new_capacity < occupied_count:
@@ -191,29 +313,26 @@ def update_parking_lot(id):
 
         # Increase capacity 
         if new_capacity > current_capacity:
-            for i in range(current_capacity + 1, new_capacity + 1):
-                spot_num = f"{lot.name[:3].upper()}-{i}"
-                db.session.add(ParkingSpot(spot_number=spot_num, lot_id=lot.id))
+            add_spots(lot.id, spot_prefix(lot.name), current_capacity + 1, new_capacity)
+            adjust_lot_occupancy(lot.id, free_delta=new_capacity - current_capacity)
 
         # Decrease capacity (but still >= occupied_count) -> remove free spots
         elif new_capacity < current_capacity:
-            free_spots = [s for s in lot.spots if not s.is_occupied]
-            free_spots.sort(key=lambda s: s.id, reverse=True)
             to_remove = current_capacity - new_capacity
 
-            if to_remove > len(free_spots):
+            if not remove_free_spots(lot.id, to_remove):
+                db.session.rollback()
                 return jsonify({
                     'message': 'Not enough free spots to reduce capacity safely.'
                 }), 400
 
-            for s in free_spots[:to_remove]:
-                db.session.delete(s)
+            adjust_lot_occupancy(lot.id, free_delta=-to_remove)
 
         lot.capacity = new_capacity
+        spot_allocator.invalidate(lot.id)
 
     db.session.commit()
-    cache.delete('available_lots')
-    cache.delete('admin_analytics')
+    lot_cache.bump(lot.id)
 
     return jsonify({'message': 'Parking lot updated successfully'}), 200
 
@@ -276,7 +395,7 @@ def delete_parking_lot(id):
         return jsonify({'message': 'Parking lot not found'}), 404
     
     # Stop ARCHIVE deletion 
-    if lot.name == "Deleted - Archived History":
+    if lot.is_archive:
         return jsonify({'message': 'System Archive cannot be deleted.'}), 403
 
     active_reservations = (
@@ -292,8 +411,6 @@ def delete_parking_lot(id):
         }), 400
 
     try:
-
-        
         has_history = (
             Reservation.query
             .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
@@ -301,43 +418,20 @@ def delete_parking_lot(id):
             .first()
         )
 
+        # everything below is one transaction: spots move (or go), lot goes, one commit
+        archive_id = None
         if has_history:
-            # Get or Create Archive Lot
-            archive_name = "Deleted - Archived History"
-            archive_lot = ParkingLot.query.filter_by(name=archive_name).first()
-            
-            if not archive_lot:
-                archive_lot = ParkingLot(
-                    name=archive_name,
-                    address="Deleted Data Storage",
-                    pin_code="000000",
-                    capacity=0,
-                    price_per_hour=0.0
-                )
-                db.session.add(archive_lot)
-                db.session.commit()
-
-            spots_to_move = list(lot.spots) 
-            
-            for spot in spots_to_move:
-                # Rename spot to indicate deletion
-                #timestamp to avoid a "Duplicate Name" error
-                unique_suffix = str(int(time.time()))
-                new_name = f"{lot.name[:5]}_{spot.spot_number}_{unique_suffix}"
-                
-                spot.spot_number = new_name[:20] # Truncate to fit DB limit
-                spot.lot_id = archive_lot.id
-                spot.is_occupied = True 
-
-            # commit to detach the spots from db
-            db.session.commit()
-
+            archive = get_archive_lot(create=True)
+            archive_id = archive.id
+            archive_lot_spots(lot, archive)
+        else:
+            drop_lot_spots(lot)
 
         db.session.delete(lot)
+        spot_allocator.invalidate(lot.id)
         db.session.commit()
 
-        cache.delete('available_lots')
-        cache.delete('admin_analytics')
+        lot_cache.bump(id, archive_id, lots=True)
 
         return jsonify({'message': 'Parking lot deleted successfully.'}), 200
 
@@ -357,65 +451,107 @@ def get_lot_spots(lot_id):
     {
       id, spot_number, is_occupied,
       reservation: {
-        id, user_id, user_email, start_time (ISO UTC Z), total_cost
+        id, user_id, user_email, start_time (ISO UTC Z), total_cost,
+        running_cost, duration_seconds   (live estimate if released now, billing.py)
       } | None
     }
+    Always 2 queries (lot + one joined spot/reservation/user query) whatever the lot size.
+    ?format=grid / grid-msgpack: {lot_id, spot_grid, reservations: [{spot_id, ...}]} (spotgrid.py).
     """
     lot = ParkingLot.query.get(lot_id)
     if not lot:
         return jsonify({'message': 'Parking lot not found'}), 404
 
-    spots_payload = []
-    for spot in lot.spots:
-        active_res = (
-            Reservation.query
-            .filter_by(spot_id=spot.id, active=True)
-            .order_by(Reservation.start_time.desc())
-            .first()
+    # Optional paging for very large lots: ?offset=0&limit=500 (by spot id)
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = max(1, min(5000, int(limit))) if limit not in (None, '') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid offset or limit'}), 400
+
+    spot_filter = ParkingSpot.lot_id == lot.id
+    if offset or limit:
+        page_ids = (
+            db.select(ParkingSpot.id)
+            .where(ParkingSpot.lot_id == lot.id)
+            .order_by(ParkingSpot.id)
+            .offset(offset)
+            .limit(limit)
         )
+        spot_filter = ParkingSpot.id.in_(page_ids)
+
+    # One round trip: spot + its active reservation (if any) + that user's email
+    rows = (
+        db.session.query(
+            ParkingSpot.id, ParkingSpot.spot_number, ParkingSpot.is_occupied,
+            Reservation.id, Reservation.user_id, Reservation.start_time, Reservation.total_cost,
+            User.email
+        )
+        .outerjoin(Reservation, and_(Reservation.spot_id == ParkingSpot.id, Reservation.active.is_(True)))
+        .outerjoin(User, User.id == Reservation.user_id)
+        .filter(spot_filter)
+        .order_by(ParkingSpot.id, Reservation.start_time.desc())
+        .all()
+    )
 
-        res_info = None
-        if active_res:
-            user_email = None
-            try:
-                user_obj = getattr(active_res, 'user', None)
-                if user_obj and getattr(user_obj, 'email', None):
-                    user_email = user_obj.email
-            except Exception:
-                user_email = None
-
-            # Fallback to explicit lookup if something goes wrong
-            if not user_email and active_res.user_id:
-                user = User.query.get(active_res.user_id)
-                if user:
-                    user_email = user.email
-
+    fmt = grid_format()
+    ids, numbers, occupied, reservations = [], [], [], {}
+    start_times = []
+    seen = set()
+    for spot_id, spot_number, is_occupied, res_id, user_id, start_time, total_cost, user_email in rows:
+        # should never be more than one active reservation per spot, keep the latest if so
+        if spot_id in seen:
+            continue
+        seen.add(spot_id)
+        ids.append(spot_id)
+        numbers.append(spot_number)
+        occupied.append(is_occupied)
+
+        if res_id is not None:
             # ISO formatting
             start_iso = None
-            if active_res.start_time:
-                st = active_res.start_time
+            if start_time:
+                st = start_time
                 if getattr(st, 'tzinfo', None) is None:
                     st = st.replace(tzinfo=timezone.utc)
                 else:
                     st = st.astimezone(timezone.utc)
                 start_iso = st.isoformat().replace('+00:00', 'Z')
 
-            res_info = {
-                'id': active_res.id,
-                'user_id': active_res.user_id,
+            reservations[spot_id] = {
+                'id': res_id,
+                'user_id': user_id,
                 'user_email': user_email or None,
                 'start_time': start_iso,
-                'total_cost': float(active_res.total_cost or 0.0)
+                'total_cost': float(total_cost or 0.0)
             }
+            start_times.append(start_time)
+
+    # every active session of the lot priced in one pass (same rate for all of them)
+    seconds, costs = billing_engine.price_sessions(start_times, [lot.price_per_hour] * len(start_times))
+    for info, elapsed, cost in zip(reservations.values(), seconds, costs):
+        info['running_cost'] = cost
+        info['duration_seconds'] = int(elapsed)
 
-        spots_payload.append({
-            'id': spot.id,
+    if fmt:
+        # only the spots that have an active reservation carry one
+        return grid_response({
             'lot_id': lot.id,
-            'spot_number': spot.spot_number,
-            'is_occupied': spot.is_occupied,
-            'reservation': res_info
-        })
+            'spot_grid': encode_spots(ids, numbers, occupied, binary=fmt == 'msgpack'),
+            'reservations': [dict(info, spot_id=spot_id) for spot_id, info in reservations.items()],
+        }, fmt)
 
+    spots_payload = [
+        {
+            'id': spot_id,
+            'lot_id': lot.id,
+            'spot_number': spot_number,
+            'is_occupied': is_occupied,
+            'reservation': reservations.get(spot_id)
+        }
+        for spot_id, spot_number, is_occupied in zip(ids, numbers, occupied)
+    ]
     return jsonify(spots_payload), 200
 
 
@@ -439,8 +575,8 @@ def release_parking_spot(spot_id):
         db.session.rollback()
         return jsonify({'message': 'Failed to release reservation', 'error': str(e)}), 500
 
-    cache.delete('available_lots')
-    cache.delete('admin_analytics')
+    lot_cache.bump(spot.lot_id)
+    publish_occupancy(spot.lot_id, [spot.id], False)
 
     return jsonify({
         'message': 'Spot released successfully.',
@@ -450,11 +586,66 @@ def release_parking_spot(spot_id):
     }), 200
 
 
+# Bulk release: many spots, or every active session of a lot, billed in one transaction
+# (releases.py). Response has the cost per reservation.
+@admin_bp.route('/parking-spots/release', methods=['POST'])
+def release_parking_spots():
+    data = request.get_json() or {}
+    try:
+        spot_ids = parse_ids(data.get('spot_ids'), current_app.config.get('BULK_RELEASE_MAX_ITEMS', MAX_ITEMS))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        result = release_reservations(Reservation.spot_id.in_(spot_ids))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to release spots', 'error': str(e)}), 500
+
+    announce_release(result)
+    return jsonify(release_payload(result, spot_ids, key='spot_id')), 200
+
+
+@admin_bp.route('/parking-lot/<int:lot_id>/evacuate', methods=['POST'])
+def evacuate_parking_lot(lot_id):
+    lot = db.session.get(ParkingLot, lot_id)
+    if not lot:
+        return jsonify({'message': 'Parking lot not found'}), 404
+
+    try:
+        result = release_reservations(ParkingSpot.lot_id == lot_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to evacuate lot', 'error': str(e)}), 500
+
+    announce_release(result)
+    payload = release_payload(result)
+    payload['lot_id'] = lot_id
+    return jsonify(payload), 200
+
+
 # Users list (simple)
 # --
+# Paginated by id (?limit=&cursor=), ?all=1 returns the old plain list.
 @admin_bp.route('/users', methods=['GET'])
+@versioned_etag(users_tag)
 def get_users():
-    users = User.query.all()
+    legacy = wants_all(request.args.get('all'))
+    query = User.query.options(selectinload(User.roles))
+
+    if legacy:
+        users = query.order_by(User.id).all()
+        has_more = False
+    else:
+        try:
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor, int) if cursor else None
+        except BadCursor:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        users, has_more = keyset_page(query, (User.id,), cursor, page_size(request.args.get('limit')))
+
     output = []
     for user in users:
         role = user.roles[0].name if user.roles else 'user'
@@ -464,28 +655,105 @@ def get_users():
             'username': user.username,
             'role': role
         })
-    return jsonify(output), 200
+
+    if legacy:
+        return jsonify(output), 200
+    return jsonify({
+        'items': output,
+        'next_cursor': encode_cursor(users[-1].id) if has_more else None
+    }), 200
 
 
 # --
 # Analytics (global)
 # --
+def _lot_summary_fragments(lot_ids):
+    """Cache builder for get_analytics: one row per lot (counters + revenue), two queries for all misses."""
+    # 1) lots + their occupancy counters
+    lot_rows = (
+        db.session.query(ParkingLot.id, ParkingLot.name, ParkingLot.capacity, ParkingLot.is_archive,
+                         LotOccupancy.free_spots, LotOccupancy.occupied_spots)
+        .outerjoin(LotOccupancy, LotOccupancy.lot_id == ParkingLot.id)
+        .filter(ParkingLot.id.in_(lot_ids))
+        .all()
+    )
+
+    # 2) revenue per lot in one GROUP BY
+    revenue_rows = (
+        db.session.query(ParkingSpot.lot_id, func.sum(Reservation.total_cost))
+        .join(Reservation, Reservation.spot_id == ParkingSpot.id)
+        .filter(ParkingSpot.lot_id.in_(lot_ids))
+        .group_by(ParkingSpot.lot_id)
+        .all()
+    )
+    revenue_by_lot = {lot_id: float(rev or 0.0) for lot_id, rev in revenue_rows}
+
+    built = {}
+    for lot_id, name, capacity, is_archive, free, occupied in lot_rows:
+        if free is None:
+            row = refresh_lot_occupancy(lot_id)
+            free, occupied = row.free_spots, row.occupied_spots
+            db.session.commit()
+
+        is_archive = bool(is_archive)
+        capacity = capacity or 0
+
+        built[lot_id] = {
+            'id': lot_id,
+            'name': name,
+            'is_archive': is_archive, # Flag for frontend
+            'capacity': capacity,
+            'occupied': occupied,
+            'free': free,
+            'available': max(0, capacity - occupied) if not is_archive else 0,
+            'total_revenue': revenue_by_lot.get(lot_id, 0.0)
+        }
+    return built
+
+
+def _orphan_revenue():
+    """Revenue of reservations whose spot no longer exists -- counts towards the total, like before."""
+    return float(
+        db.session.query(func.coalesce(func.sum(Reservation.total_cost), 0.0))
+        .outerjoin(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .filter(ParkingSpot.id.is_(None))
+        .scalar() or 0.0
+    )
+
+
 @admin_bp.route('/analytics', methods=['GET'])
-@cache.cached(timeout=300, key_prefix='admin_analytics')
+@versioned_etag(priced_lots_tag)
 def get_analytics():
-    archive_name = "Deleted - Archived History"
-
-    # Calculate Occupancy (EXCLUDING Archive)
-    # We join ParkingSpot with ParkingLot to check the name
-    total_spots = ParkingSpot.query.join(ParkingLot).filter(
-        ParkingLot.name != archive_name
-    ).count()
-
-    occupied_spots = ParkingSpot.query.join(ParkingLot).filter(
-        ParkingLot.name != archive_name,
-        ParkingSpot.is_occupied == True
-    ).count()
-    
+    # Put together from the per-lot fragments: a booking only rebuilds the row of its own lot
+    lot_ids = [lot_id for _, lot_id in lot_index()]  # already sorted, archive last
+    fragments = lot_cache.get_many('lot_summary', lot_ids, _lot_summary_fragments)
+
+    # Calculate Total Revenue (INCLUDING Archive)
+    total_revenue = lot_cache.get_global('orphan_revenue', _orphan_revenue)
+
+    # what the active sessions would bill right now (as of the ETag's estimate bucket)
+    priced_at = billing_engine.estimate_time(g.get('estimate_bucket'))
+    outstanding_by_lot, outstanding, active_sessions = billing_engine.outstanding_revenue(now=priced_at)
+
+    lots_summary = []
+    total_spots = 0
+    occupied_spots = 0
+    for lot_id in lot_ids:
+        if lot_id not in fragments:
+            continue
+        summary = dict(fragments[lot_id])
+        free = summary.pop('free')
+        total_revenue += summary['total_revenue']
+        summary['total_revenue'] = round(summary['total_revenue'], 2)
+        summary['outstanding_revenue'] = outstanding_by_lot.get(lot_id, 0.0)
+
+        # Occupancy totals EXCLUDE the archive
+        if not summary['is_archive']:
+            total_spots += free + summary['occupied']
+            occupied_spots += summary['occupied']
+
+        lots_summary.append(summary)
+
     occupancy_data = {
         'total': total_spots,
         'occupied': occupied_spots,
@@ -493,39 +761,14 @@ def get_analytics():
         'occupancy_rate': round((occupied_spots / total_spots) * 100, 1) if total_spots else 0
     }
 
-    # Calculate Total Revenue (INCLUDING Archive)
-    total_revenue = db.session.query(db.func.sum(Reservation.total_cost)).scalar()
-    total_revenue = round(total_revenue or 0.0, 2)
-
-    # Sorting done
-    lots = ParkingLot.query.all()
-    sorted_lots = sorted(lots, key=lambda x: (1 if x.name == archive_name else 0, x.id))
-
-    lots_summary = []
-    for lot in sorted_lots:
-        is_archive = (lot.name == archive_name)
-        
-        capacity = lot.capacity or 0
-        occupied = ParkingSpot.query.filter_by(lot_id=lot.id, is_occupied=True).count()
-        
-        lot_rev = db.session.query(db.func.sum(Reservation.total_cost)) \
-            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-            .filter(ParkingSpot.lot_id == lot.id) \
-            .scalar() or 0.0
-            
-        lots_summary.append({
-            'id': lot.id,
-            'name': lot.name,
-            'is_archive': is_archive, # Flag for frontend
-            'capacity': capacity,
-            'occupied': occupied,
-            'available': max(0, capacity - occupied) if not is_archive else 0,
-            'total_revenue': round(float(lot_rev), 2)
-        })
-
     return jsonify({
         'occupancy_summary': occupancy_data,
-        'revenue_summary': {'total_revenue': total_revenue},
+        'revenue_summary': {
+            'total_revenue': round(total_revenue, 2),
+            'outstanding_revenue': outstanding,
+            'active_sessions': active_sessions,
+            'priced_at': priced_at.isoformat().replace('+00:00', 'Z'),
+        },
         'lots_summary': lots_summary
     }), 200
 
@@ -541,98 +784,52 @@ def get_parking_lot_analytics(lot_id):
     - today's bookings count
     - this month's bookings count
     - capacity, occupied, occupancy_rate, avg_duration_minutes
+    Cached per (lot version, day).
     """
     lot = ParkingLot.query.get(lot_id)
     if not lot:
         return jsonify({'message': 'Parking lot not found'}), 404
-    
+
+    today_utc = datetime.now(timezone.utc).date()
+    resp = lot_cache.get('lot_analytics', lot.id, lambda: _lot_analytics(lot, today_utc),
+                         variant=today_utc.isoformat())
+    return jsonify(resp), 200
+
+
+def _lot_analytics(lot, today_utc):
     # Basic counts
     capacity = lot.capacity or 0
-    occupied = ParkingSpot.query.filter_by(lot_id=lot.id, is_occupied=True).count()
+    occupied = get_lot_occupancy(lot.id).occupied_spots
     occupancy_rate = round((occupied / capacity) * 100, 1) if capacity else 0
 
-    # Total revenue for this lot (sum of all reservations' total_cost for spots in this lot)
-    total_revenue = db.session.query(db.func.sum(Reservation.total_cost)) \
-        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-        .filter(ParkingSpot.lot_id == lot.id) \
-        .scalar() or 0.0
-    total_revenue = round(float(total_revenue), 2)
+    # Everything below comes from the (lot, day) rollup: lifetime totals in one aggregate,
+    # plus the rows of the last 30 days / this month (at most 31 rows).
+    lifetime_revenue, _, lifetime_completed, lifetime_seconds = lifetime_totals(lot.id)
+    total_revenue = round(float(lifetime_revenue or 0.0), 2)
 
-    # Today's / month's bookings (count of reservations that started today / this month)
-    today_utc = datetime.now(timezone.utc).date()
-    start_of_today = datetime(today_utc.year, today_utc.month, today_utc.day, tzinfo=timezone.utc)
-    start_of_month = datetime(today_utc.year, today_utc.month, 1, tzinfo=timezone.utc)
-
-    todays_bookings = db.session.query(db.func.count(Reservation.id)) \
-        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-        .filter(
-            ParkingSpot.lot_id == lot.id,
-            Reservation.start_time >= start_of_today
-        ).scalar() or 0
-
-    months_bookings = db.session.query(db.func.count(Reservation.id)) \
-        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-        .filter(
-            ParkingSpot.lot_id == lot.id,
-            Reservation.start_time >= start_of_month
-        ).scalar() or 0
+    start_of_month = today_utc.replace(day=1)
+    days = 30
+    window_start = today_utc - timedelta(days=days - 1)
 
-    # Average duration (for closed reservations) in minutes
-    closed_res = db.session.query(Reservation) \
-        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-        .filter(
-            ParkingSpot.lot_id == lot.id,
-            Reservation.active.is_(False),
-            Reservation.end_time.isnot(None),
-            Reservation.start_time.isnot(None)
-        ).all()
+    rows = {row.day: row for row in daily_rows(lot.id, min(window_start, start_of_month))}
 
-    avg_duration_minutes = 0.0
-    if closed_res:
-        total_minutes = 0.0
-        count_closed = 0
-        for r in closed_res:
-            try:
-                st = r.start_time
-                et = r.end_time
-                if getattr(st, 'tzinfo', None) is None:
-                    st = st.replace(tzinfo=timezone.utc)
-                else:
-                    st = st.astimezone(timezone.utc)
-                if getattr(et, 'tzinfo', None) is None:
-                    et = et.replace(tzinfo=timezone.utc)
-                else:
-                    et = et.astimezone(timezone.utc)
+    # Today's / month's bookings (sessions that started today / this month)
+    todays_bookings = rows[today_utc].bookings if today_utc in rows else 0
+    months_bookings = sum(row.bookings for day, row in rows.items() if day >= start_of_month)
 
-                dur = (et - st).total_seconds() / 60.0
-                if dur > 0:
-                    total_minutes += dur
-                    count_closed += 1
-            except Exception:
-                continue
-        if count_closed:
-            avg_duration_minutes = round(total_minutes / count_closed, 1)
+    # Average duration (for closed reservations) in minutes
+    avg_duration_minutes = 0.0
+    if lifetime_completed:
+        avg_duration_minutes = round(float(lifetime_seconds) / 60.0 / lifetime_completed, 1)
 
-    # Build 30-day revenue timeseries (date -> revenue)
+    # Build 30-day revenue timeseries (date -> revenue billed that day)
     timeseries = []
-    days = 30
     for offset in range(days - 1, -1, -1):  # oldest -> newest
         day_date = today_utc - timedelta(days=offset)
-        day_start = datetime(day_date.year, day_date.month, day_date.day, tzinfo=timezone.utc)
-        day_end = day_start + timedelta(days=1)
-
-        day_total = db.session.query(db.func.sum(Reservation.total_cost)) \
-            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
-            .filter(
-                ParkingSpot.lot_id == lot.id,
-                Reservation.start_time >= day_start,
-                Reservation.start_time < day_end,
-                Reservation.total_cost.isnot(None)
-            ).scalar() or 0.0
-
+        row = rows.get(day_date)
         timeseries.append({
-            'date': day_start.date().isoformat(),
-            'revenue': round(float(day_total), 2)
+            'date': day_date.isoformat(),
+            'revenue': round(float(row.revenue), 2) if row else 0.0
         })
 
     resp = {
@@ -648,7 +845,7 @@ def get_parking_lot_analytics(lot_id):
         'avg_duration_minutes': avg_duration_minutes
     }
 
-    return jsonify(resp), 200
+    return resp
 
 
 # below part added later
@@ -662,13 +859,27 @@ def get_user_details(user_id):
 
     role = user.roles[0].name if user.roles else 'user'
 
-    # If User.reservations relationship exists, use it; otherwise query.
-
-    
-    try:
-        all_reservations = sorted(user.reservations, key=lambda r: r.start_time or datetime.min, reverse=True)
-    except Exception:
-        all_reservations = Reservation.query.filter_by(user_id=user.id).order_by(Reservation.start_time.desc()).all()
+    # History newest first, spot + lot loaded in the same query.
+    # Paginated by (start_time, id) with ?limit=&cursor=, ?all=1 returns everything.
+    legacy = wants_all(request.args.get('all'))
+    query = (
+        Reservation.query
+        .filter(Reservation.user_id == user.id)
+        .options(joinedload(Reservation.spot).joinedload(ParkingSpot.parking_lot))
+    )
+    if legacy:
+        all_reservations = query.order_by(Reservation.start_time.desc(), Reservation.id.desc()).all()
+        has_more = False
+    else:
+        try:
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor, datetime, int) if cursor else None
+        except BadCursor:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        all_reservations, has_more = keyset_page(
+            query, (Reservation.start_time, Reservation.id), cursor,
+            page_size(request.args.get('limit')), descending=True
+        )
 
     def to_utc_iso(dt):
         """Return a UTC ISO string with trailing Z, defensively handling naive datetimes."""
@@ -716,10 +927,15 @@ def get_user_details(user_id):
             'total_cost': float(r.total_cost or 0.0)
         })
 
-    return jsonify({
+    resp = {
         'id': user.id,
         'username': getattr(user, 'username', None),
         'email': getattr(user, 'email', None),
         'role': role,
         'reservations': reservations_data
-    }), 200
+    }
+    if not legacy:
+        last = all_reservations[-1] if all_reservations else None
+        resp['next_cursor'] = encode_cursor(last.start_time, last.id) if has_more else None
+
+    return jsonify(resp), 200
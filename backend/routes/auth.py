@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
-from flask_security import verify_password, hash_password
+from flask_login import current_user
 from flask_security.utils import login_user, logout_user
 from models.models import db, User, Role
+from hashing import password_hasher, HashingBusy
+from dbprofile import read_only_transaction
+from auth_cache import token_cache
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -17,8 +20,20 @@ def login():
     # user by email
     user = User.query.filter_by(email=email).first()
 
-    # password
-    if user and verify_password(password, user.password):
+    # password (hashed on the bounded pool, see hashing.py)
+    valid = False
+    if user:
+        try:
+            valid, new_hash = password_hasher.verify(password, user.password, client=request.remote_addr)
+        except HashingBusy as e:
+            return jsonify({'message': e.message}), e.status_code
+
+        # hash settings changed since this password was stored -> save the upgraded hash
+        if valid and new_hash:
+            user.password = new_hash
+            db.session.commit()
+
+    if valid:
         login_user(user) # Creates session/token context
         
         role = user.roles[0].name if user.roles else 'user'
@@ -45,13 +60,18 @@ def register():
     if User.query.filter_by(email=email).first():
         return jsonify({'message': 'User already exists'}), 409
 
+    try:
+        password_hash = password_hasher.hash(password, client=request.remote_addr)
+    except HashingBusy as e:
+        return jsonify({'message': e.message}), e.status_code
+
     # Default new users to 'user' role
     user_role = Role.query.filter_by(name='user').first()
     
     new_user = User(
         email=email,
         username=username,
-        password=hash_password(password),
+        password=password_hash,
         active=True,
         fs_uniquifier=email # using email as unique ID
     )
@@ -65,11 +85,16 @@ def register():
     return jsonify({'message': 'User registered successfully'}), 201
 
 @auth_bp.route('/logout', methods=['POST'])
+@read_only_transaction
 def logout():
+    if current_user.is_authenticated:
+        # every worker re-checks this user's Bearer token on its next request
+        token_cache.invalidate_user(current_user.id, broadcast=True)
     logout_user()
     return jsonify({'message': 'Logged out successfully'}), 200
 
 @auth_bp.route('/profile', methods=['POST'])
+@read_only_transaction
 def get_profile():
     data = request.get_json()
     email = data.get('email')
@@ -123,9 +148,14 @@ def change_password():
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    if not verify_password(current_password, user.password):
-        return jsonify({'message': 'Current password is incorrect'}), 400
+    try:
+        valid, _ = password_hasher.verify(current_password, user.password, client=request.remote_addr)
+        if not valid:
+            return jsonify({'message': 'Current password is incorrect'}), 400
+        user.password = password_hasher.hash(new_password, client=request.remote_addr)
+    except HashingBusy as e:
+        return jsonify({'message': e.message}), e.status_code
 
-    user.password = hash_password(new_password)
     db.session.commit()
-    return jsonify({'message': 'Password changed successfully'}), 200
\ No newline at end of file
+    return jsonify({'message': 'Password changed successfully'}), 200
+
@@ -0,0 +1,65 @@
+from flask import Blueprint, jsonify
+from flask_login import current_user
+from auth_cache import token_cache
+from cache import lot_cache
+from hashing import password_hasher
+from compression import compressor
+from dbprofile import engine_profile
+from billing import billing_engine
+from occupancy_stream import occupancy_stream
+
+# Notes to me:
+# Operational counters of this worker -- caches, pools, pragmas, pricing. Admins only: they leak
+# traffic patterns and database settings, so every route here goes through require_admin.
+
+ops_bp = Blueprint('ops', __name__)
+
+
+@ops_bp.before_request
+def require_admin():
+    if not current_user.is_authenticated:
+        return jsonify({'message': 'Authentication required'}), 401
+    if not current_user.has_role('admin'):
+        return jsonify({'message': 'Admin access required'}), 403
+
+
+@ops_bp.route('/token-cache/stats', methods=['GET'])
+def token_cache_stats():
+    """Hit/miss counters of the Bearer token cache (this worker only)."""
+    return jsonify(token_cache.stats()), 200
+
+
+@ops_bp.route('/lot-cache/stats', methods=['GET'])
+def lot_cache_stats():
+    """Hit/miss counters of the per-lot fragment cache, overall, per fragment kind and per tier (this worker only)."""
+    return jsonify(lot_cache.stats()), 200
+
+
+@ops_bp.route('/compression/stats', methods=['GET'])
+def compression_stats():
+    """Compressed responses, bytes saved and stored-body hits (this worker only)."""
+    return jsonify(compressor.stats()), 200
+
+
+@ops_bp.route('/db/stats', methods=['GET'])
+def db_stats():
+    """Engine profile: effective SQLite pragmas, pool status, IMMEDIATE vs deferred transactions (this worker only)."""
+    return jsonify(engine_profile.stats()), 200
+
+
+@ops_bp.route('/billing/stats', methods=['GET'])
+def billing_stats():
+    """Sessions billed and live-priced, pricing batches, NumPy on/off (this worker only)."""
+    return jsonify(billing_engine.stats()), 200
+
+
+@ops_bp.route('/password-hashing/stats', methods=['GET'])
+def password_hashing_stats():
+    """Hash pool load and latency (this worker only)."""
+    return jsonify(password_hasher.stats()), 200
+
+
+@ops_bp.route('/stream/occupancy/stats', methods=['GET'])
+def stream_occupancy_stats():
+    """Events published/received and buffered for replay (this worker only)."""
+    return jsonify(occupancy_stream.stats()), 200
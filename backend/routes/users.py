@@ -1,9 +1,22 @@
-from flask import Blueprint, request, jsonify, current_app
-from models.models import db, ParkingLot, ParkingSpot, Reservation, User
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_login import current_user
+from models.models import db, ParkingLot, ParkingSpot, Reservation, User, LotOccupancy
 from datetime import datetime, timezone, timedelta
-from cache import cache
+from cache import lot_cache, lot_index, CHANGES
+from etags import versioned_etag, lots_tag
+from occupancy import adjust_lot_occupancy, refresh_lot_occupancy, get_lot_occupancy
+from allocator import spot_allocator
+from rollups import record_bookings, record_closed, daily_rows, lifetime_totals
 from zoneinfo import ZoneInfo
-from sqlalchemy import func
+from sqlalchemy import func, update
+from sqlalchemy.orm import joinedload
+from pagination import page_size, wants_all, encode_cursor, decode_cursor, keyset_page, BadCursor
+from exports import history_rows, iter_csv, iter_gzip
+from occupancy_stream import occupancy_stream, publish_occupancy
+from dbprofile import read_only_transaction
+from sync import change_version
+from billing import billing_engine
+from releases import MAX_ITEMS, parse_ids, release_reservations, announce_release, release_payload
 
 user_bp = Blueprint('user', __name__)
 
@@ -19,24 +32,19 @@ def _ensure_aware(dt):
     return dt.astimezone(timezone.utc)
 
 
-def _format_reservation_for_client(reservation, ist_tz):
+def _format_reservation_for_client(reservation, ist_tz, seconds, running_cost):
     """
     Convert a Reservation DB object into the exact shape expected by the frontend.
+    seconds / running_cost come from billing_engine.price_sessions for the whole page.
     """
-    now_utc = datetime.now(timezone.utc)
     start_utc = _ensure_aware(reservation.start_time)
     end_utc = _ensure_aware(reservation.end_time)
 
     if start_utc is None:
         return None
 
-    if end_utc:
-        delta = end_utc - start_utc
-    else:
-        delta = now_utc - start_utc
-
-    hours = int(delta.total_seconds() // 3600)
-    minutes = int((delta.total_seconds() % 3600) // 60)
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
     duration_str = f"{hours}h {minutes}m"
 
     # convert UTC -> IST for display strings
@@ -48,6 +56,7 @@ def _format_reservation_for_client(reservation, ist_tz):
 
     return {
         "id": reservation.id,
+        "spot_id": reservation.spot_id,
         "spot": reservation.spot.spot_number,
         "lot": reservation.spot.parking_lot.name,
         "start_time": start_str,
@@ -57,34 +66,115 @@ def _format_reservation_for_client(reservation, ist_tz):
         "end_ts": end_utc.isoformat() if end_utc else None,
 
         "duration": duration_str,
+        "duration_seconds": int(seconds),
         "cost": float(reservation.total_cost or 0.0),
+        # what releasing now would bill, active sessions only
+        "running_cost": running_cost if reservation.active else None,
         "active": bool(reservation.active)
     }
 
-# AVAILABLE LOTS (cached) 
+def _mark_occupied(lot_id, ids):
+    """
+    Conditional claim: UPDATE ... SET is_occupied = 1 WHERE id IN (ids) AND is_occupied = 0.
+    Returns the ids this transaction actually flipped -- a spot another request took first simply
+    isn't among them, on every database (FOR UPDATE is a no-op on SQLite).
+    """
+    spots = ParkingSpot.__table__
+    stmt = (
+        update(spots)
+        .where(spots.c.id.in_(ids), spots.c.lot_id == lot_id, spots.c.is_occupied.isnot(True))
+        .values(is_occupied=True, change_version=change_version())
+    )
+    if db.session.get_bind().dialect.update_returning:
+        return set(db.session.execute(stmt.returning(spots.c.id)).scalars())
+    # no RETURNING: one statement per spot, its rowcount tells
+    return {spot_id for spot_id in ids if db.session.execute(stmt.where(spots.c.id == spot_id)).rowcount}
+
+
+def _claim_free_spots(lot_id, quantity, policy=None, attempts=3):
+    """
+    Claim `quantity` free spots of the lot in the DB (uncommitted -- the caller commits, or rolls
+    back to give them all back). Returns (spot ids, available); ids is [] when the lot can't serve
+    the booking, and then nothing is left claimed.
+    The in-process allocator picks candidates, _mark_occupied makes the claim. When another worker
+    got some of them first, the lot's bitmap is reloaded and the missing ones are picked again
+    (plain lowest-free from then on), at most `attempts` rounds.
+    """
+    claimed = []
+    for _ in range(attempts):
+        need = quantity - len(claimed)
+        ids = spot_allocator.claim(lot_id, need, policy=None if claimed else policy)
+        if not ids:
+            if get_lot_occupancy(lot_id).free_spots < need:
+                break
+            spot_allocator.reload_lot(lot_id)  # bitmap is behind the DB
+            continue
+        won = _mark_occupied(lot_id, ids)
+        claimed.extend(i for i in ids if i in won)
+        if len(claimed) == quantity:
+            return sorted(claimed), quantity
+        # lost some: this worker's bitmap is behind -- re-read the lot (our claims show as taken)
+        spot_allocator.forget(lot_id, [i for i in ids if i not in won])
+        spot_allocator.reload_lot(lot_id)
+
+    db.session.rollback()  # un-claims the rows and the bitmap bits
+    return [], min(spot_allocator.free_count(lot_id), get_lot_occupancy(lot_id).free_spots)
+
+
+# AVAILABLE LOTS (cached per lot, see cache.LotCache)
+def _available_fragments(lot_ids):
+    # counters come from LotOccupancy in the same query -> cost no longer grows with spot count
+    rows = (
+        db.session.query(ParkingLot, LotOccupancy.free_spots)
+        .outerjoin(LotOccupancy, LotOccupancy.lot_id == ParkingLot.id)
+        .filter(ParkingLot.id.in_(lot_ids))
+        .all()
+    )
+    built = {}
+    for lot, available_spots in rows:
+        if available_spots is None:
+            available_spots = refresh_lot_occupancy(lot.id).free_spots
+            db.session.commit()
+        data = {
+            'id': lot.id,
+            'name': lot.name,
+            'address': lot.address,
+            'price_per_hour': float(lot.price_per_hour or 0.0),
+            'available_spots': available_spots
+        }
+        if hasattr(lot, 'pin_code'):
+            data['pin_code'] = getattr(lot, 'pin_code', None)
+        built[lot.id] = data
+    return built
+
+
 @user_bp.route('/available-lots', methods=['GET'])
-@cache.cached(timeout=60, key_prefix='available_lots')
+@versioned_etag(lots_tag)
 def get_available_lots():
-    lots = ParkingLot.query.options().all()
-    output = []
-    for lot in lots:
-        available_spots = sum(1 for s in lot.spots if not s.is_occupied)
-        if available_spots > 0:
-            data = {
-                'id': lot.id,
-                'name': lot.name,
-                'address': lot.address,
-                'price_per_hour': float(lot.price_per_hour or 0.0),
-                'available_spots': available_spots
-            }
-            if hasattr(lot, 'pin_code'):
-                data['pin_code'] = getattr(lot, 'pin_code', None)
-            output.append(data)
+    # only lots whose version moved since their fragment was stored hit the DB
+    lot_ids = [lot_id for _, lot_id in lot_index()]
+    fragments = lot_cache.get_many('available', lot_ids, _available_fragments)
+    output = [
+        fragments[lot_id] for lot_id in lot_ids
+        if lot_id in fragments and fragments[lot_id]['available_spots'] > 0
+    ]
     return jsonify(output), 200
 
 
+# OCCUPANCY STREAM (SSE) -- spot/lot occupancy changes as they commit, see occupancy_stream.py
+@user_bp.route('/stream/occupancy', methods=['GET'])
+def stream_occupancy():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(
+        stream_with_context(occupancy_stream.stream(last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 # TRIGGER CSV EXPORT
 @user_bp.route('/export-csv', methods=['POST'])
+@read_only_transaction
 def trigger_export():
     data = request.get_json() or {}
     email = data.get('email')
@@ -100,6 +190,30 @@ def trigger_export():
     return jsonify({'message': 'Export started. Check your email.'}), 200
 
 
+# DOWNLOAD CSV EXPORT (streamed, ?gzip=1 for a .csv.gz)
+# Only the caller's OWN history (Bearer token identity) -- ?email= is optional and must be theirs.
+@user_bp.route('/export-csv/download', methods=['GET'])
+def download_export():
+    if not current_user.is_authenticated:
+        return jsonify({'message': 'Authentication required'}), 401
+
+    email = request.args.get('email')
+    if email and email.lower() != (current_user.email or '').lower():
+        return jsonify({'message': 'You can only download your own history'}), 403
+
+    chunks = iter_csv(history_rows(current_user.id))
+    filename, mimetype = 'parking_history.csv', 'text/csv'
+    if str(request.args.get('gzip')).lower() in ('1', 'true', 'yes'):
+        chunks = iter_gzip(chunks)
+        filename, mimetype = 'parking_history.csv.gz', 'application/gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
 # RESERVE - multiple quantity bookings (1..10)
 @user_bp.route('/reserve', methods=['POST'])
 def reserve_spot():
@@ -121,58 +235,51 @@ def reserve_spot():
     if not lot:
         return jsonify({'message': 'Lot not found'}), 404
 
-    free_spots = (
-        ParkingSpot.query
-        .filter_by(lot_id=lot_id, is_occupied=False)
-        .order_by(ParkingSpot.id)
-        .limit(quantity)
-        .with_for_update(read=True)
-        .all()
+    # contiguous=true asks for neighbouring spots (falls back to any free spots)
+    policy = 'contiguous' if data.get('contiguous') else None
+    free_spots, available = _claim_free_spots(
+        lot.id, quantity, policy, attempts=current_app.config.get('RESERVE_CLAIM_ATTEMPTS', 3)
     )
 
-    if len(free_spots) == 0:
+    if available == 0:
         return jsonify({'message': 'Lot full'}), 400
 
+    if len(free_spots) < quantity and available >= quantity:
+        # lost every round of the claim to concurrent bookings -- free spots are there, try again
+        return jsonify({
+            'message': 'The spots were just taken by another booking, please try again.',
+            'available': available
+        }), 409
+
     if len(free_spots) < quantity:
         return jsonify({
-            'message': f'Only {len(free_spots)} spots available in this lot.',
-            'available': len(free_spots)
+            'message': f'Only {available} spots available in this lot.',
+            'available': available
         }), 400
 
     now_utc = datetime.now(timezone.utc)
-    created_reservations = []
 
     try:
-        for spot in free_spots:
-            spot.is_occupied = True
-            reservation = Reservation(
-                user_id=user.id,
-                spot_id=spot.id,
-                start_time=now_utc,
-                active=True
-            )
-            db.session.add(reservation)
-
-        db.session.flush()
-        spot_ids = [s.id for s in free_spots]
-        db.session.commit()
-
-        created = (
-            Reservation.query
-            .filter(Reservation.user_id == user.id,
-                    Reservation.spot_id.in_(spot_ids),
-                    Reservation.start_time == now_utc)
-            .all()
+        reservations = [
+            Reservation(user_id=user.id, spot_id=spot_id, start_time=now_utc, active=True)
+            for spot_id in free_spots
+        ]
+        db.session.add_all(reservations)
+        adjust_lot_occupancy(lot.id, occupied_delta=len(free_spots))
+        record_bookings(lot.id, user.id, now_utc, count=len(free_spots))
+        db.session.flush()  # reservation ids
+
+        numbers = dict(
+            db.session.query(ParkingSpot.id, ParkingSpot.spot_number).filter(ParkingSpot.id.in_(free_spots))
         )
+        created_reservations = [
+            {'reservation_id': r.id, 'spot': numbers.get(r.spot_id)}
+            for r in reservations
+        ]
+        db.session.commit()
 
-        for r in created:
-            created_reservations.append({
-                'reservation_id': r.id,
-                'spot': r.spot.spot_number
-            })
-
-        cache.delete('available_lots')
-        cache.delete('admin_analytics')
+        lot_cache.bump(lot.id)
+        publish_occupancy(lot.id, [r.spot_id for r in reservations], True)
 
         return jsonify({
             'message': 'Success!',
@@ -180,42 +287,68 @@ def reserve_spot():
         }), 201
 
     except Exception:
-        db.session.rollback()
-        try:
-            for s_id in [s.id for s in free_spots]:
-                sp = ParkingSpot.query.get(s_id)
-                if sp:
-                    sp.is_occupied = False
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-
+        db.session.rollback()  # the claimed spots go back with it
         current_app.logger.exception("Error creating multiple reservations")
         return jsonify({'message': 'Internal server error'}), 500
 
 
 # MY RESERVATIONS
+# Paginated by default: {"items": [...], "next_cursor": "..."} -- pass next_cursor back as
+# "cursor" for the next page, "limit" for the page size. "all": true gives the old plain list.
 @user_bp.route('/my-reservations', methods=['POST'])
+@read_only_transaction
 def my_reservations():
     data = request.get_json() or {}
     email = data.get('email')
+    legacy = wants_all(data.get('all'))
+    empty = [] if legacy else {'items': [], 'next_cursor': None}
     if not email:
-        return jsonify([]), 200
+        return jsonify(empty), 200
 
     user = User.query.filter_by(email=email).first()
     if not user:
-        return jsonify([]), 200
+        return jsonify(empty), 200
 
     ist = ZoneInfo("Asia/Kolkata")
-    reservations = Reservation.query.filter_by(user_id=user.id).order_by(Reservation.start_time.desc()).all()
+    query = (
+        Reservation.query
+        .filter(Reservation.user_id == user.id)
+        .options(joinedload(Reservation.spot).joinedload(ParkingSpot.parking_lot))
+    )
+
+    if legacy:
+        reservations = query.order_by(Reservation.start_time.desc(), Reservation.id.desc()).all()
+        has_more = False
+    else:
+        try:
+            cursor = decode_cursor(data['cursor'], datetime, int) if data.get('cursor') else None
+        except BadCursor:
+            return jsonify({'message': 'Invalid cursor'}), 400
+        reservations, has_more = keyset_page(
+            query, (Reservation.start_time, Reservation.id), cursor,
+            page_size(data.get('limit')), descending=True
+        )
 
+    # durations of the whole page (and live costs of the active ones) in one pricing pass
+    seconds, costs = billing_engine.price_sessions(
+        [r.start_time for r in reservations],
+        [r.spot.parking_lot.price_per_hour for r in reservations],
+        end_times=[None if r.active else r.end_time for r in reservations],
+    )
     output = []
-    for r in reservations:
-        formatted = _format_reservation_for_client(r, ist)
+    for r, elapsed, cost in zip(reservations, seconds, costs):
+        formatted = _format_reservation_for_client(r, ist, elapsed, cost)
         if formatted:
             output.append(formatted)
 
-    return jsonify(output), 200
+    if legacy:
+        return jsonify(output), 200
+
+    last = reservations[-1] if reservations else None
+    return jsonify({
+        'items': output,
+        'next_cursor': encode_cursor(last.start_time, last.id) if has_more else None
+    }), 200
 
 
 # RELEASE: end a reservation and compute cost
@@ -232,29 +365,63 @@ def release_spot():
     if start_time is None:
         return jsonify({'message': 'Invalid reservation data'}), 400
 
-    duration_seconds = (end_time - start_time).total_seconds()
-    hours = max(1, duration_seconds / 3600.0)
-
-    price = float(reservation.spot.parking_lot.price_per_hour or 0.0)
-    cost = round(hours * price, 2)
+    cost = billing_engine.session_cost(start_time, end_time, reservation.spot.parking_lot.price_per_hour)
 
     reservation.end_time = end_time
     reservation.total_cost = cost
     reservation.active = False
+    record_closed(reservation, reservation.spot.lot_id)
+    was_occupied = bool(reservation.spot.is_occupied)
     reservation.spot.is_occupied = False
+    if was_occupied:
+        adjust_lot_occupancy(reservation.spot.lot_id, occupied_delta=-1)
+        spot_allocator.release(reservation.spot.lot_id, [reservation.spot.id])
 
     db.session.commit()
 
-    cache.delete('available_lots')
-    cache.delete('admin_analytics')
+    lot_cache.bump(reservation.spot.lot_id)
+    publish_occupancy(reservation.spot.lot_id, [reservation.spot_id], False)
 
     return jsonify({'message': 'Spot Released', 'cost': cost}), 200
 
 
+# RELEASE several reservations at once: one transaction, one cache bump, cost per reservation
+@user_bp.route('/release-spots', methods=['POST'])
+def release_spots():
+    data = request.get_json() or {}
+    try:
+        reservation_ids = parse_ids(
+            data.get('reservation_ids'), current_app.config.get('BULK_RELEASE_MAX_ITEMS', MAX_ITEMS)
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        result = release_reservations(Reservation.id.in_(reservation_ids))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to release reservations', 'error': str(e)}), 500
+
+    announce_release(result)
+    return jsonify(release_payload(result, reservation_ids)), 200
+
+
 # Analytics endpoints
 # ----------------------------
 
+def _user_summary_tag():
+    # the user's reservations only change through their lots; the 30-day window moves daily
+    data = request.get_json(silent=True) or {}
+    if not data.get('email'):
+        return None
+    today = datetime.now(timezone.utc).date().isoformat()
+    return (data['email'], today, lot_cache.version_tag(CHANGES))
+
+
 @user_bp.route('/user-summary', methods=['POST'])
+@read_only_transaction
+@versioned_etag(_user_summary_tag)
 def user_summary():
     """
     Provide summary data for the user's Summary tab.
@@ -334,10 +501,12 @@ def user_summary():
 
 
 @user_bp.route('/parking-lot/<int:lot_id>/analytics', methods=['POST'])
+@read_only_transaction
 def parking_lot_analytics(lot_id):
     """
     Per-lot analytics scoped to the requesting user.
-    Fixed: Performs date grouping in Python.
+    Reads at most 30 rows of the per-user daily rollup (see rollups.py), cached per
+    (lot version, user, day).
     """
     data = request.get_json() or {}
     email = data.get('email')
@@ -349,24 +518,22 @@ def parking_lot_analytics(lot_id):
     if not user or not lot:
         return jsonify({'message': 'not found'}), 404
 
-    # Total revenue for this lot (user specific)
-    total_revenue = db.session.query(func.coalesce(func.sum(Reservation.total_cost), 0.0)).join(
-        ParkingSpot, ParkingSpot.id == Reservation.spot_id
-    ).filter(
-        Reservation.user_id == user.id,
-        ParkingSpot.lot_id == lot_id,
-        Reservation.total_cost != None
-    ).scalar() or 0.0
-
     today_utc = datetime.now(timezone.utc).date()
-    start_date = today_utc - timedelta(days=29)
+    payload = lot_cache.get(
+        'user_lot_analytics', lot.id, lambda: _user_lot_analytics(lot, user, today_utc),
+        variant=f'{user.id}:{today_utc.isoformat()}'
+    )
+    return jsonify(payload), 200
 
 
-    # fetch all relevant reservations first to avoid complex date logic in SQL
-    all_res_for_lot = Reservation.query.join(ParkingSpot).filter(
-        Reservation.user_id == user.id,
-        ParkingSpot.lot_id == lot_id
-    ).all()
+def _user_lot_analytics(lot, user, today_utc):
+    # Read from the (user, lot, day) rollup instead of the raw reservations
+    lifetime_revenue, _, lifetime_completed, lifetime_seconds = lifetime_totals(lot.id, user_id=user.id)
+    total_revenue = float(lifetime_revenue or 0.0)
+
+    start_date = today_utc - timedelta(days=29)
+
+    rows = daily_rows(lot.id, start_date, user_id=user.id)
 
     todays_bookings = 0
     months_bookings = 0
@@ -374,40 +541,24 @@ def parking_lot_analytics(lot_id):
     # Timeseries
     ts_map = { (start_date + timedelta(days=i)).isoformat(): 0.0 for i in range(30) }
 
-    # Avg Duration
-    total_seconds = 0
-    count_completed = 0
-
-    for r in all_res_for_lot:
-        if not r.start_time: continue
-        
-        st_date = r.start_time.date() if r.start_time else None
-        
-        if st_date == today_utc:
-            todays_bookings += 1
-        
-        if st_date and st_date >= start_date:
-            months_bookings += 1
-
-        # Revenue Timeseries 
-        if r.end_time and r.total_cost is not None:
-            et_date_str = r.end_time.strftime('%Y-%m-%d')
-            if et_date_str in ts_map:
-                ts_map[et_date_str] += float(r.total_cost)
-            
-            # Duration
-            dur = (r.end_time - r.start_time).total_seconds()
-            if dur > 0:
-                total_seconds += dur
-                count_completed += 1
+    for row in rows:
+        if row.day == today_utc:
+            todays_bookings += row.bookings
+        months_bookings += row.bookings
+
+        # Revenue Timeseries (day the session was closed)
+        d_str = row.day.isoformat()
+        if d_str in ts_map:
+            ts_map[d_str] += float(row.revenue)
 
+    # Avg Duration
     avg_minutes = 0
-    if count_completed > 0:
-        avg_minutes = int(round((total_seconds / count_completed) / 60.0))
+    if lifetime_completed:
+        avg_minutes = int(round((float(lifetime_seconds) / lifetime_completed) / 60.0))
 
     timeseries_30d = [{'date': d, 'revenue': round(ts_map[d], 2)} for d in sorted(ts_map.keys())]
 
-    return jsonify({
+    return {
         'lot_id': lot.id,
         'lot_name': lot.name,
         'total_revenue': float(total_revenue),
@@ -415,4 +566,4 @@ def parking_lot_analytics(lot_id):
         'months_bookings': months_bookings,
         'avg_duration_minutes': avg_minutes,
         'timeseries_30d': timeseries_30d
-    }), 200
\ No newline at end of file
+    }
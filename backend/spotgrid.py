@@ -0,0 +1,129 @@
+import base64
+import re
+from flask import request, jsonify, Response
+
+# Notes to me:
+# Compact "grid" encoding of a lot's spots, opt-in with ?format=grid (or Accept: GRID_JSON).
+# Instead of one {id, spot_number, is_occupied} object per spot (~60 bytes each on a 10k lot):
+#   count     -- number of spots, in id order
+#   ids       -- runs [[first id, length], ...]; a freshly provisioned lot is a single run
+#   prefix + index -- spot_number = prefix + str(n), n in runs like ids ("LOT-" + 1..N);
+#               lots whose numbers don't follow that (the archive's renamed ones) send
+#               spot_numbers as a plain list instead
+#   occupied  -- bitset, bit i (LSB first within each byte) = spot i is occupied, base64
+# ?format=grid-msgpack / Accept: GRID_MSGPACK returns the same structure as MessagePack with the
+# bitset as raw bytes. msgpack is in requirements.txt; an install without it answers 406 for that variant.
+# benchmarks/spot_grid.py measures encode time and bytes against the plain JSON list.
+
+GRID_JSON = 'application/vnd.parking.grid+json'
+GRID_MSGPACK = 'application/vnd.parking.grid+msgpack'
+
+_NUMBER = re.compile(r'^(.*?)([1-9][0-9]*|0)$')
+
+
+def _runs(values):
+    """[3, 4, 5, 9, 10] -> [[3, 3], [9, 2]] (runs of +1 steps)."""
+    if isinstance(values, range) and values.step == 1:
+        return [[values.start, len(values)]] if len(values) else []
+    if len(values) and values[-1] - values[0] == len(values) - 1 and values == list(range(values[0], values[-1] + 1)):
+        return [[values[0], len(values)]]  # the usual case, compared in C
+    runs = []
+    for value in values:
+        if runs and runs[-1][0] + runs[-1][1] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+    return runs
+
+
+def _split_numbers(numbers):
+    """(prefix, [n, ...]) when every spot number is prefix + n, else None."""
+    if not numbers:
+        return '', []
+    match = _NUMBER.match(numbers[0] or '')
+    if not match:
+        return None
+    prefix = match.group(1)
+    first = int(match.group(2))
+    index = range(first, first + len(numbers))
+    # the usual case (prefix-1..prefix-N in order), checked as one string compare
+    if '\0'.join(numbers) == prefix + ('\0' + prefix).join(map(str, index)):
+        return prefix, index
+    cut = len(prefix)
+    index = []
+    for number in numbers:
+        tail = number[cut:] if number and number.startswith(prefix) else ''
+        if not tail.isdigit() or (tail != '0' and tail[0] == '0'):
+            return None
+        index.append(int(tail))
+    return prefix, index
+
+
+_BITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def _bitset(flags):
+    # "0101.." -> int (base 2 is a linear-time parse) -> little-endian bytes, no per-bit Python loop
+    if not flags:
+        return b''
+    digits = bytes(map(bool, reversed(flags))).translate(_BITS)
+    return int(digits, 2).to_bytes((len(flags) + 7) // 8, 'little')
+
+
+def encode_spots(ids, numbers, occupied, binary=False):
+    """
+    Parallel lists (already in id order) -> grid dict. binary=True keeps the bitset as bytes
+    (MessagePack), otherwise it's base64 text.
+    """
+    bitset = _bitset(occupied)
+    grid = {
+        'count': len(ids),
+        'ids': _runs(ids),
+        'occupied': bitset if binary else base64.b64encode(bitset).decode(),
+    }
+    split = _split_numbers(numbers)
+    if split is None:
+        grid['spot_numbers'] = list(numbers)
+    else:
+        grid['prefix'], index = split
+        grid['index'] = _runs(index)
+    return grid
+
+
+def decode_spots(grid):
+    """Inverse of encode_spots -> [{id, spot_number, is_occupied}] (used by the benchmark / clients)."""
+    ids = [first + k for first, length in grid['ids'] for k in range(length)]
+    if 'spot_numbers' in grid:
+        numbers = grid['spot_numbers']
+    else:
+        numbers = [f"{grid['prefix']}{first + k}" for first, length in grid['index'] for k in range(length)]
+    bitset = grid['occupied']
+    if isinstance(bitset, str):
+        bitset = base64.b64decode(bitset)
+    return [
+        {'id': spot_id, 'spot_number': number, 'is_occupied': bool(bitset[pos >> 3] >> (pos & 7) & 1)}
+        for pos, (spot_id, number) in enumerate(zip(ids, numbers))
+    ]
+
+
+def grid_format():
+    """None (plain JSON objects), 'json' or 'msgpack', from ?format= or the Accept header."""
+    requested = request.args.get('format')
+    if requested == 'grid':
+        return 'json'
+    if requested == 'grid-msgpack':
+        return 'msgpack'
+    accept = request.accept_mimetypes
+    if accept.best in (GRID_JSON, GRID_MSGPACK):
+        return 'json' if accept.best == GRID_JSON else 'msgpack'
+    return None
+
+
+def grid_response(payload, fmt, status=200):
+    if fmt == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            return jsonify({'message': 'MessagePack is not available on this server'}), 406
+        return Response(msgpack.packb(payload, use_bin_type=True), status=status, mimetype=GRID_MSGPACK)
+    return jsonify(payload), status
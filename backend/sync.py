@@ -0,0 +1,185 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event, select, insert, update, delete, func, literal, and_, or_
+from sqlalchemy.orm import Session
+from models.models import db, ParkingLot, ParkingSpot, SyncState, SyncChange, SyncTombstone
+
+# Notes to me:
+# Delta sync for GET /parking-lots?since=N -- the admin dashboard used to pull every lot with every
+# spot on each poll. Every TRANSACTION that writes lots/spots gets a change version: the id of a new
+# SyncChange row (autoincrement, no shared row to lock -- writers on different lots don't wait on
+# each other). The value lives in session.info until commit/rollback. Every written lot/spot row
+# carries it in change_version, every deleted one leaves a SyncTombstone with it.
+#  - ORM writes are stamped by the before_flush hook below, automatically.
+#  - Core writes (provisioning.py, archive.py, repair_archive) stamp change_version() themselves
+#    and call tombstone_spots() before deleting.
+# Versions are handed out in one order and committed in another, so readers don't stop at the newest
+# version but at the watermark: just below the oldest version whose writer is still running. On
+# server databases the SyncChange row is committed right away (done=False) and the writer flips it to
+# done in its own transaction; a rollback flips it from the side. Rows left open longer than
+# OPEN_TIMEOUT_SECONDS (crashed worker) no longer hold readers back. SQLite has one writer at a time,
+# so there the row is simply inserted done inside the writer's transaction.
+# Tombstones older than SYNC_TOMBSTONE_DAYS are pruned; clients behind that get full_resync.
+
+log = logging.getLogger(__name__)
+
+STATE_ID = 1
+OPEN_TIMEOUT_SECONDS = 600
+
+
+def _single_writer(bind):
+    """SQLite: one writer at a time, so versions commit in the order they are handed out."""
+    return bind.dialect.name == 'sqlite'
+
+
+def change_version(session=None):
+    """This transaction's change version (allocated on first use)."""
+    session = session or db.session
+    version = session.info.get('change_version')
+    if version is None:
+        # Core statements: no autoflush (this also runs inside before_flush)
+        table = SyncChange.__table__
+        bind = session.get_bind()
+        now = datetime.utcnow()
+        if _single_writer(bind):
+            version = session.execute(insert(table).values(done=True, created_at=now)).inserted_primary_key[0]
+        else:
+            with bind.begin() as conn:
+                version = conn.execute(insert(table).values(done=False, created_at=now)).inserted_primary_key[0]
+            session.execute(update(table).where(table.c.id == version).values(done=True))
+            session.info['change_version_open'] = version
+        session.info['change_version'] = version
+    return version
+
+
+def current_state():
+    """(watermark: every version up to it is committed or gone, oldest `since` the tombstones still cover)."""
+    changes = SyncChange.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=OPEN_TIMEOUT_SECONDS)
+    # one statement = one snapshot for the newest and the oldest open version
+    newest, oldest_open, tombstones_from = db.session.execute(select(
+        select(func.max(changes.c.id)).scalar_subquery(),
+        select(func.min(changes.c.id))
+        .where(changes.c.done.is_(False), changes.c.created_at > cutoff).scalar_subquery(),
+        select(SyncState.tombstones_from).where(SyncState.id == STATE_ID).scalar_subquery(),
+    )).one()
+    version = oldest_open - 1 if oldest_open is not None else newest or 0
+    return version, tombstones_from or 0
+
+
+def tombstone_spots(*where):
+    """Core path: record the spots matching `where` as deleted (call right before the DELETE)."""
+    version = change_version()
+    db.session.execute(
+        insert(SyncTombstone.__table__).from_select(
+            ['kind', 'entity_id', 'change_version', 'deleted_at'],
+            select(literal('spot'), ParkingSpot.id, literal(version), literal(datetime.utcnow()))
+            .where(*where),
+        )
+    )
+
+
+def changes_since(since):
+    """
+    Lots/spots written after `since` plus deletions. Returns (version, lots, spots, deleted) where
+    lots/spots are ORM rows and deleted = {'lots': [...], 'spots': [...]}, or None when the client has
+    to resync from scratch (version 0, tombstones already pruned, or a version from another database).
+    """
+    version, tombstones_from = current_state()
+    if since <= 0 or since < tombstones_from or since > version:
+        return None
+
+    spots = (
+        ParkingSpot.query
+        .filter(ParkingSpot.change_version > since, ParkingSpot.change_version <= version)
+        .all()
+    )
+    touched = {spot.lot_id for spot in spots}
+    # a lot is sent again when its spots changed too (its free-spot count moved with them)
+    lots = ParkingLot.query.filter(or_(
+        and_(ParkingLot.change_version > since, ParkingLot.change_version <= version),
+        ParkingLot.id.in_(touched),
+    )).all()
+
+    deleted = {'lots': [], 'spots': []}
+    rows = db.session.execute(
+        select(SyncTombstone.kind, SyncTombstone.entity_id)
+        .where(SyncTombstone.change_version > since, SyncTombstone.change_version <= version)
+    )
+    for kind, entity_id in rows:
+        deleted[kind + 's'].append(entity_id)
+    return version, lots, spots, deleted
+
+
+def prune_tombstones(days):
+    """Drop tombstones older than `days`; clients synced before them get full_resync. Commits."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    newest = db.session.execute(
+        select(func.max(SyncTombstone.change_version)).where(SyncTombstone.deleted_at < cutoff)
+    ).scalar()
+    if newest is None:
+        return 0
+    removed = db.session.execute(
+        delete(SyncTombstone).where(SyncTombstone.change_version <= newest)
+    ).rowcount
+    table = SyncState.__table__
+    bumped = db.session.execute(
+        update(table).where(table.c.id == STATE_ID, table.c.tombstones_from < newest)
+        .values(tombstones_from=newest)
+    ).rowcount
+    if not bumped and db.session.get(SyncState, STATE_ID) is None:
+        db.session.execute(insert(table).values(id=STATE_ID, version=0, tombstones_from=newest))
+    db.session.commit()
+    return removed
+
+
+def prune_change_log():
+    """Drop SyncChange rows readers no longer need (all but the newest, open ones once expired). Commits."""
+    changes = SyncChange.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=OPEN_TIMEOUT_SECONDS)
+    newest = db.session.execute(select(func.max(changes.c.id))).scalar()
+    if newest is None:
+        return 0
+    # the newest row stays: autoincrement must never hand its id out again
+    removed = db.session.execute(
+        delete(changes).where(changes.c.id < newest, or_(changes.c.done.is_(True), changes.c.created_at < cutoff))
+    ).rowcount
+    db.session.commit()
+    return removed
+
+
+def _stamp_changes(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, (ParkingLot, ParkingSpot)):
+            obj.change_version = change_version(session)
+    for obj in session.dirty:
+        if isinstance(obj, (ParkingLot, ParkingSpot)) and session.is_modified(obj, include_collections=False):
+            obj.change_version = change_version(session)
+    for obj in session.deleted:
+        if isinstance(obj, (ParkingLot, ParkingSpot)) and obj.id is not None:
+            kind = 'lot' if isinstance(obj, ParkingLot) else 'spot'
+            session.add(SyncTombstone(kind=kind, entity_id=obj.id, change_version=change_version(session)))
+
+
+def _end_transaction(session):
+    session.info.pop('change_version', None)
+    session.info.pop('change_version_open', None)
+
+
+def _abandon_version(session):
+    """Rolled back: the version's writer is gone, don't let readers wait for it."""
+    version = session.info.get('change_version_open')
+    _end_transaction(session)
+    if version is None:
+        return
+    table = SyncChange.__table__
+    try:
+        with session.get_bind().begin() as conn:
+            conn.execute(update(table).where(table.c.id == version).values(done=True))
+    except Exception:
+        log.exception("could not close change version %s, it expires after %ss", version, OPEN_TIMEOUT_SECONDS)
+
+
+event.listen(Session, 'before_flush', _stamp_changes)
+event.listen(Session, 'after_commit', _end_transaction)
+event.listen(Session, 'after_rollback', _abandon_version)
@@ -1,85 +1,134 @@
 from app import celery
 from models.models import User, Reservation
 from flask_mail import Message
-import csv
-import io
 from datetime import datetime
-from sqlalchemy import func
 
 # JOB A: Daily Reminder
+# Picks candidates with one anti-join query and fans them out in chunks (see reminders.py).
 @celery.task
 def send_daily_reminder():
     """Check if user has no active reservation to remind user."""
     # Imported locally to avoid circular dependency
-    from app import app, mail 
+    from app import app
+    from reminders import reminder_candidates
     with app.app_context():
-        users = User.query.all()
-        count = 0
-        for user in users:
-            if user.has_role('admin'): continue
+        batches = users = 0
+        for user_ids in reminder_candidates(app.config['REMINDER_WINDOW_HOURS'], app.config['REMINDER_CHUNK_SIZE']):
+            send_reminder_batch.delay(user_ids)
+            batches += 1
+            users += len(user_ids)
+        return f"Daily Reminders queued for {users} users in {batches} batches."
 
-            # Check for active spot
-            has_active = Reservation.query.filter_by(user_id=user.id, active=True).first()
-            
-            if not has_active:
-                msg = Message("Need Parking Tomorrow?", recipients=[user.email])
-                msg.body = f"Hi {user.username},\n\nYou don't have a spot booked. Log in now to reserve one!"
-                mail.send(msg)
-                count += 1
-        return f"Daily Reminders sent to {count} users."
+@celery.task
+def send_reminder_batch(user_ids):
+    """Mail one chunk of reminder candidates over a single SMTP connection."""
+    from app import app, mail
+    from reminders import claim_reminders, unclaim_reminders
+    from dbprofile import immediate_transactions
+    with app.app_context():
+        # claim = read + write in one transaction: take the SQLite write lock up front
+        with immediate_transactions():
+            claimed = claim_reminders(user_ids, app.config['REMINDER_WINDOW_HOURS'])
+        failed = []
+        if claimed:
+            try:
+                with mail.connect() as conn:
+                    for user_id, email, username in claimed:
+                        msg = Message("Need Parking Tomorrow?", recipients=[email])
+                        msg.body = f"Hi {username},\n\nYou don't have a spot booked. Log in now to reserve one!"
+                        try:
+                            conn.send(msg)
+                        except Exception:
+                            app.logger.exception("Reminder to %s failed", email)
+                            failed.append(user_id)
+            except Exception:
+                # no SMTP connection at all: give the whole chunk back to the next run
+                unclaim_reminders([row[0] for row in claimed])
+                raise
+        unclaim_reminders(failed)
+        return f"Daily Reminders sent to {len(claimed) - len(failed)} users."
 
 # JOB B: Monthly Activity Report
+# Aggregates in SQL over a start_time range (see reports.py). Past MONTHLY_REPORT_INLINE_ROWS
+# bookings the detail list goes into a gzipped CSV attachment instead of the HTML.
 @celery.task
 def generate_monthly_report():
     """Send HTML report of current month's bookings to Admin."""
     from app import app, mail 
+    from reports import month_range, month_totals, revenue_by_lot, revenue_by_day, detail_rows, render_report, DETAIL_HEADER
+    from exports import iter_csv, iter_gzip, spool
     with app.app_context():
         now = datetime.utcnow()
-        # Filter for current month
-        reservations = Reservation.query.filter(
-            func.extract('month', Reservation.start_time) == now.month,
-            func.extract('year', Reservation.start_time) == now.year
-        ).all()
-
-        total_revenue = sum(r.total_cost for r in reservations)
-        
-        # HTML Content
-        html = f"<h1>Monthly Report: {now.strftime('%B %Y')}</h1>"
-        html += f"<p>Total Revenue: <strong>₹{total_revenue}</strong></p><ul>"
-        for r in reservations:
-            html += f"<li>User: {r.user.email} | Spot: {r.spot.spot_number} | Cost: ₹{r.total_cost}</li>"
-        html += "</ul>"
+        start, end = month_range(now)
+        totals = month_totals(start, end)
+        by_lot = revenue_by_lot(start, end)
+        by_day = revenue_by_day(start, end)
 
         msg = Message(f"Monthly Report - {now.strftime('%B')}", recipients=['admin@parking.com'])
-        msg.html = html
+        if totals[0] > app.config['MONTHLY_REPORT_INLINE_ROWS']:
+            filename = f"bookings_{start:%Y_%m}.csv.gz"
+            with spool(iter_gzip(iter_csv(detail_rows(start, end), DETAIL_HEADER))) as detail:
+                msg.attach(filename, "application/gzip", detail.read())
+            msg.html = render_report(now, totals, by_lot, by_day, attached=filename)
+        else:
+            msg.html = render_report(now, totals, by_lot, by_day, details=detail_rows(start, end))
         mail.send(msg)
         return "Monthly Report Sent"
 
 # JOB C: Export CSV (Async)
+# Rows are streamed (exports.py) into a spooled temp file: RAM up to 1MB, disk after.
+# Big exports are attached gzipped so the mail itself stays reasonable.
+GZIP_ATTACHMENT_OVER = 1024 * 1024
+
 @celery.task
 def export_user_csv(user_email):
     """Generate CSV of user history and email it."""
     from app import app, mail 
+    from exports import history_rows, iter_csv, iter_gzip, spool
     with app.app_context():
         user = User.query.filter_by(email=user_email).first()
         if not user: return "User Not Found"
 
         # Generate CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Reservation ID', 'Lot', 'Spot', 'Start', 'End', 'Cost', 'Status'])
+        with spool(iter_csv(history_rows(user.id))) as output:
+            size = output.seek(0, 2)
+            output.seek(0)
 
-        reservations = Reservation.query.filter_by(user_id=user.id).all()
-        for r in reservations:
-            status = "Active" if r.active else "Completed"
-            writer.writerow([r.id, r.spot.parking_lot.name, r.spot.spot_number, r.start_time, r.end_time, r.total_cost, status])
-        
-        output.seek(0)
+            if size > GZIP_ATTACHMENT_OVER:
+                chunks = iter(lambda: output.read(64 * 1024), b'')
+                filename, content_type = "parking_history.csv.gz", "application/gzip"
+                data = b''.join(iter_gzip(chunks))
+            else:
+                filename, content_type = "parking_history.csv", "text/csv"
+                data = output.read()
 
         # Send Email
         msg = Message("Your Parking History Export", recipients=[user_email])
         msg.body = "Please find the CSV export attached in this email."
-        msg.attach("parking_history.csv", "text/csv", output.getvalue())
+        msg.attach(filename, content_type, data)
         
         mail.send(msg)
-        return f"CSV sent to {user_email}"
\ No newline at end of file
+        return f"CSV sent to {user_email}"
+
+# JOB D: Rebuild analytics rollups
+@celery.task
+def backfill_daily_stats():
+    """Rebuild the (lot, day) analytics rollups from the full reservation history."""
+    from app import app
+    from rollups import backfill_daily_stats as rebuild
+    from cache import lot_cache
+    with app.app_context():
+        seen = rebuild()
+        lot_cache.bump_all()
+        return f"Daily stats rebuilt from {seen} reservations."
+
+# JOB E: Prune delta-sync tombstones
+@celery.task
+def prune_sync_tombstones():
+    """Drop tombstones older than SYNC_TOMBSTONE_DAYS (clients further behind get a full resync) and old change log rows."""
+    from app import app
+    from sync import prune_tombstones, prune_change_log
+    with app.app_context():
+        removed = prune_tombstones(app.config['SYNC_TOMBSTONE_DAYS'])
+        versions = prune_change_log()
+        return f"{removed} sync tombstones and {versions} change log rows pruned."
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask_login import LoginManager  # noqa: E402
+from models.models import db, User, ParkingLot  # noqa: E402
+from dbprofile import engine_options, engine_profile  # noqa: E402
+
+
+@pytest.fixture
+def bare_app(tmp_path):
+    """The admin + user blueprints on an empty SQLite file (no tables), production engine profile."""
+    from routes.admin import admin_bp
+    from routes.users import user_bp
+    uri = 'sqlite:///' + str(tmp_path / 'parking.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    LoginManager(app).user_loader(lambda user_id: db.session.get(User, int(user_id)))
+    app.register_blueprint(admin_bp, url_prefix='/api')
+    app.register_blueprint(user_bp, url_prefix='/api')
+    with app.app_context():
+        engine_profile.configure_engine(db.engine)
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def app(bare_app):
+    """bare_app with the current schema."""
+    db.create_all()
+    return bare_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_users(count):
+    users = [
+        User(email=f'user{n}@test', username=f'user{n}', password='x', fs_uniquifier=f'token-{n}')
+        for n in range(count)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def add_lot(client, capacity, name='Lot'):
+    response = client.post('/api/parking-lot', json={
+        'name': name, 'address': 'x', 'pin_code': '000000',
+        'capacity': capacity, 'price_per_hour': 10,
+    })
+    assert response.status_code == 201, response.get_json()
+    return ParkingLot.query.filter_by(name=name).one().id
@@ -0,0 +1,47 @@
+from sqlalchemy import event
+from models.models import db
+from conftest import add_users, add_lot
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def _spots_queries(client, lot_id, expected_spots):
+    db.session.remove()  # nothing from the setup in the identity map
+    with QueryCounter(db.engine) as counter:
+        response = client.get(f'/api/parking-lot/{lot_id}/spots')
+    assert response.status_code == 200
+    spots = response.get_json()
+    assert len(spots) == expected_spots
+    return counter.count, spots
+
+
+def test_get_lot_spots_query_count_does_not_grow_with_lot_size(client):
+    add_users(3)
+    small = add_lot(client, 5, name='Small')
+    large = add_lot(client, 500, name='Large')
+    for lot_id in (small, large):
+        for n in range(3):
+            assert client.post('/api/reserve', json={'lot_id': lot_id, 'user_email': f'user{n}@test'}).status_code == 201
+
+    small_queries, small_spots = _spots_queries(client, small, 5)
+    large_queries, large_spots = _spots_queries(client, large, 500)
+
+    assert small_queries == large_queries
+    for spots in (small_spots, large_spots):
+        booked = [s for s in spots if s['reservation']]
+        assert len(booked) == 3
+        assert {s['reservation']['user_email'] for s in booked} == {'user0@test', 'user1@test', 'user2@test'}
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import inspect, text
+from models.models import db
+from migrations import MIGRATIONS, run_migrations, check_query_plans
+
+
+def test_fresh_database_migrates_and_hot_queries_use_indexes(app):
+    assert run_migrations() == [migration_id for migration_id, _ in MIGRATIONS]
+    assert run_migrations() == []
+    with db.engine.connect() as conn:
+        done = {row[0] for row in conn.execute(text('SELECT id FROM schema_migrations'))}
+    assert done == {migration_id for migration_id, _ in MIGRATIONS}
+
+    assert check_query_plans() == {}
+
+
+# the schema a parking.db from before any migration has (models.py of the first release)
+BASELINE_SCHEMA = """
+CREATE TABLE role (id INTEGER PRIMARY KEY, name VARCHAR(80) UNIQUE, description VARCHAR(255));
+CREATE TABLE user (
+    id INTEGER PRIMARY KEY, email VARCHAR(255) NOT NULL UNIQUE, username VARCHAR(255) UNIQUE,
+    password VARCHAR(255) NOT NULL, active BOOLEAN, fs_uniquifier VARCHAR(255) NOT NULL UNIQUE
+);
+CREATE TABLE roles_users (user_id INTEGER REFERENCES user (id), role_id INTEGER REFERENCES role (id));
+CREATE TABLE parking_lot (
+    id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE, address VARCHAR(255) NOT NULL,
+    pin_code VARCHAR(10) NOT NULL, price_per_hour FLOAT NOT NULL, capacity INTEGER NOT NULL
+);
+CREATE TABLE parking_spot (
+    id INTEGER PRIMARY KEY, spot_number VARCHAR(20) NOT NULL, is_occupied BOOLEAN,
+    lot_id INTEGER NOT NULL REFERENCES parking_lot (id)
+);
+CREATE TABLE reservation (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+    spot_id INTEGER NOT NULL REFERENCES parking_spot (id), start_time DATETIME NOT NULL,
+    end_time DATETIME, total_cost FLOAT, active BOOLEAN
+);
+INSERT INTO parking_lot (id, name, address, pin_code, price_per_hour, capacity)
+    VALUES (1, 'Main', 'x', '000000', 10, 2), (2, 'Deleted - Archived History', 'x', '000000', 0, 0);
+INSERT INTO parking_spot (id, spot_number, is_occupied, lot_id) VALUES (1, 'MAI-1', 0, 1), (2, 'MAI-2', 1, 1);
+"""
+
+
+@pytest.mark.parametrize('create_all_first', [False, True], ids=['migrations only', 'startup order'])
+def test_existing_baseline_database_is_upgraded_in_place(bare_app, create_all_first):
+    with db.engine.begin() as conn:
+        for statement in BASELINE_SCHEMA.split(';'):
+            if statement.strip():
+                conn.exec_driver_sql(statement)
+    if create_all_first:
+        db.create_all()  # what create_initial_data does first: adds the missing tables only
+
+    applied = run_migrations()
+    assert applied == [migration_id for migration_id, _ in MIGRATIONS]
+    assert run_migrations() == []
+
+    schema = inspect(db.engine)
+    columns = {table: {c['name'] for c in schema.get_columns(table)} for table in ('user', 'parking_lot', 'parking_spot')}
+    assert 'last_reminded_at' in columns['user']
+    assert {'is_archive', 'change_version'} <= columns['parking_lot']
+    assert 'change_version' in columns['parking_spot']
+    assert schema.has_table('sync_change')
+
+    indexes = {index['name'] for table in schema.get_table_names() for index in schema.get_indexes(table)}
+    assert {
+        'ix_reservation_spot_active', 'ix_reservation_user_start', 'ix_reservation_start_time',
+        'ix_reservation_end_time', 'ix_parking_spot_lot_occupied', 'ix_parking_lot_is_archive',
+        'ix_parking_lot_change_version', 'ix_parking_spot_change_version', 'ix_sync_change_open',
+    } <= indexes
+
+    with db.engine.connect() as conn:
+        done = {row[0] for row in conn.execute(text('SELECT id FROM schema_migrations'))}
+        archive = conn.execute(text('SELECT id FROM parking_lot WHERE is_archive = 1')).scalars().all()
+        versions = conn.execute(text('SELECT DISTINCT change_version FROM parking_spot')).scalars().all()
+    assert done == {migration_id for migration_id, _ in MIGRATIONS}
+    assert archive == [2]
+    assert versions == [0]
+
+    if create_all_first:
+        assert check_query_plans() == {}
@@ -0,0 +1,73 @@
+import random
+import threading
+
+from sqlalchemy import func
+from models.models import db, ParkingSpot, Reservation, LotOccupancy
+from conftest import add_users, add_lot
+
+# a bounded version of benchmarks/reserve_stress.py: a few threads, a fixed number of operations each,
+# lots small enough that they run full and the conditional claims collide
+THREADS = 6
+OPERATIONS = 30
+LOTS = 2
+SPOTS_PER_LOT = 6
+USERS = 10
+
+
+def _client_loop(app, seed, errors):
+    rng = random.Random(seed)
+    client = app.test_client()
+    mine = []
+    for _ in range(OPERATIONS):
+        if mine and (rng.random() < 0.45 or len(mine) > 4):
+            response = client.post('/api/release-spot', json={'reservation_id': mine.pop(rng.randrange(len(mine)))})
+            if response.status_code != 200:
+                errors.append(('release', response.status_code))
+            continue
+        response = client.post('/api/reserve', json={
+            'lot_id': rng.randrange(1, LOTS + 1),
+            'user_email': f'user{rng.randrange(USERS)}@test',
+            'quantity': rng.choice((1, 1, 2, 3)),
+        })
+        if response.status_code == 201:
+            mine.extend(r['reservation_id'] for r in response.get_json()['reservations'])
+        elif response.status_code not in (400, 409):  # lot full / lost every claim
+            errors.append(('reserve', response.status_code))
+
+
+def test_concurrent_reserve_and_release_keep_spots_consistent(app, client):
+    add_users(USERS)
+    for n in range(LOTS):
+        add_lot(client, SPOTS_PER_LOT, name=f'Lot {n}')
+    db.session.remove()
+
+    errors = []
+    threads = [threading.Thread(target=_client_loop, args=(app, n, errors)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads)
+    assert errors == []
+
+    # one active reservation per spot
+    doubles = (
+        db.session.query(Reservation.spot_id)
+        .filter(Reservation.active.is_(True))
+        .group_by(Reservation.spot_id)
+        .having(func.count() > 1)
+        .all()
+    )
+    assert doubles == []
+
+    # occupied flags == spots with an active reservation
+    occupied = {row[0] for row in db.session.query(ParkingSpot.id).filter(ParkingSpot.is_occupied.is_(True))}
+    booked = {row[0] for row in db.session.query(Reservation.spot_id).filter(Reservation.active.is_(True))}
+    assert occupied == booked
+
+    # per-lot counters == spot rows
+    for row in LotOccupancy.query.all():
+        taken = db.session.query(func.count()).filter(
+            ParkingSpot.lot_id == row.lot_id, ParkingSpot.is_occupied.is_(True)
+        ).scalar()
+        assert (row.occupied_spots, row.free_spots) == (taken, SPOTS_PER_LOT - taken), row.lot_id
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+import sync
+from models.models import db, SyncChange
+from sync import change_version, current_state
+
+
+def watermark():
+    db.session.rollback()  # a new read transaction, like a new request
+    return current_state()[0]
+
+
+def test_sqlite_versions_are_visible_once_committed(app):
+    writer = Session(db.engine)
+    version = change_version(writer)
+    assert watermark() < version
+    writer.commit()
+    assert watermark() == version
+    assert change_version(writer) == version + 1
+    writer.rollback()
+    assert watermark() == version
+
+
+def test_open_versions_hold_the_watermark_back(app, monkeypatch):
+    # the server-database path: the version is committed open, the writer closes it with its commit
+    monkeypatch.setattr(sync, '_single_writer', lambda bind: False)
+    writer = Session(db.engine)
+
+    first = change_version(writer)
+    assert watermark() == first - 1
+    writer.commit()
+    assert watermark() == first
+
+    second = change_version(writer)
+    assert watermark() == first
+    writer.rollback()  # abandoned: closed from the side
+    assert watermark() == second
+
+    # left open by a worker that died mid-transaction: only holds readers back until it expires
+    stale = SyncChange(done=False, created_at=datetime.utcnow() - timedelta(seconds=sync.OPEN_TIMEOUT_SECONDS + 1))
+    db.session.add(stale)
+    db.session.commit()
+    assert watermark() == stale.id
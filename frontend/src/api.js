@@ -1,5 +1,10 @@
 const BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:5000/api';
 
+// Last ETag + body per request (method + url + body), so polls can send If-None-Match
+// and reuse the body they already have when the server answers 304 Not Modified.
+const etagCache = new Map();
+const ETAG_CACHE_LIMIT = 50;
+
 export async function apiFetch(path, options = {}) {
   const url = `${BASE_URL}${path}`;
 
@@ -15,11 +20,21 @@ export async function apiFetch(path, options = {}) {
     headers['Content-Type'] = 'application/json';
   }
 
-  // if token present, Attach Authorization header 
+  // if token present, Attach Authorization header
   if (token) {
     headers['Authorization'] = `Bearer ${token}`;
   }
 
+  // conditional request if we have seen this exact request before (same token too)
+  const method = (options.method || 'GET').toUpperCase();
+  const cacheKey = typeof options.body === 'string' || !options.body
+    ? `${token || ''} ${method} ${url} ${options.body || ''}`
+    : null;
+  const cached = cacheKey ? etagCache.get(cacheKey) : null;
+  if (cached && !headers['If-None-Match']) {
+    headers['If-None-Match'] = cached.etag;
+  }
+
   const finalOptions = {
     // send cookies
     credentials: 'include',
@@ -27,5 +42,66 @@ export async function apiFetch(path, options = {}) {
     headers
   };
 
-  return fetch(url, finalOptions);
+  const res = await fetch(url, finalOptions);
+
+  if (res.status === 304 && cached) {
+    // unchanged: hand the caller the body we already have, as a normal 200
+    return new Response(cached.body, { status: 200, headers: { 'Content-Type': cached.contentType } });
+  }
+
+  const etag = res.headers.get('ETag');
+  if (cacheKey && res.ok && etag) {
+    const body = await res.clone().text();
+    etagCache.delete(cacheKey);
+    etagCache.set(cacheKey, { etag, body, contentType: res.headers.get('Content-Type') || 'application/json' });
+    if (etagCache.size > ETAG_CACHE_LIMIT) {
+      etagCache.delete(etagCache.keys().next().value);
+    }
+  }
+
+  return res;
+}
+
+// Live occupancy changes (Server-Sent Events, /api/stream/occupancy).
+// The browser reconnects by itself and sends Last-Event-ID, so missed events are replayed;
+// "reset" means the server couldn't replay them -> reload everything once.
+// Returns a close() function, or null when EventSource isn't available (keep polling then).
+export function openOccupancyStream({ onEvent, onReset, onOpen, onError } = {}) {
+  if (typeof EventSource === 'undefined') return null;
+
+  const source = new EventSource(`${BASE_URL}/stream/occupancy`, { withCredentials: true });
+  source.addEventListener('open', () => onOpen && onOpen());
+  source.addEventListener('error', () => onError && onError());
+  source.addEventListener('reset', () => onReset && onReset());
+  source.addEventListener('occupancy', (e) => {
+    try {
+      onEvent && onEvent(JSON.parse(e.data));
+    } catch (err) {
+      console.error('Bad occupancy event', err);
+    }
+  });
+  return () => source.close();
+}
+
+// Compact spot grid (?format=grid, backend/spotgrid.py) -> [{id, spot_number, is_occupied}] in id order.
+export function decodeSpotGrid(grid) {
+  const ids = [];
+  grid.ids.forEach(([first, length]) => {
+    for (let k = 0; k < length; k++) ids.push(first + k);
+  });
+
+  let numbers = grid.spot_numbers;
+  if (!numbers) {
+    numbers = [];
+    grid.index.forEach(([first, length]) => {
+      for (let k = 0; k < length; k++) numbers.push(`${grid.prefix}${first + k}`);
+    });
+  }
+
+  const bits = atob(grid.occupied);
+  return ids.map((id, pos) => ({
+    id,
+    spot_number: numbers[pos],
+    is_occupied: ((bits.charCodeAt(pos >> 3) >> (pos & 7)) & 1) === 1
+  }));
 }